@@ -6,6 +6,8 @@ from flask_jwt_extended import JWTManager
 # from config import Config
 from datetime import timedelta
 import os
+import time
+import click
 # from redis_client import redis_client
 import sys
 from config2 import Config2
@@ -69,7 +71,7 @@ CORS(
         "http://localhost:5173", 
         "http://127.0.0.1:5173"
     ],
-    allow_headers=["Content-Type", "Authorization", "Cache-Control", "Pragma"],
+    allow_headers=["Content-Type", "Authorization", "Cache-Control", "Pragma", "Idempotency-Key"],
     expose_headers=["Set-Cookie"],
     methods=["GET", "POST", "PUT", "DELETE"]
 )
@@ -93,17 +95,57 @@ from tickets import (
    
     TicketListResource, 
     UserTicketsResource, 
-    TicketVerificationResource
+    TicketVerificationResource,
+    TicketQRCodeResource
    
   
 )
-from payments import PaymentResource, PaymentListResource
+from payments import PaymentResource, PaymentListResource, cleanup_queue, schedule_cleanup
+from inventory import sweep_queue, schedule_sweep, reconcile_queue, schedule_reconcile, reconcile_inventory
+from qr_cache import prerender_queue
 from categories import CategoryResource, CategoryListResource
 from discount_codes import DiscountCodeResource, DiscountCodeListResource, ValidateDiscountCodeResource
 from organizer import OrganizerListResource, OrganizerResource, UserOrganizerResource
 
-from cash import  TicketPurchaseResource, MpesaCallbackResource
-  
+from cash import  TicketPurchaseResource, MpesaCallbackResource, verification_queue, callback_queue, \
+    email_queue, email_relay_queue, schedule_email_relay
+from mailings import EventMailingListResource, EventMailingResource, mailing_queue, mailing_relay_queue, \
+    schedule_mailing_relay
+
+def start_background_workers():
+    """Start this process's job queue workers: payment verifications, callbacks,
+    ticket emails, QR renders and mailings queued before a restart, plus the
+    periodic outbox and mailing relays, pending tickets cleanup, expired
+    holds sweep and inventory reconcile. Run by `python app.py` and `flask
+    run-workers`, not on import, so other commands and importers don't start
+    them. Returns False without Redis."""
+    if not app.redis_available:
+        return False
+    verification_queue.start()
+    callback_queue.start()
+    email_queue.start()
+    schedule_email_relay()
+    email_relay_queue.start()
+    prerender_queue.start()
+    schedule_cleanup()
+    cleanup_queue.start()
+    schedule_sweep()
+    sweep_queue.start()
+    schedule_reconcile()
+    reconcile_queue.start()
+    mailing_queue.start()
+    schedule_mailing_relay()
+    mailing_relay_queue.start()
+    return True
+
+@click.command('run-workers')
+def run_workers():
+    """Run the background job queues until interrupted"""
+    if not start_background_workers():
+        raise click.ClickException("Redis is unavailable, the job queues need it")
+    click.echo("Job queue workers running, press Ctrl+C to stop")
+    while True:
+        time.sleep(3600)
 
 
 
@@ -127,6 +169,9 @@ api.add_resource(EventCategoriesResource, '/api/events/<string:event_id>/categor
 api.add_resource(FeaturedEventsResource, '/api/events/featured')
 api.add_resource(UserTicketsResource, '/api/users/<string:user_id>/tickets')
 api.add_resource(TicketVerificationResource, '/api/tickets/<string:ticket_id>/verify')
+api.add_resource(TicketQRCodeResource, '/api/tickets/<string:ticket_id>/qr')
+api.add_resource(EventMailingListResource, '/api/events/<string:event_id>/mailings')
+api.add_resource(EventMailingResource, '/api/events/<string:event_id>/mailings/<string:mailing_id>')
 
 # Update the ticket purchase endpoint to use event_id
 api.add_resource(TicketPurchaseResource, '/api/events/<string:event_id>/purchase')
@@ -161,8 +206,20 @@ api.add_resource(DevAdminResource, '/api/dev/make-admin')
 
 api.add_resource(StatsResource, '/api/stats')  
 
+from query_plans import check_query_plans
+from rollups import rebuild_stats_rollups
+from qr_cache import prerender_event_qrs
+app.cli.add_command(check_query_plans)
+app.cli.add_command(rebuild_stats_rollups)
+app.cli.add_command(prerender_event_qrs)
+app.cli.add_command(run_workers)
+app.cli.add_command(reconcile_inventory)
+
 
 
 
 if __name__ == '__main__':
+    # With the reloader, only in the child process that serves requests
+    if not Config2.DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(debug=Config2.DEBUG)
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Render time of the ticket email templates, per email.
+
+    python benchmarks/bench_email_templates.py [iterations]
+"""
+import os
+import sys
+import time
+import timeit
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_templates import TicketEmailTemplates
+
+def main(iterations=10000, repeat=5):
+    start = time.perf_counter()
+    templates = TicketEmailTemplates()
+    load_ms = (time.perf_counter() - start) * 1000
+
+    user = SimpleNamespace(first_name='Jane', last_name='Wanjiru', email='jane@example.com')
+    event = SimpleNamespace(
+        title='Nairobi Jazz Night',
+        start_datetime=datetime(2026, 12, 5, 19, 30),
+        location='Carnivore Grounds, Nairobi'
+    )
+    ticket = SimpleNamespace(event=event, quantity=2)
+
+    seconds = min(timeit.repeat(lambda: templates.render(user, ticket), number=iterations, repeat=repeat))
+    _, text, html = templates.render(user, ticket)
+
+    print(f"templates loaded in {load_ms:.1f} ms")
+    print(f"{seconds / iterations * 1e6:.1f} us per email, best of {repeat} x {iterations} "
+          f"({len(html)} bytes HTML, {len(text)} bytes text)")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -8,7 +8,7 @@ from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from email_service import send_email, mail
 from database import db
-from models import Ticket, Event, User, Attendee, Payment, TicketType
+from models import Ticket, Event, User, Attendee, Payment, TicketType, EmailOutbox
 from utils.response import success_response, error_response
 from flask_mail import Message
 from datetime import datetime, timedelta
@@ -22,12 +22,22 @@ import json
 from json.decoder import JSONDecodeError
 from flask import g
 import threading
+import uuid
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import set_committed_value
 from contextlib import contextmanager
 from app2 import app
+from redis_client import redis_client
+from inventory import ticket_inventory, InsufficientInventory, InventoryUnavailable
+from mpesa_gateway import mpesa_gateway
+from job_queue import DelayedJobQueue, StreamQueue
+from idempotency import idempotency_store, fingerprint, IdempotencyConflict
+from rollups import record_sales
+from qr_cache import qr_cache, ticket_qr_payload, prerender_ticket_qrs
+from email_templates import ticket_email_templates
+from mail_transport import smtp_pool
 
 from config import (
-    MPESA_BASE_URL, 
     MPESA_CONSUMER_KEY, 
     MPESA_CONSUMER_SECRET,
     MPESA_BUSINESS_SHORT_CODE,
@@ -41,25 +51,136 @@ from config import (
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def generate_access_token():
-    """Generate M-Pesa API access token"""
-    try:
-        endpoint = f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-        response = requests.get(
-            endpoint, 
-            auth=HTTPBasicAuth(MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET)
-        )
-        
-        if response.status_code != 200:
-            logger.error(f"Token generation failed: {response.text}")
-            raise Exception(f"Failed to fetch access token: {response.status_code}")
+# Tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 60
+TOKEN_CACHE_KEY = "mpesa:access_token"
+TOKEN_REFRESH_LOCK = "mpesa_token_refresh"
+
+class AccessTokenManager:
+    """Caches the M-Pesa OAuth token per process and in Redis, shared by all workers.
+
+    A token is reused until TOKEN_REFRESH_MARGIN seconds before it expires and
+    renewed in a background thread shortly before that. Refreshes are
+    single-flight: one thread per process (self._lock) and one worker across
+    processes (a Redis lock) fetch a new token, the others wait for it.
+    """
+    def __init__(self):
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self._background_refresh = None
+
+    def get_token(self, force_refresh=False):
+        """Return a valid token. force_refresh replaces the current one, e.g. after an auth error."""
+        token, expires_at = self._token, self._expires_at
+        if force_refresh:
+            return self._refresh(stale_token=token)
+        if self._is_valid(expires_at) and token:
+            if expires_at - time.time() < 2 * TOKEN_REFRESH_MARGIN:
+                self._refresh_in_background(token)
+            return token
+        return self._refresh(stale_token=None)
+
+    def _is_valid(self, expires_at):
+        return time.time() < expires_at - TOKEN_REFRESH_MARGIN
+
+    def _refresh_in_background(self, stale_token):
+        if self._background_refresh is not None and self._background_refresh.is_alive():
+            return
+        self._background_refresh = threading.Thread(target=self._refresh_quietly, args=(stale_token,), daemon=True)
+        self._background_refresh.start()
+
+    def _refresh_quietly(self, stale_token):
+        try:
+            self._refresh(stale_token)
+        except Exception as e:
+            logger.error(f"Background token refresh failed: {str(e)}")
+
+    def _refresh(self, stale_token):
+        """Replace stale_token, unless another thread or worker already did"""
+        with self._lock:
+            if self._token and self._token != stale_token and self._is_valid(self._expires_at):
+                return self._token
+
+            shared = self._load_shared()
+            if shared and shared[0] != stale_token:
+                token, expires_at = shared
+            elif redis_client.client is None:
+                token, expires_at = self._fetch()
+            elif redis_client.acquire_lock(TOKEN_REFRESH_LOCK, timeout=15):
+                try:
+                    token, expires_at = self._fetch()
+                    self._store_shared(token, expires_at)
+                finally:
+                    redis_client.release_lock(TOKEN_REFRESH_LOCK)
+            else:
+                # Another worker is fetching, wait for its token
+                token, expires_at = self._wait_for_shared(stale_token) or self._fetch()
+
+            self._token, self._expires_at = token, expires_at
+            return token
+
+    def _fetch(self):
+        """Fetch a new token from the OAuth endpoint. Returns (token, expires_at)."""
+        try:
+            response = mpesa_gateway.get(
+                "/oauth/v1/generate",
+                params={"grant_type": "client_credentials"},
+                auth=HTTPBasicAuth(MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET)
+            )
             
-        token = response.json().get("access_token")
-        logger.info("Access token generated successfully")
-        return token
-    except Exception as e:
-        logger.error(f"Access token generation error: {str(e)}")
-        raise
+            if response.status_code != 200:
+                logger.error(f"Token generation failed: {response.text}")
+                raise Exception(f"Failed to fetch access token: {response.status_code}")
+                
+            result = response.json()
+            logger.info("Access token generated successfully")
+            return result.get("access_token"), time.time() + int(result.get("expires_in", 3599))
+        except Exception as e:
+            logger.error(f"Access token generation error: {str(e)}")
+            raise
+
+    def _load_shared(self):
+        try:
+            cached = redis_client.client.get(TOKEN_CACHE_KEY) if redis_client.client else None
+            if cached:
+                shared = json.loads(cached)
+                if self._is_valid(shared['expires_at']):
+                    return shared['token'], shared['expires_at']
+        except Exception as e:
+            logger.error(f"Error reading shared access token: {str(e)}")
+        return None
+
+    def _store_shared(self, token, expires_at):
+        try:
+            ttl = max(1, int(expires_at - time.time() - TOKEN_REFRESH_MARGIN))
+            redis_client.client.set(TOKEN_CACHE_KEY, json.dumps({'token': token, 'expires_at': expires_at}), ex=ttl)
+        except Exception as e:
+            logger.error(f"Error sharing access token: {str(e)}")
+
+    def _wait_for_shared(self, stale_token, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(0.1)
+            shared = self._load_shared()
+            if shared and shared[0] != stale_token:
+                return shared
+        return None
+
+token_manager = AccessTokenManager()
+
+def generate_access_token(force_refresh=False):
+    """Get an M-Pesa API access token (cached, see AccessTokenManager)"""
+    return token_manager.get_token(force_refresh=force_refresh)
+
+def is_auth_error(response):
+    """True if the gateway rejected the request's access token"""
+    if response.status_code == 401:
+        return True
+    try:
+        return response.json().get('errorCode') == '404.001.04'
+    except ValueError:
+        return False
 
 def format_phone_number(phone_number):
     """Format phone number to required M-Pesa format (254XXXXXXXXX)"""
@@ -118,12 +239,22 @@ def initiate_mpesa_payment(amount, phone_number):
         logger.info(f"Initiating payment for {phone_number}, amount: {amount}")
         
        
-        response = requests.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest", 
+        response = mpesa_gateway.post(
+            "/mpesa/stkpush/v1/processrequest", 
             json=payload, 
             headers=headers
         )
         
+        # A rejected token means the push was not processed, so it's safe to resend
+        if is_auth_error(response):
+            logger.error("Authentication error with M-Pesa API. Refreshing access token.")
+            headers["Authorization"] = f"Bearer {generate_access_token(force_refresh=True)}"
+            response = mpesa_gateway.post(
+                "/mpesa/stkpush/v1/processrequest", 
+                json=payload, 
+                headers=headers
+            )
+        
     
         logger.info(f"STK Push response: {response.status_code} - {response.text}")
         
@@ -139,7 +270,6 @@ def initiate_mpesa_payment(amount, phone_number):
 
 def verify_mpesa_payment(checkout_request_id):
     try:
-        # Generate a fresh access token for each verification
         access_token = generate_access_token()
         
         
@@ -163,40 +293,29 @@ def verify_mpesa_payment(checkout_request_id):
             "Authorization": f"Bearer {access_token}"
         }
         
-        # Use session for connection pooling
-        session = requests.Session()
-        session.mount('https://', requests.adapters.HTTPAdapter(
-            pool_connections=100,
-            pool_maxsize=100,
-            max_retries=3
-        ))
-        
-        response = session.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query",
+        # A status query doesn't change anything, so it can be retried
+        response = mpesa_gateway.post(
+            "/mpesa/stkpushquery/v1/query",
+            idempotent=True,
             json=payload,
-            headers=headers,
-            timeout=10
+            headers=headers
         )
 
-        response.raise_for_status()
-        result = response.json()
-        
-    
-        if result.get('errorCode') == '404.001.04':
+        if is_auth_error(response):
             logger.error("Authentication error with M-Pesa API. Token may be invalid.")
           
             access_token = generate_access_token(force_refresh=True)
             headers["Authorization"] = f"Bearer {access_token}"
             
-            response = session.post(
-                f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query",
+            response = mpesa_gateway.post(
+                "/mpesa/stkpushquery/v1/query",
+                idempotent=True,
                 json=payload,
-                headers=headers,
-                timeout=10
+                headers=headers
             )
-            
-            response.raise_for_status()
-            result = response.json()
+
+        response.raise_for_status()
+        result = response.json()
 
         result_code = result.get('ResultCode')
 
@@ -215,11 +334,13 @@ def verify_mpesa_payment(checkout_request_id):
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return {"error": str(e)}
-    finally:
-        session.close()
 
 def delayed_verification(checkout_request_id, attempt=1):
-    """Handle delayed payment verification with retries"""
+    """Verify a pending payment with M-Pesa.
+
+    Run by verification_queue. Returns the delay before the next attempt,
+    or None once the payment is settled or out of retries.
+    """
     try:
         with app.app_context():
             with transaction_lock(checkout_request_id):
@@ -232,23 +353,24 @@ def delayed_verification(checkout_request_id, attempt=1):
                 if 'error' in result:
                     logger.error(f"Payment verification error: {result['error']}")
                     if attempt <= 4:
-                        delay = 5 * (2 ** (attempt - 1))
-                        threading.Timer(delay, delayed_verification, args=(checkout_request_id, attempt + 1)).start()
-                        return
+                        return 5 * (2 ** (attempt - 1))
                     else:
-                        payment.payment_status = 'Failed'
+                        if not claim_pending_payment(payment, 'Failed'):
+                            return
                         payment.failure_reason = result.get('error', 'Payment verification failed after retries')
                         db.session.commit()
+                        settle_inventory(checkout_request_id, completed=False)
                         return
 
                 result_code = result.get('ResultCode')
                 if result_code == '1032' or result_code == '1':
-                    payment.payment_status = 'Canceled'
+                    if not claim_pending_payment(payment, 'Canceled'):
+                        return
                     payment.failure_reason = result.get('ResultDesc', 'Payment canceled by user')
-                    ticket = payment.ticket
-                    if ticket:
+                    for ticket in checkout_tickets(checkout_request_id, payment):
                         ticket.satus = 'canceled'
                     db.session.commit()
+                    settle_inventory(checkout_request_id, completed=False)
                     return
                 
                 elif result_code == '0':
@@ -256,28 +378,53 @@ def delayed_verification(checkout_request_id, attempt=1):
                 
                 elif result_code == '2001' or result.get('status') == 'pending':
                     if attempt <= 3:
-                        delay = 5 * (2 ** (attempt - 1))
-                        threading.Timer(delay, delayed_verification, args=(checkout_request_id, attempt + 1)).start()
+                        return 5 * (2 ** (attempt - 1))
                     else:
-                        payment.payment_status = 'Failed'
+                        if not claim_pending_payment(payment, 'Failed'):
+                            return
                         payment.failure_reason = 'Payment pending but max retries reached'
                         db.session.commit()
+                        settle_inventory(checkout_request_id, completed=False)
                 
                 else:
-                    payment.payment_status = 'Failed'
+                    if not claim_pending_payment(payment, 'Failed'):
+                        return
                     payment.failure_reason = result.get('ResultDesc', 'Payment failed')
                     db.session.commit()
+                    settle_inventory(checkout_request_id, completed=False)
 
     except SQLAlchemyError as e:
+        # Raised on so the queue retries the job after its error delay
         logger.error(f"Database error: {str(e)}")
         with app.app_context():
             db.session.rollback()
+        raise
     except Exception as e:
-        logger.error(f"Thread error: {str(e)}")
+        logger.error(f"Verification error: {str(e)}")
+        raise
     finally:
         with app.app_context():
             db.session.remove()
 
+verification_queue = DelayedJobQueue('verification', delayed_verification)
+
+def schedule_verification(checkout_request_id, delay, attempt=1):
+    """Verify the payment after delay seconds. Without Redis it runs on a
+    timer in this process, and goes back to the queue once Redis is back."""
+    if verification_queue.schedule(checkout_request_id, delay, attempt):
+        return
+    timer = threading.Timer(delay, _verify_in_process, args=[checkout_request_id, attempt])
+    timer.daemon = True
+    timer.start()
+
+def _verify_in_process(checkout_request_id, attempt):
+    try:
+        delay = delayed_verification(checkout_request_id, attempt)
+    except Exception:
+        delay = verification_queue.error_delay if attempt < verification_queue.max_attempts else None
+    if delay is not None:
+        schedule_verification(checkout_request_id, delay, attempt + 1)
+
 class LockManager:
     def __init__(self):
         self._locks = {}
@@ -310,110 +457,263 @@ def transaction_lock(checkout_id):
         # Clean up lock after successful transaction
         lock_manager.cleanup(checkout_id)
 
+def release_hold(hold_id):
+    try:
+        ticket_inventory.release(hold_id)
+    except InventoryUnavailable as e:
+        logger.error(f"Could not release inventory hold {hold_id}: {str(e)}")
+
+def checkout_tickets(checkout_request_id, payment):
+    """The tickets bought in a checkout. Purchases made before tickets recorded
+    their checkout only have the payment's ticket."""
+    tickets = Ticket.query.filter_by(checkout_request_id=checkout_request_id).all()
+    if not tickets and payment.ticket:
+        tickets = [payment.ticket]
+    return tickets
+
+def settle_inventory(checkout_request_id, completed, tickets=()):
+    """Confirm (payment completed, with the sold tickets) or release (payment
+    failed) the checkout's inventory hold"""
+    try:
+        if completed:
+            items = [(ticket.ticket_type_id, ticket.quantity) for ticket in tickets]
+            ticket_inventory.confirm_checkout(checkout_request_id, items)
+        else:
+            ticket_inventory.release_checkout(checkout_request_id)
+    except InventoryUnavailable as e:
+        logger.error(f"Could not settle inventory for {checkout_request_id}: {str(e)}")
+
+def claim_pending_payment(payment, status):
+    """Move a payment out of Pending. False if the callback or a verification
+    in another worker settled it first."""
+    claimed = Payment.query.filter_by(id=payment.id, payment_status='Pending').update(
+        {'payment_status': status}, synchronize_session=False
+    )
+    if claimed:
+        set_committed_value(payment, 'payment_status', status)
+    return claimed == 1
+
+def add_tickets_sold(sold):
+    """Add {ticket_type_id: quantity} to tickets_sold in SQL, so concurrent workers can't lose updates"""
+    for ticket_type_id, quantity in sold.items():
+        TicketType.query.filter_by(id=ticket_type_id).update(
+            {'tickets_sold': TicketType.tickets_sold + quantity}, synchronize_session=False
+        )
+
+def apply_mpesa_callbacks(callbacks):
+    """Apply a batch of stkCallback payloads.
+
+    Only payments still Pending are updated, so redelivered callbacks are
+    no-ops. If the batch fails as a whole each callback is retried on its
+    own, and any that still fail are raised so the queue redelivers them.
+
+    Returns the indexes of callbacks for payments that don't exist yet (the
+    callback beat the purchase's commit), which the queue redelivers later.
+    """
+    with app.app_context():
+        unknown = set()
+        try:
+            unknown = _apply_callbacks(callbacks)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Callback batch failed, applying one by one: {str(e)}")
+            failed = 0
+            for callback in callbacks:
+                try:
+                    unknown |= _apply_callbacks([callback])
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    failed += 1
+                    logger.error(f"Error applying callback {callback.get('CheckoutRequestID')}: {str(e)}")
+            if failed:
+                raise RuntimeError(f"{failed} of {len(callbacks)} callbacks failed")
+        finally:
+            db.session.remove()
+        return [i for i, callback in enumerate(callbacks) if callback['CheckoutRequestID'] in unknown]
+
+def _apply_callbacks(callbacks):
+    by_checkout = {callback['CheckoutRequestID']: callback for callback in callbacks}
+    payments = Payment.query.filter(
+        Payment.transaction_id.in_(list(by_checkout)),
+        Payment.payment_status == 'Pending'
+    ).all()
+    # Before the loop below swaps completed payments' ids for their receipt numbers
+    pending_checkouts = {payment.transaction_id for payment in payments}
+    tickets = {}  # checkout request id -> tickets
+    if payments:
+        for ticket in Ticket.query.filter(Ticket.checkout_request_id.in_(list(pending_checkouts))):
+            tickets.setdefault(ticket.checkout_request_id, []).append(ticket)
+        unlinked = {
+            payment.ticket_id: payment.transaction_id
+            for payment in payments if payment.transaction_id not in tickets
+        }
+        if unlinked:
+            for ticket in Ticket.query.filter(Ticket.id.in_(list(unlinked))):
+                tickets[unlinked[ticket.id]] = [ticket]
+
+    settled = []
+    sold = {}
+    emails = []
+    for payment in payments:
+        checkout_request_id = payment.transaction_id
+        stk_callback = by_checkout[checkout_request_id]
+        paid_tickets = tickets.get(checkout_request_id, [])
+
+        if stk_callback.get('ResultCode') == 0:
+            if not claim_pending_payment(payment, 'Completed'):
+                continue
+            payment_details = {}
+            for item in stk_callback.get('CallbackMetadata', {}).get('Item', []):
+                if 'Name' in item and 'Value' in item:
+                    payment_details[item['Name']] = item['Value']
+                else:
+                    logger.warning(f"Malformed metadata item: {item}")
+            logger.debug(f"Extracted payment details: {payment_details}")
+
+            payment.transaction_id = payment_details.get('MpesaReceiptNumber')
+            payment.payment_date = datetime.now()
+            for ticket in paid_tickets:
+                ticket.satus = 'purchased'
+                sold[ticket.ticket_type_id] = sold.get(ticket.ticket_type_id, 0) + ticket.quantity
+                emails.append(queue_ticket_email(ticket))
+            settled.append((checkout_request_id, paid_tickets, True))
+        else:
+            if not claim_pending_payment(payment, 'Failed'):
+                continue
+            payment.failure_reason = stk_callback.get('ResultDesc', 'Payment failed')
+            for ticket in paid_tickets:
+                ticket.satus = 'payment_failed'
+            settled.append((checkout_request_id, paid_tickets, False))
+
+    add_tickets_sold(sold)
+    sold_tickets = [ticket for _, paid_tickets, completed in settled if completed for ticket in paid_tickets]
+    organizer_ids = record_sales(sold_tickets)
+    db.session.commit()
+
+    for checkout_request_id, paid_tickets, completed in settled:
+        settle_inventory(checkout_request_id, completed=completed, tickets=paid_tickets)
+        logger.info(f"Payment {'completed' if completed else 'failed'} for CheckoutRequestID: {checkout_request_id}")
+    dispatch_emails(emails)
+    sold_event_ids = {ticket.event_id for ticket in sold_tickets}
+    if sold_event_ids:
+        redis_client.invalidate_events_cache(sold_event_ids)
+        redis_client.invalidate_stats_cache(organizer_ids)
+
+    skipped = len(by_checkout) - len(settled)
+    if skipped:
+        logger.info(f"Skipped {skipped} callbacks for unknown or already settled payments")
+    return _unknown_checkouts(by_checkout, pending_checkouts)
+
+def _unknown_checkouts(by_checkout, pending):
+    """CheckoutRequestIDs of callbacks without a payment row. A completed
+    payment's transaction_id is its receipt number, so that is looked up too."""
+    candidates = {
+        checkout_request_id: callback for checkout_request_id, callback in by_checkout.items()
+        if checkout_request_id not in pending
+    }
+    if not candidates:
+        return set()
+    receipts = {}
+    for checkout_request_id, callback in candidates.items():
+        for item in callback.get('CallbackMetadata', {}).get('Item', []):
+            if item.get('Name') == 'MpesaReceiptNumber' and item.get('Value'):
+                receipts[str(item['Value'])] = checkout_request_id
+    known = {
+        transaction_id for (transaction_id,) in db.session.query(Payment.transaction_id)
+        .filter(Payment.transaction_id.in_(list(candidates) + list(receipts)))
+    }
+    known |= {checkout_request_id for receipt, checkout_request_id in receipts.items() if receipt in known}
+    return set(candidates) - known
+
+callback_queue = StreamQueue('mpesa-callbacks', apply_mpesa_callbacks)
+
 class MpesaCallbackResource(Resource):
     """Handler for M-Pesa callback notifications"""
     
     def post(self):
-        """Process M-Pesa callback data"""
+        """Validate the callback and queue it, so the gateway is acknowledged right away"""
         logger.info("Received M-Pesa callback")
         
-        try:
-            # Get callback data
-            callback_data = request.get_json()
-            
-            if not callback_data:
-                logger.error("Empty callback data received")
-                return {"ResultCode": 1, "ResultDesc": "Invalid data received"}, 400
-                
-            logger.info(f"Callback data: {callback_data}")
-            
+        callback_data = request.get_json(silent=True)
+        if not callback_data:
+            logger.error("Empty callback data received")
+            return {"ResultCode": 1, "ResultDesc": "Invalid data received"}, 400
             
-            body = callback_data.get('Body', {})
-            stk_callback = body.get('stkCallback', {})
-            
-           
-            result_code = stk_callback.get('ResultCode')
-            checkout_request_id = stk_callback.get('CheckoutRequestID')
-            
-            if not checkout_request_id:
-                logger.error("Missing CheckoutRequestID in callback")
-                return {"ResultCode": 1, "ResultDesc": "Missing CheckoutRequestID"}, 400
-                
-            logger.info(f"Processing callback for CheckoutRequestID: {checkout_request_id}")
+        logger.info(f"Callback data: {callback_data}")
+        
+        stk_callback = (callback_data.get('Body') or {}).get('stkCallback') or {}
+        checkout_request_id = stk_callback.get('CheckoutRequestID')
+        
+        if not checkout_request_id:
+            logger.error("Missing CheckoutRequestID in callback")
+            return {"ResultCode": 1, "ResultDesc": "Missing CheckoutRequestID"}, 400
+        if 'ResultCode' not in stk_callback:
+            logger.error(f"Missing ResultCode in callback for {checkout_request_id}")
+            return {"ResultCode": 1, "ResultDesc": "Missing ResultCode"}, 400
             
-            with transaction_lock(checkout_request_id):
-                payment = Payment.query.filter_by(transaction_id=checkout_request_id).first()
-                
-                if not payment:
-                    logger.error(f"Payment not found for CheckoutRequestID: {checkout_request_id}")
-                    return {"ResultCode": 1, "ResultDesc": "Payment not found"}, 404
-                    
-                
-                if result_code == 0:  
-                    
-                    callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-                    payment_details = {}
-                    for item in callback_metadata:
-                        if 'Name' in item and 'Value' in item:
-                            payment_details[item['Name']] = item['Value']
-                        else:
-                            logger.warning(f"Malformed metadata item: {item}")
-                            
-                    logger.debug(f"Extracted payment details: {payment_details}")
-                    
-                    
-                    
-                    payment.payment_status = 'Completed'
-                    payment.transaction_id = payment_details.get('MpesaReceiptNumber')
-                    payment.payment_date = datetime.now()
-                    
-                
-                    ticket = Ticket.query.get(payment.ticket_id)
-                    if ticket:
-                        ticket.satus = 'purchased'
-                        
-                        
-                        ticket_type = TicketType.query.get(ticket.ticket_type_id)
-                        if ticket_type:
-                            ticket_type.tickets_sold += ticket.quantity
-                    
-                
-                    db.session.commit()
-                    
-                    logger.info(f"Payment completed for CheckoutRequestID: {checkout_request_id}")
-                    
-                
-             
-                    
-                else:  
-                
-                    payment.payment_status = 'Failed'
-                    payment.failure_reason = stk_callback.get('ResultDesc', 'Payment failed')
-                    
-                    # Update ticket status
-                    ticket = Ticket.query.get(payment.ticket_id)
-                    if ticket:
-                        ticket.satus = 'payment_failed'
-                    
-                    # Commit changes
-                    db.session.commit()
-                    
-                    logger.info(f"Payment failed for CheckoutRequestID: {checkout_request_id}")
-                    return {"ResultCode": 0, "ResultDesc": "Payment failure recorded"}, 200
-                
-        except TimeoutError as e:
-            logger.error(f"Transaction lock timeout: {str(e)}")
-            return {"ResultCode": 1, "ResultDesc": "Transaction processing timeout"}, 503
-        except Exception as e:
-            logger.error(f"Error processing callback: {str(e)}")
-            return {"ResultCode": 1, "ResultDesc": f"Error: {str(e)}"}, 500
+        ack = {"ResultCode": 0, "ResultDesc": "Accepted"}, 200
+        # Gateway retries of a callback already accepted are acknowledged again and dropped
+        scope = f"callback:{checkout_request_id}"
+        claimed, response = idempotency_store.begin(scope)
+        if not claimed:
+            logger.info(f"Duplicate callback for CheckoutRequestID: {checkout_request_id}")
+            return response or ack
+
+        if callback_queue.add(stk_callback) is None:
+            # Without Redis the callback is applied in the request
+            logger.warning(f"Callback queue unavailable, applying {checkout_request_id} inline")
+            try:
+                apply_mpesa_callbacks([stk_callback])
+            except Exception as e:
+                logger.error(f"Error processing callback: {str(e)}")
+                idempotency_store.abandon(scope)
+                return {"ResultCode": 1, "ResultDesc": f"Error: {str(e)}"}, 500
+        
+        idempotency_store.finish(scope, ack)
+        logger.info(f"Queued callback for CheckoutRequestID: {checkout_request_id}")
+        return ack
 
 class TicketPurchaseResource(Resource):
-    """Resource for initiating ticket purchases"""
+    """Resource for initiating ticket purchases.
+
+    Purchases run as reserve -> pay -> confirm: the tickets are held first
+    (atomically in Redis, or under the per-event lock without it), the STK
+    push happens outside any lock, and the pending tickets and payment are
+    recorded once the gateway accepts. The hold is released if that fails.
+    """
     
     @jwt_required()
     def post(self, event_id):
-        """Initiate ticket purchase for an event"""
+        """Initiate ticket purchase for an event.
+
+        Requests carrying an Idempotency-Key header are handled once per user
+        and key, retries and double submits get the first response back.
+        """
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return self._purchase(event_id)
+
+        scope = f"purchase:{get_jwt_identity()}:{key}"
+        request_fingerprint = fingerprint([event_id, request.get_json(silent=True)])
+        try:
+            claimed, response = idempotency_store.begin(scope, request_fingerprint)
+        except IdempotencyConflict as e:
+            return error_response(str(e), 422)
+        if not claimed:
+            return response or error_response("A request with this Idempotency-Key is already in progress", 409)
+
+        try:
+            response = self._purchase(event_id)
+        except Exception:
+            idempotency_store.abandon(scope)
+            raise
+        idempotency_store.finish(scope, response, request_fingerprint)
+        return response
+
+    def _purchase(self, event_id):
+        hold_id = None
+        checkout_request_id = None
+        committed = False
         try:
             current_user_id = get_jwt_identity()
             user = User.query.get(current_user_id)
@@ -433,90 +733,92 @@ class TicketPurchaseResource(Resource):
             if not ticket_details:
                 return error_response("No ticket details provided", 400)
             
-            # Validate ticket availability and create purchase transaction
-            with transaction_lock(f"event_{event_id}"):
-                # Validate all tickets first
-                for detail in ticket_details:
-                    ticket_type_id = detail.get('ticket_type_id')
-                    quantity = detail.get('quantity', 1)
-                    
-                    ticket_type = TicketType.query.get(ticket_type_id)
-                    if not ticket_type or ticket_type.event_id != event_id:
-                        return error_response("Invalid ticket type", 400)
-                        
-                    available = ticket_type.quantity - ticket_type.tickets_sold
-                    if available < quantity:
-                        return error_response(f"Only {available} tickets available for {ticket_type.name}", 400)
-                        
-                    if ticket_type.per_person_limit and quantity > ticket_type.per_person_limit:
-                        return error_response(f"Cannot purchase more than {ticket_type.per_person_limit} tickets per person", 400)
-                
-                # Get or create attendee
-                attendee = Attendee.query.filter_by(user_id=user.id).first()
-                if not attendee:
-                    attendee = Attendee(user_id=user.id)
-                    db.session.add(attendee)
-                    db.session.flush()
+            # Validate all tickets first
+            items = []
+            for detail in ticket_details:
+                ticket_type_id = detail.get('ticket_type_id')
+                quantity = detail.get('quantity', 1)
                 
-                # Initialize M-Pesa payment
-                payment_result = initiate_mpesa_payment(total_amount, user.phone)
-                
-                if "error" in payment_result:
-                    return error_response(f"Payment initiation failed: {payment_result.get('error')}", 400)
-                    
-                if payment_result.get('ResponseCode') != '0':
-                    return error_response(f"Payment gateway error: {payment_result.get('ResponseDescription')}", 400)
+                ticket_type = TicketType.query.get(ticket_type_id)
+                if not ticket_type or ticket_type.event_id != event_id:
+                    return error_response("Invalid ticket type", 400)
                     
-                checkout_request_id = payment_result.get('CheckoutRequestID')
-                if not checkout_request_id:
-                    return error_response("Missing checkout request ID in payment response", 400)
+                if ticket_type.per_person_limit and quantity > ticket_type.per_person_limit:
+                    return error_response(f"Cannot purchase more than {ticket_type.per_person_limit} tickets per person", 400)
                 
-                # Create ticket records
-                tickets = []
-                for detail in ticket_details:
-                    ticket_type_id = detail.get('ticket_type_id')
-                    quantity = detail.get('quantity', 1)
-                    ticket_type = TicketType.query.get(ticket_type_id)
-                    
-                    ticket = Ticket(
-                        event_id=event.id,
-                        attendee_id=attendee.id,
-                        ticket_type_id=ticket_type.id,
-                        price=ticket_type.price * quantity,
-                        quantity=quantity,
-                        currency=ticket_type.currency,
-                        satus='pending'
-                    )
-                    
-                    db.session.add(ticket)
-                    db.session.flush()
-                    tickets.append(ticket)
+                items.append((ticket_type, quantity))
+            
+            # 1. Reserve
+            hold_id, error = self._reserve(event_id, items)
+            if error:
+                return error
+            
+            # 2. Pay - the gateway round trips happen outside any lock
+            payment_result = initiate_mpesa_payment(total_amount, user.phone)
+            
+            if "error" in payment_result:
+                return error_response(f"Payment initiation failed: {payment_result.get('error')}", 400)
                 
-                # Create payment record
-                payment = Payment(
-                    ticket_id=tickets[0].id,
-                    payment_method='Mpesa',
-                    payment_status='Pending',
-                    transaction_id=checkout_request_id,
-                    amount=total_amount,
-                    currency=tickets[0].currency
+            if payment_result.get('ResponseCode') != '0':
+                return error_response(f"Payment gateway error: {payment_result.get('ResponseDescription')}", 400)
+                
+            checkout_request_id = payment_result.get('CheckoutRequestID')
+            if not checkout_request_id:
+                return error_response("Missing checkout request ID in payment response", 400)
+            
+            # 3. Confirm - record the attendee, pending tickets and payment in one
+            # short transaction, nothing is written before the gateway answers
+            attendee = Attendee.query.filter_by(user_id=user.id).first()
+            if not attendee:
+                attendee = Attendee(user_id=user.id)
+                db.session.add(attendee)
+                db.session.flush()
+            
+            tickets = []
+            for ticket_type, quantity in items:
+                ticket = Ticket(
+                    event_id=event.id,
+                    attendee_id=attendee.id,
+                    ticket_type_id=ticket_type.id,
+                    price=ticket_type.price * quantity,
+                    quantity=quantity,
+                    currency=ticket_type.currency,
+                    satus='pending',
+                    checkout_request_id=checkout_request_id
                 )
                 
-                db.session.add(payment)
-                db.session.commit()
+                db.session.add(ticket)
+                db.session.flush()
+                tickets.append(ticket)
+            
+            # Create payment record
+            payment = Payment(
+                ticket_id=tickets[0].id,
+                payment_method='Mpesa',
+                payment_status='Pending',
+                transaction_id=checkout_request_id,
+                amount=total_amount,
+                currency=tickets[0].currency
+            )
+            
+            db.session.add(payment)
+            ticket_ids = [ticket.id for ticket in tickets]
+            # Attached first, so a callback racing the commit finds the hold
+            if hold_id:
+                ticket_inventory.attach_checkout(hold_id, checkout_request_id)
+            db.session.commit()
+            committed = True
 
-                # Schedule verification
-                threading.Timer(
-                    5,  # Initial delay
-                    delayed_verification,
-                    args=(checkout_request_id,)
-                ).start()
-
-                return success_response(
-                    message="Payment initiated successfully. Please complete on your phone.",
-                    data={"CheckoutRequestID": checkout_request_id},
-                    status_code=200
-                )
+            # Schedule verification, the callback normally settles it first
+            schedule_verification(checkout_request_id, 5)
+            # Render the QR codes while the buyer pays, the ticket email reads them from the cache
+            prerender_ticket_qrs(ticket_ids)
+
+            return success_response(
+                message="Payment initiated successfully. Please complete on your phone.",
+                data={"CheckoutRequestID": checkout_request_id},
+                status_code=200
+            )
             
         except TimeoutError as e:
             logger.error(f"Transaction lock timeout: {str(e)}")
@@ -525,6 +827,30 @@ class TicketPurchaseResource(Resource):
             logger.error(f"Error processing ticket purchase: {str(e)}")
             db.session.rollback()
             return error_response(f"Error: {str(e)}", 500)
+        finally:
+            # Anything short of a recorded payment gives the held tickets back
+            if hold_id and not committed:
+                if checkout_request_id:
+                    ticket_inventory.detach_checkout(checkout_request_id)
+                release_hold(hold_id)
+
+    def _reserve(self, event_id, items):
+        """Hold the tickets. Returns (hold_id, error_response)."""
+        try:
+            return ticket_inventory.reserve(items), None
+        except InsufficientInventory as e:
+            return None, error_response(str(e), 400)
+        except InventoryUnavailable as e:
+            logger.warning(f"Inventory unavailable, checking database counts: {str(e)}")
+        
+        # Without Redis the lock covers only the availability check
+        with transaction_lock(f"event_{event_id}"):
+            for ticket_type, quantity in items:
+                db.session.refresh(ticket_type)
+                available = ticket_type.quantity - ticket_type.tickets_sold
+                if available < quantity:
+                    return None, error_response(f"Only {available} tickets available for {ticket_type.name}", 400)
+        return None, None
 
 # class PaymentStatusResource(Resource):
 #     """Resource for checking payment status"""
@@ -535,55 +861,56 @@ def get_verification_status(result, payment):
     try:
         # First verify the payment is actually successful
         if result.get('ResultCode') != '0':
-            payment.payment_status = 'Failed'
+            if not claim_pending_payment(payment, 'Failed'):
+                return False
             payment.failure_reason = result.get('ResultDesc', 'Payment verification failed')
             db.session.commit()
+            settle_inventory(payment.transaction_id, completed=False)
             logger.info(f"Payment verification failed for payment ID: {payment.id}")
             return False
         
         # Update payment status for successful transaction
-        payment.payment_status = 'Completed'
+        if not claim_pending_payment(payment, 'Completed'):
+            logger.info(f"Payment ID {payment.id} was already settled")
+            return False
         # payment.transaction_id = result.get('MpesaReceiptNumber')
         payment.payment_date = datetime.now()
 
-        # Update ticket status
-        ticket = Ticket.query.get(payment.ticket_id)
-        if ticket:
+        # Update the status of every ticket of the checkout
+        tickets = checkout_tickets(payment.transaction_id, payment)
+        sold = {}
+        emails = []
+        for ticket in tickets:
             ticket.satus = 'purchased'
-            ticket_type = TicketType.query.get(ticket.ticket_type_id)
-            if ticket_type:
-                ticket_type.tickets_sold += ticket.quantity
+            sold[ticket.ticket_type_id] = sold.get(ticket.ticket_type_id, 0) + ticket.quantity
+            # Confirmation email, sent by the email workers once this commits
+            emails.append(queue_ticket_email(ticket))
+        add_tickets_sold(sold)
+        organizer_ids = record_sales(tickets)
 
         # Commit changes
         db.session.commit()
+        settle_inventory(payment.transaction_id, completed=True, tickets=tickets)
+        if tickets:
+            redis_client.invalidate_events_cache({ticket.event_id for ticket in tickets})
+            redis_client.invalidate_stats_cache(organizer_ids)
 
-        # Send confirmation email only for completed payments
-        logger.info(f"Sending ticket email for payment ID: {payment.id}")
-        send_ticket_qr_email(ticket)
+        logger.info(f"Queued ticket email for payment ID: {payment.id}")
+        dispatch_emails(emails)
         return True
 
     except Exception as e:
         logger.error(f"Payment processing failed: {str(e)}")
         db.session.rollback()
-        return False
+        # Raised on so the verification job retries it
+        raise
 
 def send_ticket_qr_email( ticket):
     """Send ticket email with properly attached QR code"""
-    
-    
-    user = User.query.get(ticket.attendee.user_id)
-    
     try:
-        # Validate essential data
-        if not all([ticket, ticket.qr_code, user.email, ticket.event]):
-            logging.error(f"Missing data - Ticket: {bool(ticket)}, QR: {bool(ticket.qr_code)}, User: {user}")
+        msg = build_ticket_email(ticket)
+        if msg is None:
             return
-
-        
-        qr_filename, qr_data = generate_qr_attachment(ticket)
-        
-        # Create email message
-        msg = create_email_message(user, ticket, qr_filename, qr_data)
         
         # Send with retry logic
         send_email_with_retry(msg, retries=2)
@@ -591,264 +918,138 @@ def send_ticket_qr_email( ticket):
     except Exception as e:
         logging.error(f"Ticket email failed: {str(e)}")
 
+def build_ticket_email(ticket):
+    """The ticket email with its QR code attached, or None if the ticket is missing data"""
+    user = User.query.get(ticket.attendee.user_id)
+    
+    # Validate essential data
+    if not all([ticket, ticket.qr_code, user.email, ticket.event]):
+        logging.error(f"Missing data - Ticket: {bool(ticket)}, QR: {bool(ticket.qr_code)}, User: {user}")
+        return None
+
+    qr_filename, qr_data = generate_qr_attachment(ticket)
+    
+    # Create email message
+    return create_email_message(user, ticket, qr_filename, qr_data)
+
+EMAIL_MAX_ATTEMPTS = 6
+EMAIL_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+EMAIL_RELAY_INTERVAL = 60
+EMAIL_RELAY_BATCH = 500
+
+def queue_ticket_email(ticket):
+    """Add a ticket's email to the outbox in the caller's transaction. Returns the
+    outbox id, to pass to dispatch_emails() after the commit."""
+    outbox_id = str(uuid.uuid4())
+    db.session.add(EmailOutbox(id=outbox_id, kind='ticket', ticket_id=ticket.id))
+    return outbox_id
+
+def dispatch_emails(outbox_ids):
+    """Hand committed outbox rows to the email workers. Without Redis they are sent inline."""
+    for outbox_id in outbox_ids:
+        if not email_queue.schedule(outbox_id, 0):
+            deliver_outbox_email(outbox_id)
+
+def deliver_outbox_email(outbox_id, attempt=1):
+    """Send one outbox email.
+
+    Run by email_queue. Returns the delay before the next attempt if sending
+    failed, or None once the email is sent or out of attempts.
+    """
+    try:
+        with app.app_context():
+            outbox = EmailOutbox.query.get(outbox_id)
+            if not outbox or outbox.status != 'pending':
+                return
+
+            try:
+                msg = build_ticket_email(outbox.ticket) if outbox.ticket else None
+                if msg is None:
+                    outbox.status = 'failed'
+                    outbox.last_error = 'Ticket is missing data for the email'
+                    db.session.commit()
+                    return
+                smtp_pool.send(msg)
+            except Exception as e:
+                db.session.rollback()
+                outbox.attempts += 1
+                outbox.last_error = str(e)[:1000]
+                if outbox.attempts >= EMAIL_MAX_ATTEMPTS:
+                    outbox.status = 'failed'
+                    db.session.commit()
+                    logger.error(f"Giving up on email {outbox_id} after {outbox.attempts} attempts: {str(e)}")
+                    return
+                delay = EMAIL_RETRY_DELAY * (2 ** (outbox.attempts - 1))
+                outbox.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                db.session.commit()
+                logger.warning(f"Email {outbox_id} failed on attempt {outbox.attempts}, retrying in {delay}s: {str(e)}")
+                return delay
+
+            outbox.status = 'sent'
+            outbox.attempts += 1
+            outbox.sent_at = datetime.utcnow()
+            db.session.commit()
+            logger.info(f"Email {outbox_id} sent to {msg.recipients}")
+    finally:
+        with app.app_context():
+            db.session.remove()
+
+def relay_outbox_emails(job_id, attempt=1):
+    """Queue outbox rows that are due but were never handed to the email
+    workers, e.g. after a crash between the commit and dispatch_emails().
+
+    Run by email_relay_queue every EMAIL_RELAY_INTERVAL seconds. Rows that
+    are already queued or being sent keep their place.
+    """
+    try:
+        with app.app_context():
+            due = db.session.query(EmailOutbox.id).filter(
+                EmailOutbox.status == 'pending',
+                EmailOutbox.next_attempt_at <= datetime.utcnow()
+            ).order_by(EmailOutbox.next_attempt_at).limit(EMAIL_RELAY_BATCH)
+            for (outbox_id,) in due:
+                email_queue.schedule(outbox_id, 0, replace=False)
+    except Exception as e:
+        logger.error(f"Error relaying outbox emails: {str(e)}")
+    finally:
+        with app.app_context():
+            db.session.remove()
+    return EMAIL_RELAY_INTERVAL
+
+email_queue = DelayedJobQueue('email', deliver_outbox_email, workers=4, max_attempts=EMAIL_MAX_ATTEMPTS)
+email_relay_queue = DelayedJobQueue('email-relay', relay_outbox_emails, workers=1)
+
+def schedule_email_relay():
+    """Queue the periodic outbox relay unless it is already queued"""
+    email_relay_queue.schedule('outbox', 0, replace=False)
+
 def generate_qr_attachment(ticket):
-    """Generate QR code file with enhanced security and visual appeal"""
+    """QR code file of the ticket's verification URL, from the QR cache"""
     try:
-        # Create verification URL using ticket ID as the primary identifier
-        verification_url = f"{Config2.BASE_URL}/verify/ticket/{ticket.id}"
-        
-        # Create QR code with enhanced settings
-        qr = qrcode.QRCode(
-            version=None, 
-            error_correction=qrcode.constants.ERROR_CORRECT_H,  
-            box_size=10, 
-            border=4,  
-        )
-        
-        qr.add_data(verification_url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(
-            fill_color="#1a1a1a", 
-            back_color="#ffffff",  
-            image_factory=None  
-        )
-        
-        # Convert to PNG with high quality
-        img_buffer = BytesIO()
-        img.save(img_buffer, format="PNG", quality=100)
-        img_buffer.seek(0)
+        qr_data = qr_cache.get_or_render(ticket_qr_payload(ticket.id))
         
         # Generate filename using ticket ID
         filename = f"ticket_{ticket.id}.png"
         
-        return (filename, img_buffer.getvalue())
+        return (filename, qr_data)
         
     except Exception as e:
         logging.error(f"QR generation failed: {str(e)}")
         raise
 
 def create_email_message(user, ticket, qr_filename, qr_data):
-    """Create email message with enhanced styling and layout"""
+    """Create the ticket email from the precompiled templates, see email_templates.py"""
     try:
-        event_date = ticket.event.start_datetime.strftime('%B %d, %Y %H:%M') if not ticket.event.start_datetime else "Date to be announced"
-        
-        html_content = f"""<!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <style>
-                body {{
-                    margin: 0;
-                    padding: 0;
-                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                    background-color: #f5f5f5;
-                }}
-                .email-container {{
-                    max-width: 600px;
-                    margin: 0 auto;
-                    background-color: #ffffff;
-                    border-radius: 12px;
-                    overflow: hidden;
-                    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-                }}
-                .email-header {{
-                    background: linear-gradient(135deg, {Config2.BRAND_COLOR}, {Config2.BRAND_COLOR}99);
-                    color: white;
-                    padding: 30px 20px;
-                    text-align: center;
-                }}
-                .email-header h1 {{
-                    margin: 0;
-                    font-size: 24px;
-                    font-weight: 600;
-                }}
-                .email-body {{
-                    padding: 30px;
-                    color: #333333;
-                }}
-                .greeting {{
-                    font-size: 18px;
-                    margin-bottom: 25px;
-                    color: #444444;
-                }}
-                .ticket-details {{
-                    background-color: #f8f9fa;
-                    border-radius: 8px;
-                    padding: 20px;
-                    margin-bottom: 25px;
-                }}
-                .detail-item {{
-                    display: flex;
-                    align-items: center;
-                    margin-bottom: 15px;
-                    padding-bottom: 15px;
-                    border-bottom: 1px solid #e9ecef;
-                }}
-                .detail-item:last-child {{
-                    border-bottom: none;
-                    margin-bottom: 0;
-                    padding-bottom: 0;
-                }}
-                .detail-icon {{
-                    width: 24px;
-                    height: 24px;
-                    margin-right: 15px;
-                    color: {Config2.BRAND_COLOR};
-                }}
-                .detail-content {{
-                    flex: 1;
-                }}
-                .detail-label {{
-                    font-size: 14px;
-                    color: #6c757d;
-                    margin-bottom: 4px;
-                }}
-                .detail-value {{
-                    font-size: 16px;
-                    font-weight: 500;
-                    color: #212529;
-                }}
-                .qr-section {{
-                    text-align: center;
-                    margin: 30px 0;
-                    padding: 25px;
-                    background-color: #ffffff;
-                    border-radius: 8px;
-                    border: 1px solid #e9ecef;
-                }}
-                .qr-box {{
-                    display: inline-block;
-                    padding: 20px;
-                    background-color: #ffffff;
-                    border-radius: 8px;
-                    box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-                }}
-                .qr-code-img {{
-                    width: 200px;
-                    height: 200px;
-                    margin: 0 auto;
-                    display: block;
-                }}
-                .qr-instructions {{
-                    margin-top: 15px;
-                    color: #6c757d;
-                    font-size: 14px;
-                }}
-                .footer {{
-                    margin-top: 30px;
-                    padding-top: 20px;
-                    border-top: 1px solid #e9ecef;
-                    text-align: center;
-                    color: #6c757d;
-                    font-size: 14px;
-                }}
-                .event-title {{
-                    font-size: 20px;
-                    font-weight: 600;
-                    color: #212529;
-                    margin-bottom: 20px;
-                }}
-                @media only screen and (max-width: 600px) {{
-                    .email-container {{
-                        border-radius: 0;
-                    }}
-                    .email-body {{
-                        padding: 20px;
-                    }}
-                    .qr-code-img {{
-                        width: 180px;
-                        height: 180px;
-                    }}
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="email-container">
-                <div class="email-header">
-                    <h1>🎟 Your Ticket Confirmation</h1>
-                </div>
-                
-                <div class="email-body">
-                    <div class="greeting">
-                        Hello {user.first_name} {user.last_name},
-                    </div>
-
-                    <div class="ticket-details">
-                        <div class="event-title">{ticket.event.title}</div>
-                        
-                        <div class="detail-item">
-                            <div class="detail-icon">📅</div>
-                            <div class="detail-content">
-                                <div class="detail-label">Event Date & Time</div>
-                                <div class="detail-value">{event_date}</div>
-                            </div>
-                        </div>
-                        
-                        <div class="detail-item">
-                            <div class="detail-icon">📍</div>
-                            <div class="detail-content">
-                                <div class="detail-label">Location</div>
-                                <div class="detail-value">{ticket.event.location}</div>
-                            </div>
-                        </div>
-                        
-                        <div class="detail-item">
-                            <div class="detail-icon">🎫</div>
-                            <div class="detail-content">
-                                <div class="detail-label">Number of Tickets</div>
-                                <div class="detail-value">{ticket.quantity}</div>
-                            </div>
-                        </div>
-                    </div>
-
-                    <div class="qr-section">
-                        <div class="qr-box">
-                            <img src="cid:qr_code" 
-                                 class="qr-code-img"
-                                 alt="Ticket QR Code">
-                            <div class="qr-instructions">
-                                Present this QR code at the event entrance for scanning
-                            </div>
-                        </div>
-                    </div>
-                    
-                    <div class="footer">
-                        <p>We look forward to seeing you at the event!</p>
-                        <p>Best regards,<br><strong>{Config2.EMAIL_SENDER_NAME}</strong></p>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>"""
+        subject, text, html = ticket_email_templates.render(user, ticket)
 
         msg = Message(
-            subject=f"🎟 Your Ticket for {ticket.event.title}",
+            subject=subject,
             recipients=[user.email],
             sender=(Config2.EMAIL_SENDER_NAME, Config2.MAIL_USERNAME),
             charset="utf-8"
         )
-        
-        # HTML version
-        msg.html = html_content
-        
-        # Text version
-        msg.body = f"""Hi {user.first_name},
-
-Your ticket details:
-
-Event: {ticket.event.title}
-Date: {event_date}
-Location: {ticket.event.location}
-Tickets: {ticket.quantity}
-
-Please present the attached QR code at the event entrance for scanning.
-
-We look forward to seeing you at the event!
-
-Best regards,
-{Config2.EMAIL_SENDER_NAME}"""
+        msg.html = html
+        msg.body = text
 
         # Attach QR code
         msg.attach(
@@ -863,12 +1064,13 @@ Best regards,
     except Exception as e:
         logging.error(f"Email creation failed: {str(e)}")
         raise
+
 def send_email_with_retry(msg, retries=2):
     """Robust email sending with retries"""
     logger = logging.getLogger(__name__)
     for attempt in range(retries + 1):
         try:
-            mail.send(msg)
+            smtp_pool.send(msg)
             logger.info(f"Email sent successfully to {msg.recipients}")
             return True
         except SMTPException as e:
@@ -2,9 +2,13 @@ from flask import request
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database import db
-from models import Category, User
+from models import Category, User, EventCategory
 from utils.response import success_response, error_response
 from utils.auth import admin_required
+from redis_client import redis_client
+
+def _category_event_ids(category_id):
+    return [event_id for event_id, in EventCategory.query.with_entities(EventCategory.event_id).filter_by(category_id=category_id)]
 
 class CategoryListResource(Resource):
     """
@@ -78,6 +82,7 @@ class CategoryResource(Resource):
         
         try:
             db.session.commit()
+            redis_client.invalidate_events_cache(_category_event_ids(category_id))
             return success_response(
                 data=category.to_dict(),
                 message="Category updated successfully"
@@ -95,9 +100,12 @@ class CategoryResource(Resource):
         if not category:
             return error_response("Category not found", 404)
             
+        event_ids = _category_event_ids(category_id)
+            
         try:
             db.session.delete(category)
             db.session.commit()
+            redis_client.invalidate_events_cache(event_ids)
             return success_response(message="Category deleted successfully")
         except Exception as e:
             db.session.rollback()
@@ -11,3 +11,16 @@ class Config2:
     BRAND_COLOR = "#2563eb"  
     BASE_URL = "https://fest-hrrc.onrender.com"  
     EMAIL_SENDER_NAME = "Event Team" 
+    DEBUG = os.getenv('FLASK_DEBUG', 'false').lower() in ('1', 'true')
+
+    # Outgoing mail: SMTP sessions kept open per process and the send rate
+    # per process in messages per second (0 for no limit)
+    MAIL_POOL_SIZE = int(os.getenv('MAIL_POOL_SIZE', 4))
+    MAIL_POOL_IDLE_TIMEOUT = int(os.getenv('MAIL_POOL_IDLE_TIMEOUT', 60))  # seconds
+    MAIL_SEND_RATE = float(os.getenv('MAIL_SEND_RATE', 10))
+
+    # Admin stats: run the aggregate groups concurrently, each on its own pooled
+    # connection, and answer with the groups that finished within the deadline
+    STATS_CONCURRENT_QUERIES = os.getenv('STATS_CONCURRENT_QUERIES', 'true').lower() == 'true'
+    STATS_QUERY_WORKERS = int(os.getenv('STATS_QUERY_WORKERS', 4))
+    STATS_QUERY_DEADLINE = float(os.getenv('STATS_QUERY_DEADLINE', 5))  # seconds
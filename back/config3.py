@@ -74,6 +74,11 @@ class Config:
         'pool_reset_on_return': 'rollback'
     }
     
+    # In-process (L1) cache in front of Redis, per worker
+    LOCAL_CACHE_MAX_BYTES = 16 * 1024 * 1024
+    LOCAL_CACHE_TTL = 30  # seconds
+    CACHE_INVALIDATION_CHANNEL = 'cache:invalidate'
+    
     # Memory management settings
     REDIS_MAXMEMORY = 85 * 1024 * 1024  
     REDIS_EVICTION_POLICY = 'allkeys-lru'
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+Email templates.
+
+The templates in templates/email use {{ name }} fields. They are compiled
+once per process into literal chunks and field slots: the stylesheet and
+the other fields that only depend on config (brand colour, sender name) are
+filled in at load time, so per email only the ticket fields are slotted in
+and the chunks joined. The subject, plain-text and HTML parts are rendered
+from one set of field values, escaped once for the HTML part.
+
+Event reminders (reminder.html and reminder.txt) are compiled once per
+mailing with the event fields and the organizer's message as constants, so
+only the recipient's name is filled in per email.
+
+    python benchmarks/bench_email_templates.py
+
+prints the render time per email.
+"""
+import os
+import re
+from html import escape
+
+from config2 import Config2
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')
+FIELD = re.compile(r'{{\s*(\w+)\s*}}')
+
+class CompiledTemplate:
+    """A template split once into literal text and field slots, with the
+    constants already substituted. Rendering fills the slots and joins."""
+    def __init__(self, source, **constants):
+        self._parts = []
+        self._slots = []  # (index in _parts, field name)
+        for i, part in enumerate(FIELD.split(source)):  # literal, field name, literal, ...
+            if i % 2 and part not in constants:
+                self._slots.append((len(self._parts), part))
+                self._parts.append(None)
+                continue
+            text = str(constants[part]) if i % 2 else part
+            if self._parts and self._parts[-1] is not None:
+                self._parts[-1] += text
+            else:
+                self._parts.append(text)
+
+    def render(self, fields):
+        parts = self._parts[:]
+        for index, name in self._slots:
+            parts[index] = fields[name]
+        return ''.join(parts)
+
+def _read(directory, name):
+    with open(os.path.join(directory, name), encoding='utf-8') as f:
+        return f.read().rstrip('\n')
+
+def _event_date(event):
+    return event.start_datetime.strftime('%B %d, %Y %H:%M') if event.start_datetime else "Date to be announced"
+
+class TicketEmailTemplates:
+    def __init__(self, directory=TEMPLATE_DIR, brand_color=Config2.BRAND_COLOR, sender_name=Config2.EMAIL_SENDER_NAME):
+        styles = CompiledTemplate(_read(directory, 'ticket.css'), brand_color=brand_color).render({})
+        self.html = CompiledTemplate(_read(directory, 'ticket.html'), styles=styles, sender_name=escape(sender_name))
+        self.text = CompiledTemplate(_read(directory, 'ticket.txt'), sender_name=sender_name)
+        self.subject = CompiledTemplate("🎟 Your Ticket for {{ event_title }}")
+
+    def render(self, user, ticket):
+        """(subject, text, html) of a ticket's confirmation email"""
+        event = ticket.event
+        fields = {
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'event_title': event.title,
+            'event_date': _event_date(event),
+            'location': event.location,
+            'quantity': str(ticket.quantity),
+        }
+        html_fields = {name: escape(value) for name, value in fields.items()}
+        return self.subject.render(fields), self.text.render(fields), self.html.render(html_fields)
+
+ticket_email_templates = TicketEmailTemplates()
+
+class ReminderEmail:
+    """A mailing's reminder, compiled with everything but the recipient's name"""
+    def __init__(self, subject, text, html):
+        self.subject = subject
+        self.text = text
+        self.html = html
+
+    def render(self, first_name, last_name):
+        """(text, html) for one recipient"""
+        fields = {'first_name': first_name, 'last_name': last_name}
+        html_fields = {name: escape(value) for name, value in fields.items()}
+        return self.text.render(fields), self.html.render(html_fields)
+
+class ReminderEmailTemplates:
+    def __init__(self, directory=TEMPLATE_DIR, brand_color=Config2.BRAND_COLOR, sender_name=Config2.EMAIL_SENDER_NAME):
+        self.styles = CompiledTemplate(_read(directory, 'ticket.css'), brand_color=brand_color).render({})
+        self.html_source = _read(directory, 'reminder.html')
+        self.text_source = _read(directory, 'reminder.txt')
+        self.sender_name = sender_name
+
+    def compile(self, event, subject, message):
+        fields = {
+            'event_title': event.title,
+            'event_date': _event_date(event),
+            'location': event.location,
+            'message': message,
+        }
+        html_fields = {name: escape(value) for name, value in fields.items()}
+        html_fields['message'] = html_fields['message'].replace('\n', '<br>\n')
+        return ReminderEmail(
+            subject,
+            CompiledTemplate(self.text_source, sender_name=self.sender_name, **fields),
+            CompiledTemplate(self.html_source, styles=self.styles, sender_name=escape(self.sender_name), **html_fields)
+        )
+
+reminder_email_templates = ReminderEmailTemplates()
@@ -3,29 +3,40 @@ from flask_restful import Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database import db
 from models import Event, User, Category, EventCategory, Organizer, TicketType
-from utils.response import success_response, error_response, paginate_response
+from utils.response import success_response, error_response, paginate_response, cursor_response, encode_cursor, decode_cursor
 from utils.auth import organizer_required, admin_required
 from datetime import datetime
 import cloudinary.uploader
 import json
-from redis_client import redis_client
+from redis_client import redis_client, EVENT_LISTING_TAG
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
+EVENTS_PER_PAGE = 20
+EVENTS_MAX_PER_PAGE = 100
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _event_cursor(phase, event):
+    """Keyset cursor pointing just past the given event in the listing order"""
+    return encode_cursor({'p': phase, 's': event.start_datetime.isoformat(), 'i': event.id})
+
 class EventListResource(Resource):
     def get(self):
-        # Generate cache key based on query parameters
-        cache_key = f"events:all:{request.query_string.decode()}"
+        # Generate cache key based on query parameters, versioned by the listing tag
+        cache_key = redis_client.tagged_key(f"events:all:{request.query_string.decode()}", [EVENT_LISTING_TAG])
         
-        # Try to get cached data
-        cached_data = redis_client.get_cached_events(cache_key)
-        if cached_data:
-            return cached_data
-            
+        # Only one worker rebuilds an expired page, the others wait for it or get the stale copy
+        try:
+            return redis_client.get_or_compute(cache_key, self._build_page), 200
+        except ValueError as e:
+            return error_response(str(e))
+    
+    def _build_page(self):
+        """Query one page of events for the current request and return the response
+        body. Raises ValueError for bad parameters."""
         category = request.args.get('category')
         search = request.args.get('search')
         start_date = request.args.get('start_date')
@@ -53,14 +64,14 @@ class EventListResource(Resource):
                 start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
                 query = query.filter(Event.start_datetime >= start_date)
             except ValueError:
-                return error_response("Invalid start_date format")
+                raise ValueError("Invalid start_date format")
                 
         if end_date:
             try:
                 end_date = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
                 query = query.filter(Event.end_datetime <= end_date)
             except ValueError:
-                return error_response("Invalid end_datetime format")
+                raise ValueError("Invalid end_datetime format")
                 
         if organizer_id:
             query = query.filter(Event.organizer_id == organizer_id)
@@ -69,22 +80,72 @@ class EventListResource(Resource):
             location_term = f"%{location}%"
             query = query.filter(Event.location.ilike(location_term))
             
+        # Bounded page size
+        per_page = request.args.get('per_page', EVENTS_PER_PAGE, type=int)
+        per_page = max(1, min(per_page, EVENTS_MAX_PER_PAGE))
+        
+        # Decode keyset cursor (phase + last seen start_datetime/id)
+        phase, after_start, after_id = 'upcoming', None, None
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                payload = decode_cursor(cursor)
+                phase = payload['p']
+                if phase not in ('upcoming', 'past') or (phase == 'upcoming' and not payload.get('s')):
+                    raise ValueError("Invalid cursor")
+                if payload.get('s'):
+                    after_start = datetime.fromisoformat(payload['s'])
+                    after_id = payload['i']
+            except (ValueError, KeyError, TypeError):
+                raise ValueError("Invalid cursor")
+            if phase == 'past' and not show_past:
+                raise ValueError("Invalid cursor")
+        
         # Get current time for sorting
         current_time = datetime.utcnow()
         
-        # Split events into upcoming and past
-        upcoming_events = query.filter(Event.start_datetime >= current_time).order_by(Event.start_datetime).all()
-        past_events = query.filter(Event.start_datetime < current_time).order_by(Event.start_datetime.desc()).all() if show_past else []
-        
-        # Combine events with upcoming first
-        all_events = upcoming_events + past_events
-        
-        result = success_response(data=[event.to_dict() for event in all_events])
-        
-        # Cache the results
-        redis_client.set_cached_events(cache_key, result)
-        
-        return result
+        # Upcoming events first (soonest first), then past events (most recent first)
+        events = []
+        next_cursor = None
+        if phase == 'upcoming':
+            upcoming_query = query.filter(Event.start_datetime >= current_time)
+            if after_start is not None:
+                upcoming_query = upcoming_query.filter(db.or_(
+                    Event.start_datetime > after_start,
+                    db.and_(Event.start_datetime == after_start, Event.id > after_id)
+                ))
+            events = upcoming_query.order_by(Event.start_datetime, Event.id).limit(per_page + 1).all()
+            
+            if len(events) > per_page:
+                events = events[:per_page]
+                next_cursor = _event_cursor('upcoming', events[-1])
+            elif show_past:
+                # Upcoming events exhausted, fill the rest of the page with past events
+                phase, after_start, after_id = 'past', None, None
+        
+        if phase == 'past':
+            remaining = per_page - len(events)
+            past_query = query.filter(Event.start_datetime < current_time)
+            if after_start is not None:
+                past_query = past_query.filter(db.or_(
+                    Event.start_datetime < after_start,
+                    db.and_(Event.start_datetime == after_start, Event.id < after_id)
+                ))
+            past_events = past_query.order_by(Event.start_datetime.desc(), Event.id.desc()).limit(remaining + 1).all()
+            
+            if len(past_events) > remaining:
+                past_events = past_events[:remaining]
+                # A page filled entirely by upcoming events resumes at the start of the past phase
+                next_cursor = _event_cursor('past', past_events[-1]) if past_events else encode_cursor({'p': 'past'})
+            events += past_events
+        
+        # Cached per page by get(): the cursor is part of the query string
+        body, _ = cursor_response(
+            Event.to_dict_many(events),
+            next_cursor=next_cursor,
+            per_page=per_page
+        )
+        return body
     
     @jwt_required()
     def post(self):
@@ -187,6 +248,7 @@ class EventListResource(Resource):
         try:
             db.session.add(new_event)
             db.session.commit()
+            redis_client.invalidate_event_cache(new_event.id)
             
             return success_response(
                 data=new_event.to_dict(include_organizer=True),
@@ -206,7 +268,7 @@ class EventListResource(Resource):
 class EventResource(Resource):
     def get(self, event_id):
         # Try to get cached event
-        cache_key = f"event:{event_id}"
+        cache_key = redis_client.tagged_key(f"event:{event_id}", [f"event:{event_id}"])
         cached_data = redis_client.get_cached_events(cache_key)
         if cached_data:
             return cached_data
@@ -380,6 +442,7 @@ class EventCategoriesResource(Resource):
         
         try:
             db.session.commit()
+            redis_client.invalidate_event_cache(event_id)
             return success_response(
                 data=[category.to_dict() for category in event.categories],
                 message="Category added successfully"
@@ -398,27 +461,24 @@ class FeaturedEventsResource(Resource):
         start_date = request.args.get('start_date')
         
         # Generate cache key based on start_date
-        cache_key = f"events:featured:{start_date if start_date else 'all'}"
-        cached_data = redis_client.get_cached_events(cache_key)
-        if cached_data:
-            return cached_data
-            
-        # Build query
-        query = Event.query.filter_by(featured=True)
+        cache_key = redis_client.tagged_key(f"events:featured:{start_date if start_date else 'all'}", [EVENT_LISTING_TAG])
         
         # Apply start_date filter if provided
         if start_date:
             try:
                 start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                query = query.filter(Event.start_datetime >= start_date)
             except ValueError:
                 return error_response("Invalid start_date format")
         
+        return redis_client.get_or_compute(cache_key, lambda: self._build_featured(start_date)), 200
+    
+    def _build_featured(self, start_date):
+        # Build query
+        query = Event.query.filter_by(featured=True)
+        if start_date:
+            query = query.filter(Event.start_datetime >= start_date)
+        
         # Get and sort events
         featured_events = query.order_by(Event.start_datetime).all()
-        result = success_response(data=[event.to_dict() for event in featured_events])
-        
-        # Cache the result
-        redis_client.set_cached_events(cache_key, result)
-        
-        return result
\ No newline at end of file
+        body, _ = success_response(data=Event.to_dict_many(featured_events))
+        return body
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+Idempotency store on Redis.
+
+The first request for a key claims it with SET NX and, once handled, stores
+its response under the key, so duplicates get the stored response back
+without touching the database or the payment gateway. The store fails open:
+without Redis every request is handled.
+
+    idem:<scope>  JSON {'state': 'pending' | 'done', 'fingerprint', 'response': [body, status]}
+"""
+import hashlib
+import json
+import logging
+
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = 24 * 3600  # seconds a stored response is replayed
+# Seconds a claimed key blocks duplicates while the first request runs. Well
+# above the worst-case purchase, about 330s: the 30s inventory lock wait, two
+# OAuth token refreshes (5s waiting on another worker's, then 3 attempts of up
+# to 35s plus backoff each) and two STK pushes of up to 35s
+PENDING_TTL = 600
+
+def fingerprint(payload):
+    """Stable hash of a request payload, to catch a key reused for a different request"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different payload"""
+
+class IdempotencyStore:
+    def __init__(self, redis_manager, ttl=IDEMPOTENCY_TTL, pending_ttl=PENDING_TTL):
+        self._redis = redis_manager
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+
+    def begin(self, scope, request_fingerprint=None):
+        """Claim scope for this request.
+
+        Returns (True, None) when the caller should handle the request,
+        (False, response) for a completed duplicate and (False, None) while
+        the first request is still running.
+        """
+        client = self._redis.client
+        if client is None:
+            return True, None
+        key = f"idem:{scope}"
+        record = {'state': 'pending', 'fingerprint': request_fingerprint}
+        try:
+            if client.set(key, json.dumps(record), nx=True, ex=self.pending_ttl):
+                return True, None
+            stored = client.get(key)
+        except Exception as e:
+            logger.error(f"Idempotency store unavailable for {scope}: {str(e)}")
+            return True, None
+
+        if stored is None:
+            # Expired between the two calls
+            return self.begin(scope, request_fingerprint)
+        stored = json.loads(stored)
+        if request_fingerprint and stored.get('fingerprint') not in (None, request_fingerprint):
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+        if stored['state'] == 'done':
+            body, status = stored['response']
+            return False, (body, status)
+        return False, None
+
+    def finish(self, scope, response, request_fingerprint=None):
+        """Store the (body, status) response for duplicates. Server errors are
+        not stored, the key is freed so the request can be retried."""
+        client = self._redis.client
+        if client is None:
+            return
+        body, status = response
+        try:
+            if status >= 500:
+                client.delete(f"idem:{scope}")
+                return
+            record = {'state': 'done', 'fingerprint': request_fingerprint, 'response': [body, status]}
+            client.set(f"idem:{scope}", json.dumps(record), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Error storing idempotent response for {scope}: {str(e)}")
+
+    def abandon(self, scope):
+        """Free a claimed key without storing a response"""
+        client = self._redis.client
+        if client is None:
+            return
+        try:
+            client.delete(f"idem:{scope}")
+        except Exception as e:
+            logger.error(f"Error releasing idempotency key {scope}: {str(e)}")
+
+idempotency_store = IdempotencyStore(redis_client)
@@ -0,0 +1,361 @@
+"""
+Redis-backed ticket inventory.
+
+Available counts per TicketType live in Redis and are reserved, released and
+confirmed with Lua scripts, so availability is enforced atomically across
+worker processes instead of under a per-process lock.
+
+Keys (single Redis instance, the scripts derive per-ticket-type keys themselves):
+    inventory:tt:<ticket_type_id>:available   tickets that can still be reserved
+    inventory:tt:<ticket_type_id>:held        tickets reserved by unexpired holds
+    inventory:hold:<hold_id>                  JSON [[ticket_type_id, quantity], ...]
+    inventory:holds                           sorted set of hold ids by expiry time
+    inventory:checkout:<checkout_request_id>  hold id of an initiated payment
+
+Counts are loaded lazily from the ticket_types table and re-derived from it
+with reconcile(): available = quantity - tickets_sold - held. reconcile_queue
+does so for the ticket types of upcoming events every RECONCILE_INTERVAL
+seconds, right away after Redis reconnects, and `flask reconcile-inventory`
+on demand.
+
+Holds that are neither confirmed nor released (the buyer never paid, or the
+process died mid-purchase) are returned to the available pool by sweep_queue,
+which releases expired holds every SWEEP_INTERVAL seconds.
+"""
+import json
+import logging
+import time
+import uuid
+
+from datetime import datetime
+
+import click
+import redis
+from flask.cli import with_appcontext
+from sqlalchemy import and_, or_
+
+from app2 import app
+from database import db
+from job_queue import DelayedJobQueue
+from models import Event, TicketType
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+HOLD_TTL = 600  # seconds a reservation is held while the buyer pays
+HOLDS_KEY = "inventory:holds"
+SWEEP_BATCH_SIZE = 500
+SWEEP_INTERVAL = 30  # seconds
+SWEEP_LOCK = "inventory-sweep"
+RECONCILE_INTERVAL = 300  # seconds
+RECONCILE_BATCH_SIZE = 500
+
+RESERVE_SCRIPT = """
+-- KEYS: holds set, hold key, then an (available, held) pair per item
+-- ARGV: hold id, expires at, items json, then a quantity per item
+local count = (#KEYS - 2) / 2
+for i = 1, count do
+    local available = redis.call('GET', KEYS[1 + 2 * i])
+    if not available then
+        return {'missing', i}
+    end
+    if tonumber(available) < tonumber(ARGV[3 + i]) then
+        return {'insufficient', i, tonumber(available)}
+    end
+end
+for i = 1, count do
+    redis.call('DECRBY', KEYS[1 + 2 * i], ARGV[3 + i])
+    redis.call('INCRBY', KEYS[2 + 2 * i], ARGV[3 + i])
+end
+redis.call('SET', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+return {'ok'}
+"""
+
+# Returns the held tickets to the available pool
+RELEASE_SCRIPT = """
+-- KEYS: holds set, hold key; ARGV: hold id
+local items = redis.call('GET', KEYS[2])
+if not items then
+    return 0
+end
+for _, item in ipairs(cjson.decode(items)) do
+    redis.call('INCRBY', 'inventory:tt:' .. item[1] .. ':available', item[2])
+    redis.call('DECRBY', 'inventory:tt:' .. item[1] .. ':held', item[2])
+end
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Releases up to a batch of expired holds, like RELEASE_SCRIPT for each
+RELEASE_EXPIRED_SCRIPT = """
+-- KEYS: holds set; ARGV: now, batch size
+local hold_ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, hold_id in ipairs(hold_ids) do
+    local hold_key = 'inventory:hold:' .. hold_id
+    local items = redis.call('GET', hold_key)
+    if items then
+        for _, item in ipairs(cjson.decode(items)) do
+            redis.call('INCRBY', 'inventory:tt:' .. item[1] .. ':available', item[2])
+            redis.call('DECRBY', 'inventory:tt:' .. item[1] .. ':held', item[2])
+        end
+        redis.call('DEL', hold_key)
+    end
+    redis.call('ZREM', KEYS[1], hold_id)
+end
+return #hold_ids
+"""
+
+# Turns a hold into a sale. If the hold is already gone (expired and released
+# before the payment came through) the sold items are taken from available again.
+CONFIRM_SCRIPT = """
+-- KEYS: holds set, hold key; ARGV: hold id, items json of the sale
+local items = redis.call('GET', KEYS[2])
+if not items then
+    for _, item in ipairs(cjson.decode(ARGV[2])) do
+        local available_key = 'inventory:tt:' .. item[1] .. ':available'
+        if redis.call('EXISTS', available_key) == 1 then
+            redis.call('DECRBY', available_key, item[2])
+        end
+    end
+    return 0
+end
+for _, item in ipairs(cjson.decode(items)) do
+    redis.call('DECRBY', 'inventory:tt:' .. item[1] .. ':held', item[2])
+end
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 1
+"""
+
+RECONCILE_SCRIPT = """
+-- KEYS: available, held; ARGV: quantity - tickets_sold, '1' to only load a missing count
+if ARGV[2] == '1' and redis.call('EXISTS', KEYS[1]) == 1 then
+    return tonumber(redis.call('GET', KEYS[1]))
+end
+local held = tonumber(redis.call('GET', KEYS[2]) or '0')
+local available = tonumber(ARGV[1]) - held
+redis.call('SET', KEYS[1], available)
+return available
+"""
+
+def _available_key(ticket_type_id):
+    return f"inventory:tt:{ticket_type_id}:available"
+
+def _held_key(ticket_type_id):
+    return f"inventory:tt:{ticket_type_id}:held"
+
+def _hold_key(hold_id):
+    return f"inventory:hold:{hold_id}"
+
+def _checkout_key(checkout_request_id):
+    return f"inventory:checkout:{checkout_request_id}"
+
+class InventoryUnavailable(Exception):
+    """Redis can't be reached, callers fall back to the database counts"""
+
+class InsufficientInventory(Exception):
+    def __init__(self, ticket_type, available):
+        super().__init__(f"Only {available} tickets available for {ticket_type.name}")
+        self.ticket_type = ticket_type
+        self.available = available
+
+class TicketInventory:
+    def __init__(self, redis_manager):
+        self._redis = redis_manager
+        self._scripts = {}
+
+    def _run(self, name, source, keys, args):
+        client = self._redis.client
+        if client is None:
+            raise InventoryUnavailable("Redis client not initialized")
+        if name not in self._scripts:
+            self._scripts[name] = client.register_script(source)
+        try:
+            return self._scripts[name](keys=keys, args=args, client=client)
+        except redis.RedisError as e:
+            logger.error(f"Inventory script {name} failed: {str(e)}")
+            raise InventoryUnavailable(str(e))
+
+    def reserve(self, items, ttl=HOLD_TTL):
+        """Atomically hold (ticket_type, quantity) items, all or nothing.
+
+        Returns the hold id. Raises InsufficientInventory naming the first
+        ticket type that can't cover its quantity.
+        """
+        merged = {}
+        for ticket_type, quantity in items:
+            if ticket_type.id in merged:
+                merged[ticket_type.id] = (ticket_type, merged[ticket_type.id][1] + quantity)
+            else:
+                merged[ticket_type.id] = (ticket_type, quantity)
+        items = list(merged.values())
+
+        hold_id = str(uuid.uuid4())
+        keys = [HOLDS_KEY, _hold_key(hold_id)]
+        for ticket_type, _ in items:
+            keys += [_available_key(ticket_type.id), _held_key(ticket_type.id)]
+        args = [
+            hold_id,
+            time.time() + ttl,
+            json.dumps([[ticket_type.id, quantity] for ticket_type, quantity in items])
+        ] + [quantity for _, quantity in items]
+
+        # A missing count is loaded from the database and the reservation retried
+        for _ in range(len(items) + 1):
+            result = self._run('reserve', RESERVE_SCRIPT, keys, args)
+            if result[0] == 'ok':
+                return hold_id
+            ticket_type = items[int(result[1]) - 1][0]
+            if result[0] == 'missing':
+                self.load(ticket_type)
+                continue
+            raise InsufficientInventory(ticket_type, int(result[2]))
+        raise InventoryUnavailable("Could not load inventory counts")
+
+    def release(self, hold_id):
+        """Return a hold's tickets to the available pool. False if it was already gone."""
+        return self._run('release', RELEASE_SCRIPT, [HOLDS_KEY, _hold_key(hold_id)], [hold_id]) == 1
+
+    def confirm(self, hold_id, items):
+        """Mark a hold as sold. items are the sold (ticket_type_id, quantity) pairs,
+        used only when the hold had already expired."""
+        sold = json.dumps([[ticket_type_id, quantity] for ticket_type_id, quantity in items])
+        return self._run('confirm', CONFIRM_SCRIPT, [HOLDS_KEY, _hold_key(hold_id)], [hold_id, sold]) == 1
+
+    def attach_checkout(self, hold_id, checkout_request_id, ttl=HOLD_TTL * 6):
+        """Remember which hold an M-Pesa checkout belongs to"""
+        try:
+            self._redis.client.set(_checkout_key(checkout_request_id), hold_id, ex=ttl)
+        except Exception as e:
+            logger.error(f"Error attaching checkout {checkout_request_id} to hold {hold_id}: {str(e)}")
+
+    def detach_checkout(self, checkout_request_id):
+        """Forget a checkout's hold, e.g. when its payment couldn't be recorded"""
+        try:
+            self._redis.client.delete(_checkout_key(checkout_request_id))
+        except Exception as e:
+            logger.error(f"Error detaching checkout {checkout_request_id}: {str(e)}")
+
+    def confirm_checkout(self, checkout_request_id, items):
+        """Confirm the hold of a completed payment. Checkouts without one (made while
+        Redis was down, or already confirmed) are left to reconcile_queue."""
+        hold_id = self._pop_checkout(checkout_request_id)
+        return self.confirm(hold_id, items) if hold_id else False
+
+    def release_checkout(self, checkout_request_id):
+        hold_id = self._pop_checkout(checkout_request_id)
+        return self.release(hold_id) if hold_id else False
+
+    def _pop_checkout(self, checkout_request_id):
+        client = self._redis.client
+        if client is None:
+            raise InventoryUnavailable("Redis client not initialized")
+        try:
+            pipe = client.pipeline()
+            pipe.get(_checkout_key(checkout_request_id))
+            pipe.delete(_checkout_key(checkout_request_id))
+            return pipe.execute()[0]
+        except redis.RedisError as e:
+            raise InventoryUnavailable(str(e))
+
+    def release_expired(self, now=None, batch_size=SWEEP_BATCH_SIZE):
+        """Release up to batch_size expired holds. Returns how many were released."""
+        return self._run('release_expired', RELEASE_EXPIRED_SCRIPT, [HOLDS_KEY], [now or time.time(), batch_size])
+
+    def sweep_expired_holds(self, batch_size=SWEEP_BATCH_SIZE, lock_timeout=60):
+        """Release every hold that has expired, batch_size at a time, under a
+        lock so one process sweeps at a time. Returns the number released, or
+        None if another process is sweeping."""
+        if not self._redis.acquire_lock(SWEEP_LOCK, timeout=lock_timeout):
+            return None
+        try:
+            now = time.time()
+            released = 0
+            while True:
+                count = self.release_expired(now, batch_size)
+                released += count
+                if count < batch_size:
+                    break
+            if released:
+                logger.info(f"Released {released} expired inventory holds")
+            return released
+        finally:
+            self._redis.release_lock(SWEEP_LOCK)
+
+    def load(self, ticket_type):
+        """Load a ticket type's count from the database unless Redis already has one"""
+        return self._reconcile(ticket_type, only_if_missing=True)
+
+    def reconcile(self, ticket_types):
+        """Re-derive available counts from the ticket_types table. Returns {ticket_type_id: available}."""
+        return {ticket_type.id: self._reconcile(ticket_type) for ticket_type in ticket_types}
+
+    def _reconcile(self, ticket_type, only_if_missing=False):
+        return self._run(
+            'reconcile',
+            RECONCILE_SCRIPT,
+            [_available_key(ticket_type.id), _held_key(ticket_type.id)],
+            [ticket_type.quantity - ticket_type.tickets_sold, '1' if only_if_missing else '0']
+        )
+
+ticket_inventory = TicketInventory(redis_client)
+
+def sweep_job(job_id, attempt):
+    """Run by sweep_queue every SWEEP_INTERVAL seconds"""
+    try:
+        ticket_inventory.sweep_expired_holds()
+    except InventoryUnavailable as e:
+        logger.error(f"Could not sweep expired inventory holds: {str(e)}")
+    return SWEEP_INTERVAL
+
+sweep_queue = DelayedJobQueue('inventory-sweep', sweep_job, workers=1)
+
+def schedule_sweep():
+    """Queue the periodic sweep unless it is already queued"""
+    sweep_queue.schedule('expired-holds', 0, replace=False)
+
+def reconcile_all():
+    """Re-derive the available counts of every ticket type of an event that
+    hasn't ended. Returns how many were reconciled."""
+    now = datetime.utcnow()
+    ticket_types = TicketType.query.join(Event, Event.id == TicketType.event_id).filter(
+        or_(Event.end_datetime >= now, and_(Event.end_datetime.is_(None), Event.start_datetime >= now))
+    ).order_by(TicketType.id).yield_per(RECONCILE_BATCH_SIZE)
+    count = 0
+    for ticket_type in ticket_types:
+        ticket_inventory.reconcile([ticket_type])
+        count += 1
+    return count
+
+@click.command('reconcile-inventory')
+@with_appcontext
+def reconcile_inventory():
+    """Re-derive the Redis ticket counts of upcoming events from the database"""
+    try:
+        click.echo(f"Reconciled inventory of {reconcile_all()} ticket types")
+    except InventoryUnavailable as e:
+        raise click.ClickException(f"Redis is unavailable: {str(e)}")
+
+def reconcile_job(job_id, attempt):
+    """Run by reconcile_queue every RECONCILE_INTERVAL seconds"""
+    try:
+        with app.app_context():
+            count = reconcile_all()
+            logger.info(f"Reconciled inventory of {count} ticket types")
+    except InventoryUnavailable as e:
+        logger.error(f"Could not reconcile inventory: {str(e)}")
+    finally:
+        with app.app_context():
+            db.session.remove()
+    return RECONCILE_INTERVAL
+
+reconcile_queue = DelayedJobQueue('inventory-reconcile', reconcile_job, workers=1)
+
+def schedule_reconcile(now=False):
+    """Queue the periodic reconcile unless it is already queued, or run it now"""
+    reconcile_queue.schedule('ticket-types', 0, replace=now)
+
+# Counts may have drifted, or been lost, while Redis was unreachable
+redis_client.on_reconnect(lambda: schedule_reconcile(now=True))
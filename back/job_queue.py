@@ -0,0 +1,275 @@
+"""
+Durable background work queues on Redis.
+
+DelayedJobQueue: each job is a member of jobs:<name>:due scored by the time it is due, with
+its attempt number in the jobs:<name>:attempts hash. Every process runs one
+poller thread that claims due jobs in batches and hands them to a small
+worker pool. A claim pushes the job's score forward by a lease instead of
+removing it, so jobs survive restarts and a job whose worker died is picked
+up again once its lease runs out.
+
+StreamQueue: payloads appended to a Redis stream and consumed in batches by
+a consumer group. Entries stay pending until their batch is handled, so a
+crashed worker's entries are claimed by another after claim_idle_ms.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+CLAIM_SCRIPT = """
+-- KEYS: due set, attempts hash; ARGV: now, lease expiry, batch size
+local jobs = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])
+local claimed = {}
+for _, job_id in ipairs(jobs) do
+    redis.call('ZADD', KEYS[1], ARGV[2], job_id)
+    table.insert(claimed, job_id)
+    table.insert(claimed, redis.call('HGET', KEYS[2], job_id) or '1')
+end
+return claimed
+"""
+
+class DelayedJobQueue:
+    """Runs handler(job_id, attempt) for each job once it is due.
+
+    The handler returns a delay in seconds to run the job again (with
+    attempt + 1), or None when the job is done. A handler that raises is
+    retried after error_delay seconds, up to max_attempts.
+    """
+    def __init__(self, name, handler, workers=4, poll_interval=1, lease=120, error_delay=30, max_attempts=10):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.error_delay = error_delay
+        self.max_attempts = max_attempts
+        self.due_key = f"jobs:{name}:due"
+        self.attempts_key = f"jobs:{name}:attempts"
+        self._claim_script = None
+        self._executor = None
+        self._poller = None
+        self._pid = None
+        self._slots = threading.Semaphore(workers)
+        self._start_lock = threading.Lock()
+
+    def schedule(self, job_id, delay, attempt=1, replace=True):
+        """Run job_id after delay seconds. With replace=False a job that is
+        already queued (or running) keeps its due time. Returns False if Redis
+        is unavailable."""
+        client = redis_client.client
+        if client is None:
+            logger.error(f"Redis unavailable, could not schedule {self.name} job {job_id}")
+            return False
+        try:
+            pipe = client.pipeline()
+            if replace:
+                pipe.hset(self.attempts_key, job_id, attempt)
+            else:
+                pipe.hsetnx(self.attempts_key, job_id, attempt)
+            pipe.zadd(self.due_key, {job_id: time.time() + delay}, nx=not replace)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error scheduling {self.name} job {job_id}: {str(e)}")
+            return False
+        self.start()
+        return True
+
+    def complete(self, job_id):
+        client = redis_client.client
+        if client is None:
+            return
+        pipe = client.pipeline()
+        pipe.zrem(self.due_key, job_id)
+        pipe.hdel(self.attempts_key, job_id)
+        pipe.execute()
+
+    def start(self):
+        """Start this process's poller and workers (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-job")
+            self._slots = threading.Semaphore(self.workers)
+            self._poller = threading.Thread(target=self._poll_loop, name=f"{self.name}-poller", daemon=True)
+            self._poller.start()
+            self._pid = os.getpid()
+
+    def _poll_loop(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming {self.name} jobs: {str(e)}")
+                claimed = []
+            for job_id, attempt in claimed:
+                self._executor.submit(self._run, job_id, attempt)
+            if not claimed:
+                time.sleep(self.poll_interval)
+
+    def _claim(self):
+        """Claim as many due jobs as there are idle workers"""
+        client = redis_client.client
+        if client is None:
+            return []
+        free = 0
+        while free < self.workers and self._slots.acquire(blocking=False):
+            free += 1
+        if not free:
+            return []
+        if self._claim_script is None:
+            self._claim_script = client.register_script(CLAIM_SCRIPT)
+        now = time.time()
+        try:
+            result = self._claim_script(
+                keys=[self.due_key, self.attempts_key],
+                args=[now, now + self.lease, free],
+                client=client
+            )
+        except Exception:
+            for _ in range(free):
+                self._slots.release()
+            raise
+        claimed = [(result[i], int(result[i + 1])) for i in range(0, len(result), 2)]
+        for _ in range(free - len(claimed)):
+            self._slots.release()
+        return claimed
+
+    def _run(self, job_id, attempt):
+        try:
+            try:
+                delay = self.handler(job_id, attempt)
+            except Exception as e:
+                logger.error(f"{self.name} job {job_id} failed on attempt {attempt}: {str(e)}")
+                delay = self.error_delay if attempt < self.max_attempts else None
+
+            if delay is None:
+                self.complete(job_id)
+            else:
+                self.schedule(job_id, delay, attempt + 1)
+        except Exception as e:
+            # Left claimed, the job runs again when its lease expires
+            logger.error(f"Error finishing {self.name} job {job_id}: {str(e)}")
+        finally:
+            self._slots.release()
+
+class StreamQueue:
+    """Runs handler(payloads) on batches of payloads added with add().
+
+    A batch is acknowledged once the handler returns. If it raises, the
+    batch stays pending and is retried; entries delivered max_deliveries
+    times are moved to the stream:<name>:dead stream. The handler can also
+    return the indexes of payloads it can't handle yet, which stay pending
+    and are retried after claim_idle_ms.
+    """
+    def __init__(self, name, handler, workers=2, batch_size=50, block_ms=1000, claim_idle_ms=60000,
+                 max_deliveries=5, maxlen=100000):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.maxlen = maxlen
+        self.stream = f"stream:{name}"
+        self.dead_stream = f"stream:{name}:dead"
+        self.group = f"{name}-workers"
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def add(self, payload):
+        """Append a payload. Returns its entry id, or None if Redis is unavailable."""
+        client = redis_client.client
+        if client is None:
+            return None
+        try:
+            entry_id = client.xadd(self.stream, {'data': json.dumps(payload)}, maxlen=self.maxlen, approximate=True)
+        except Exception as e:
+            logger.error(f"Error adding to {self.stream}: {str(e)}")
+            return None
+        self.start()
+        return entry_id
+
+    def start(self):
+        """Start this process's consumers (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            try:
+                redis_client.client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+            except Exception as e:
+                if 'BUSYGROUP' not in str(e):
+                    logger.error(f"Error creating consumer group for {self.stream}: {str(e)}")
+                    return
+            prefix = f"{socket.gethostname()}-{os.getpid()}"
+            for i in range(self.workers):
+                threading.Thread(
+                    target=self._consume, args=(f"{prefix}-{i}",), name=f"{self.name}-consumer-{i}", daemon=True
+                ).start()
+            self._pid = os.getpid()
+
+    def _consume(self, consumer):
+        last_reclaim = 0
+        while True:
+            try:
+                entries = []
+                if time.monotonic() - last_reclaim > self.claim_idle_ms / 2000:
+                    last_reclaim = time.monotonic()
+                    entries = self._reclaim(consumer)
+                if not entries:
+                    entries = self._read(consumer)
+                if entries:
+                    self._process(entries)
+            except Exception as e:
+                logger.error(f"Error consuming {self.stream}: {str(e)}")
+                time.sleep(1)
+
+    def _read(self, consumer):
+        response = redis_client.client.xreadgroup(
+            self.group, consumer, {self.stream: '>'}, count=self.batch_size, block=self.block_ms
+        )
+        return response[0][1] if response else []
+
+    def _reclaim(self, consumer):
+        """Claim entries left pending by a crashed or failing consumer"""
+        client = redis_client.client
+        pending = client.xpending_range(
+            self.stream, self.group, min='-', max='+', count=self.batch_size, idle=self.claim_idle_ms
+        )
+        if not pending:
+            return []
+        delivered = {item['message_id']: item['times_delivered'] for item in pending}
+        entries = client.xclaim(self.stream, self.group, consumer, self.claim_idle_ms, list(delivered))
+        retry = []
+        for entry_id, fields in entries:
+            if fields and delivered.get(entry_id, 0) < self.max_deliveries:
+                retry.append((entry_id, fields))
+                continue
+            logger.error(f"Giving up on {self.stream} entry {entry_id} after {delivered.get(entry_id)} deliveries")
+            pipe = client.pipeline()
+            if fields:
+                pipe.xadd(self.dead_stream, fields, maxlen=self.maxlen, approximate=True)
+            pipe.xack(self.stream, self.group, entry_id)
+            pipe.execute()
+        return retry
+
+    def _process(self, entries):
+        # Trimmed entries come back without fields and are just acknowledged
+        batch = [(entry_id, json.loads(fields['data'])) for entry_id, fields in entries if fields]
+        retry = set(self.handler([payload for _, payload in batch]) or ()) if batch else set()
+        left_pending = {batch[i][0] for i in retry}
+        done = [entry_id for entry_id, _ in entries if entry_id not in left_pending]
+        if done:
+            redis_client.client.xack(self.stream, self.group, *done)
@@ -0,0 +1,144 @@
+"""
+Pooled SMTP transport for outgoing mail.
+
+mail.send() opens a new SMTP session, with STARTTLS and login, for every
+message. SMTPPool keeps up to MAIL_POOL_SIZE authenticated sessions per
+process and sends many messages over each:
+
+- a session that fails at the connection level is dropped and the message
+  retried once on a fresh one,
+- sessions idle for longer than MAIL_POOL_IDLE_TIMEOUT seconds are
+  reopened before use, as the server has usually closed them by then,
+- sends are throttled to MAIL_SEND_RATE messages per second per process
+  (0 for no limit), so a burst of ticket emails stays under the provider's
+  limits.
+
+Flask-Mail's Connection does the sending, so MAIL_SUPPRESS_SEND, the
+email_dispatched signal and MAIL_MAX_EMAILS work as with mail.send().
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+
+from flask import current_app
+from flask_mail import Connection
+
+logger = logging.getLogger(__name__)
+
+def is_connection_error(e):
+    """Whether the session can't be reused after e. SMTPException subclasses
+    OSError, so only socket errors that aren't SMTP replies count, besides
+    the server hanging up or failing the handshake."""
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPHeloError)):
+        return True
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+class RateLimiter:
+    """Token bucket: rate acquisitions per second on average, in bursts of
+    up to burst. A rate of 0 doesn't limit."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take the token now and wait for it outside the lock
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class SMTPPool:
+    """Up to size open SMTP sessions shared by the threads of a process.
+    Configured from the app config on first use (again after a fork)."""
+    def __init__(self):
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _setup(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            config = current_app.config
+            self.size = config.get('MAIL_POOL_SIZE', 4)
+            self.idle_timeout = config.get('MAIL_POOL_IDLE_TIMEOUT', 60)
+            self._slots = threading.BoundedSemaphore(self.size)
+            self._idle = []  # (connection, last used), most recently used last
+            self._idle_lock = threading.Lock()
+            self.limiter = RateLimiter(config.get('MAIL_SEND_RATE', 0))
+            self._pid = os.getpid()
+
+    def send(self, msg):
+        """Send msg over a pooled session. Connection errors are retried once on
+        a new session; errors about the message itself (refused recipients or
+        sender, a rejected DATA) are raised right away and the session kept."""
+        self._setup()
+        self.limiter.acquire()
+        self._slots.acquire()
+        try:
+            for attempt in range(2):
+                connection = self._checkout()
+                try:
+                    connection.send(msg)
+                except Exception as e:
+                    if not is_connection_error(e):
+                        # The session is still good, smtplib resets it after a refused message
+                        self._checkin(connection)
+                        raise
+                    self._close(connection)
+                    if attempt:
+                        raise
+                    logger.warning(f"SMTP session failed, retrying on a new one: {str(e)}")
+                    continue
+                self._checkin(connection)
+                return
+        finally:
+            self._slots.release()
+
+    def _checkout(self):
+        with self._idle_lock:
+            idle = self._idle.pop() if self._idle else None
+        if idle:
+            connection, last_used = idle
+            if time.monotonic() - last_used < self.idle_timeout:
+                return connection
+            self._close(connection)
+        mail = current_app.extensions['mail']
+        return Connection(mail).__enter__()
+
+    def _checkin(self, connection):
+        with self._idle_lock:
+            self._idle.append((connection, time.monotonic()))
+
+    def _close(self, connection):
+        try:
+            if connection.host is not None:
+                connection.host.quit()
+        except Exception:
+            try:
+                connection.host.close()
+            except Exception:
+                pass
+
+    def close(self):
+        """Close the idle sessions"""
+        if self._pid != os.getpid():
+            return
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+smtp_pool = SMTPPool()
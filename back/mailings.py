@@ -0,0 +1,287 @@
+"""
+Organizer mailings to everyone holding tickets for an event.
+
+    POST /api/events/<event_id>/mailings   {"subject", "message", "send_at"?}
+
+schedules an EventMailing; mailing_queue sends it from send_at on. Each run
+streams the recipients (users with a purchased or used ticket, one email
+each however many tickets they hold) in user id order from a server-side
+cursor, renders them from the reminder template compiled once for the
+mailing, and sends through the pooled SMTP sessions at MAIL_SEND_RATE (see
+mail_transport.py).
+
+Progress is checkpointed to the mailing row every MAILING_CHECKPOINT_EVERY
+recipients, on a connection of its own so the cursor stays open. A run
+stops after MAILING_SLICE_SECONDS and requeues itself, so it stays inside
+its job lease; after a crash the job is picked up again once the lease runs
+out and resumes after the checkpoint, resending at most
+MAILING_CHECKPOINT_EVERY emails. A cancelled mailing stops at the next
+checkpoint.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from smtplib import SMTPRecipientsRefused, SMTPResponseException
+
+from flask import request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_mail import BadHeaderError, Message
+from flask_restful import Resource
+
+from app2 import app
+from config2 import Config2
+from database import db
+from email_templates import reminder_email_templates
+from job_queue import DelayedJobQueue
+from mail_transport import is_connection_error, smtp_pool
+from models import Attendee, Event, EventMailing, Ticket, User
+from utils.response import success_response, error_response
+
+logger = logging.getLogger(__name__)
+
+MAILING_BATCH_SIZE = 500  # rows per cursor fetch
+MAILING_CHECKPOINT_EVERY = 100
+MAILING_SLICE_SECONDS = 120
+MAILING_RETRY_DELAY = 60  # seconds, doubled after every run that fails without progress
+MAILING_MAX_RETRIES = 5
+MAILING_RELAY_INTERVAL = 60
+RECIPIENT_STATUSES = ('purchased', 'used')
+# Errors about one recipient's message. Permanent ones (5xx) are counted as
+# failed and skipped; temporary ones (4xx), like connection and database
+# errors, stop the run, which is retried from the recipient after a backoff.
+MESSAGE_ERRORS = (SMTPRecipientsRefused, SMTPResponseException, BadHeaderError)
+
+class MailingCancelled(Exception):
+    pass
+
+def _is_permanent(e):
+    """Whether a message error rejects the message for good, rather than for now"""
+    if isinstance(e, SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    if isinstance(e, SMTPResponseException):
+        return e.smtp_code >= 500
+    return True
+
+def _recipients(event_id, after_user_id):
+    """(user id, email, first name, last name) of the event's ticket holders
+    after after_user_id, in user id order"""
+    query = db.session.query(User.id, User.email, User.first_name, User.last_name)\
+        .join(Attendee, Attendee.user_id == User.id)\
+        .join(Ticket, Ticket.attendee_id == Attendee.id)\
+        .filter(Ticket.event_id == event_id, Ticket.satus.in_(RECIPIENT_STATUSES))\
+        .distinct()\
+        .order_by(User.id)
+    if after_user_id:
+        query = query.filter(User.id > after_user_id)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return query.yield_per(MAILING_BATCH_SIZE)
+    # SQLite keeps a read lock while a cursor is open, which would block the checkpoints
+    return query.all()
+
+def _checkpoint(mailing_id, **values):
+    """Write progress on its own connection. Raises MailingCancelled if the
+    mailing is no longer being sent."""
+    table = EventMailing.__table__
+    with db.engine.begin() as connection:
+        result = connection.execute(
+            table.update()
+            .where(table.c.id == mailing_id, table.c.status == 'sending')
+            .values(**values)
+        )
+    if not result.rowcount:
+        raise MailingCancelled(mailing_id)
+
+def send_mailing(mailing_id, attempt=1):
+    """Send a slice of a mailing. Run by mailing_queue; returns 0 to carry on
+    with the next slice, a delay to retry after, or None once done."""
+    try:
+        with app.app_context():
+            mailing = EventMailing.query.get(mailing_id)
+            if not mailing or mailing.status not in ('scheduled', 'sending'):
+                return
+            now = datetime.utcnow()
+            if mailing.send_at > now:
+                return (mailing.send_at - now).total_seconds()
+            if mailing.status == 'scheduled':
+                mailing.status = 'sending'
+                mailing.started_at = now
+                db.session.commit()
+
+            email = reminder_email_templates.compile(mailing.event, mailing.subject, mailing.message)
+            sender = (Config2.EMAIL_SENDER_NAME, Config2.MAIL_USERNAME)
+            last_user_id = mailing.last_user_id
+            sent, failed, retries = mailing.sent_count, mailing.failed_count, mailing.retries
+            progressed = False
+            unsaved = 0
+            deadline = time.monotonic() + MAILING_SLICE_SECONDS
+            try:
+                for user_id, address, first_name, last_name in _recipients(mailing.event_id, last_user_id):
+                    text, html = email.render(first_name, last_name)
+                    msg = Message(subject=email.subject, recipients=[address], sender=sender, charset="utf-8")
+                    msg.body = text
+                    msg.html = html
+                    try:
+                        smtp_pool.send(msg)
+                        sent += 1
+                    except MESSAGE_ERRORS as e:
+                        if is_connection_error(e) or not _is_permanent(e):
+                            raise
+                        logger.warning(f"Mailing {mailing_id}: email to {address!r} failed: {str(e)}")
+                        failed += 1
+                    last_user_id = user_id
+                    progressed = True
+                    unsaved += 1
+                    if unsaved >= MAILING_CHECKPOINT_EVERY or time.monotonic() > deadline:
+                        _checkpoint(mailing_id, last_user_id=last_user_id, sent_count=sent, failed_count=failed, retries=0)
+                        unsaved = 0
+                        if time.monotonic() > deadline:
+                            return 0
+            except MailingCancelled:
+                logger.info(f"Mailing {mailing_id} cancelled after {sent} emails")
+                return
+            except Exception as e:
+                db.session.rollback()
+                # Save what was sent before the error, so a retry resumes after it
+                retries = 0 if progressed else retries + 1
+                values = {'last_user_id': last_user_id, 'sent_count': sent, 'failed_count': failed,
+                          'retries': retries, 'last_error': str(e)[:1000]}
+                if retries > MAILING_MAX_RETRIES:
+                    values.update(status='failed', finished_at=datetime.utcnow())
+                try:
+                    _checkpoint(mailing_id, **values)
+                except MailingCancelled:
+                    return
+                if retries > MAILING_MAX_RETRIES:
+                    logger.error(f"Giving up on mailing {mailing_id} after {sent} emails: {str(e)}")
+                    return
+                delay = MAILING_RETRY_DELAY * (2 ** max(retries - 1, 0))
+                logger.warning(f"Mailing {mailing_id} failed after {sent} emails, retrying in {delay}s: {str(e)}")
+                return delay
+
+            try:
+                _checkpoint(mailing_id, last_user_id=last_user_id, sent_count=sent, failed_count=failed,
+                            retries=0, status='sent', finished_at=datetime.utcnow())
+            except MailingCancelled:
+                return
+            logger.info(f"Mailing {mailing_id} sent to {sent} attendees ({failed} failed)")
+    finally:
+        with app.app_context():
+            db.session.remove()
+
+def relay_mailings(job_id, attempt=1):
+    """Queue mailings that are due but not queued, e.g. scheduled while Redis
+    was down. Run by mailing_relay_queue every MAILING_RELAY_INTERVAL seconds."""
+    try:
+        with app.app_context():
+            due = db.session.query(EventMailing.id).filter(
+                EventMailing.status.in_(['scheduled', 'sending']),
+                EventMailing.send_at <= datetime.utcnow()
+            )
+            for (mailing_id,) in due:
+                mailing_queue.schedule(mailing_id, 0, replace=False)
+    except Exception as e:
+        logger.error(f"Error relaying mailings: {str(e)}")
+    finally:
+        with app.app_context():
+            db.session.remove()
+    return MAILING_RELAY_INTERVAL
+
+# Runs get their own lease on top of the slice so they're never claimed twice
+mailing_queue = DelayedJobQueue('mailings', send_mailing, workers=1, lease=MAILING_SLICE_SECONDS + 180)
+mailing_relay_queue = DelayedJobQueue('mailing-relay', relay_mailings, workers=1)
+
+def schedule_mailing_relay():
+    """Queue the periodic mailing relay unless it is already queued"""
+    mailing_relay_queue.schedule('mailings', 0, replace=False)
+
+def _event_for_organizer(event_id):
+    """(event, None) if the current user may mail the event's attendees, else (None, error response)"""
+    user = User.query.get(get_jwt_identity())
+    if not user:
+        return None, error_response("User not found", 404)
+    event = Event.query.get(event_id)
+    if not event:
+        return None, error_response("Event not found", 404)
+    if not user.has_role('admin') and not (user.organizer and user.organizer.id == event.organizer_id):
+        return None, error_response("Unauthorized. You can only mail attendees of events you organize.", 403)
+    return event, None
+
+class EventMailingListResource(Resource):
+    @jwt_required()
+    def get(self, event_id):
+        """List an event's mailings with their progress"""
+        event, error = _event_for_organizer(event_id)
+        if error:
+            return error
+        mailings = EventMailing.query.filter_by(event_id=event.id).order_by(EventMailing.created_at.desc()).all()
+        return success_response(data=[mailing.to_dict() for mailing in mailings])
+
+    @jwt_required()
+    def post(self, event_id):
+        """Schedule a mailing to everyone holding tickets for the event"""
+        event, error = _event_for_organizer(event_id)
+        if error:
+            return error
+
+        data = request.get_json() or {}
+        subject = (data.get('subject') or '').strip()
+        message = (data.get('message') or '').strip()
+        if not subject or not message:
+            return error_response("Subject and message are required")
+        if len(subject) > 255:
+            return error_response("Subject must be at most 255 characters")
+
+        send_at = datetime.utcnow()
+        if data.get('send_at'):
+            try:
+                send_at = datetime.fromisoformat(data['send_at'].replace('Z', '+00:00'))
+            except ValueError:
+                return error_response("Invalid datetime format")
+            if send_at.tzinfo:
+                send_at = send_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+        try:
+            mailing = EventMailing(
+                event_id=event.id,
+                created_by=get_jwt_identity(),
+                subject=subject,
+                message=message,
+                send_at=send_at
+            )
+            db.session.add(mailing)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return error_response(f"Error scheduling mailing: {str(e)}", 500)
+
+        # Without Redis the relay queues it once Redis is back
+        mailing_queue.schedule(mailing.id, max((send_at - datetime.utcnow()).total_seconds(), 0))
+        return success_response(data=mailing.to_dict(), message="Mailing scheduled", status_code=201)
+
+class EventMailingResource(Resource):
+    @jwt_required()
+    def get(self, event_id, mailing_id):
+        """A mailing's progress"""
+        event, error = _event_for_organizer(event_id)
+        if error:
+            return error
+        mailing = EventMailing.query.filter_by(id=mailing_id, event_id=event.id).first()
+        if not mailing:
+            return error_response("Mailing not found", 404)
+        return success_response(data=mailing.to_dict())
+
+    @jwt_required()
+    def delete(self, event_id, mailing_id):
+        """Cancel a mailing. One being sent stops at its next checkpoint."""
+        event, error = _event_for_organizer(event_id)
+        if error:
+            return error
+        mailing = EventMailing.query.filter_by(id=mailing_id, event_id=event.id).first()
+        if not mailing:
+            return error_response("Mailing not found", 404)
+        if mailing.status not in ('scheduled', 'sending'):
+            return error_response(f"Mailing is already {mailing.status}", 400)
+        mailing.status = 'cancelled'
+        mailing.finished_at = datetime.utcnow()
+        db.session.commit()
+        return success_response(data=mailing.to_dict(), message="Mailing cancelled")
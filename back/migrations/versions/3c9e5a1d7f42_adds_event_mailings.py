@@ -0,0 +1,50 @@
+"""adds event mailings
+
+Revision ID: 3c9e5a1d7f42
+Revises: 8b4f0c3e7a21
+Create Date: 2026-10-18 17:40:21.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e5a1d7f42'
+down_revision = '8b4f0c3e7a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_mailings',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('event_id', sa.String(length=36), nullable=False),
+    sa.Column('created_by', sa.String(length=36), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('send_at', sa.DateTime(), nullable=False),
+    sa.Column('last_user_id', sa.String(length=36), nullable=True),
+    sa.Column('sent_count', sa.Integer(), nullable=False),
+    sa.Column('failed_count', sa.Integer(), nullable=False),
+    sa.Column('retries', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['event_id'], ['events.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('event_mailings', schema=None) as batch_op:
+        batch_op.create_index('ix_event_mailings_event_id', ['event_id'], unique=False)
+        batch_op.create_index('ix_event_mailings_status_send_at', ['status', 'send_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('event_mailings', schema=None) as batch_op:
+        batch_op.drop_index('ix_event_mailings_status_send_at')
+        batch_op.drop_index('ix_event_mailings_event_id')
+
+    op.drop_table('event_mailings')
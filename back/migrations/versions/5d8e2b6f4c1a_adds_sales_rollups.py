@@ -0,0 +1,47 @@
+"""adds sales rollups
+
+Revision ID: 5d8e2b6f4c1a
+Revises: a3c1f7d2b9e4
+Create Date: 2026-10-18 11:40:27.204915
+
+Fill the table afterwards with `flask rebuild-stats-rollups`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8e2b6f4c1a'
+down_revision = 'a3c1f7d2b9e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sales_rollups',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('period', sa.String(length=4), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('event_id', sa.String(length=36), nullable=False),
+    sa.Column('organizer_id', sa.String(length=36), nullable=False),
+    sa.Column('ticket_type_id', sa.String(length=36), nullable=False),
+    sa.Column('revenue', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.Column('tickets', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('period', 'bucket', 'event_id', 'ticket_type_id', name='uq_sales_rollups_bucket')
+    )
+    with op.batch_alter_table('sales_rollups', schema=None) as batch_op:
+        batch_op.create_index('ix_sales_rollups_period_bucket', ['period', 'bucket'], unique=False)
+        batch_op.create_index('ix_sales_rollups_organizer_id_period_bucket', ['organizer_id', 'period', 'bucket'], unique=False)
+        batch_op.create_index('ix_sales_rollups_event_id_period_bucket', ['event_id', 'period', 'bucket'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sales_rollups', schema=None) as batch_op:
+        batch_op.drop_index('ix_sales_rollups_event_id_period_bucket')
+        batch_op.drop_index('ix_sales_rollups_organizer_id_period_bucket')
+        batch_op.drop_index('ix_sales_rollups_period_bucket')
+
+    op.drop_table('sales_rollups')
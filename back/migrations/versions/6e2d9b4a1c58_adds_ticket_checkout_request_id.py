@@ -0,0 +1,30 @@
+"""adds the checkout request id to tickets
+
+Revision ID: 6e2d9b4a1c58
+Revises: 3c9e5a1d7f42
+Create Date: 2026-10-18 19:05:12.407311
+
+Tickets bought before this keep a NULL checkout_request_id and are settled
+through their payment's ticket_id as before.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2d9b4a1c58'
+down_revision = '3c9e5a1d7f42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('checkout_request_id', sa.String(length=100), nullable=True))
+        batch_op.create_index('ix_tickets_checkout_request_id', ['checkout_request_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.drop_index('ix_tickets_checkout_request_id')
+        batch_op.drop_column('checkout_request_id')
@@ -0,0 +1,49 @@
+"""adds indexes for hot queries
+
+Revision ID: a3c1f7d2b9e4
+Revises: 69e619999077
+Create Date: 2026-10-18 10:12:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c1f7d2b9e4'
+down_revision = '69e619999077'
+branch_labels = None
+depends_on = None
+
+# payments.transaction_id already has the index behind its unique constraint
+INDEXES = [
+    # event listing keyset pagination, featured events, organizer dashboards, admin growth
+    ('ix_events_start_datetime_id', 'events', ['start_datetime', 'id']),
+    ('ix_events_featured_start_datetime', 'events', ['featured', 'start_datetime']),
+    ('ix_events_organizer_id_start_datetime', 'events', ['organizer_id', 'start_datetime']),
+    ('ix_events_created_at', 'events', ['created_at']),
+    ('ix_event_categories_category_id', 'event_categories', ['category_id']),
+    ('ix_ticket_types_event_id_created_at', 'ticket_types', ['event_id', 'created_at']),
+    # per-event stats and ticket lists, admin stats, user tickets, pending cleanup
+    ('ix_tickets_event_id_purchase_date', 'tickets', ['event_id', 'purchase_date']),
+    ('ix_tickets_purchase_date', 'tickets', ['purchase_date']),
+    ('ix_tickets_attendee_id', 'tickets', ['attendee_id']),
+    ('ix_tickets_satus_purchase_date', 'tickets', ['satus', 'purchase_date']),
+    ('ix_tickets_ticket_type_id', 'tickets', ['ticket_type_id']),
+    ('ix_payments_ticket_id_payment_status', 'payments', ['ticket_id', 'payment_status']),
+    ('ix_payments_payment_status_payment_date', 'payments', ['payment_status', 'payment_date']),
+    ('ix_payments_payment_date', 'payments', ['payment_date']),
+]
+
+
+def upgrade():
+    # Built concurrently on Postgres so live tables keep taking writes
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
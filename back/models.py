@@ -161,6 +161,12 @@ class Attendee(db.Model):
 
 class Event(db.Model):
   __tablename__ = 'events'
+  __table_args__ = (
+    db.Index('ix_events_start_datetime_id', 'start_datetime', 'id'),
+    db.Index('ix_events_featured_start_datetime', 'featured', 'start_datetime'),
+    db.Index('ix_events_organizer_id_start_datetime', 'organizer_id', 'start_datetime'),
+    db.Index('ix_events_created_at', 'created_at'),
+  )
 
   id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
   organizer_id = db.Column(db.String(36), db.ForeignKey('organizers.id'), nullable=False)
@@ -183,7 +189,14 @@ class Event(db.Model):
   discount_codes = db.relationship('DiscountCode', secondary='event_discount_codes', backref=db.backref('events', lazy='dynamic'))
   ticket_types = db.relationship('TicketType', backref='event', lazy='dynamic')
   
-  def to_dict(self, include_organizer=False):
+  def to_dict(self, include_organizer=False, categories=None, ticket_types=None, organizer=None):
+    # categories / ticket_types / organizer can be passed in pre-fetched (see to_dict_many)
+    # to avoid a lazy load per event
+    if categories is None:
+      categories = self.categories
+    if ticket_types is None:
+      ticket_types = self.ticket_types
+
     event_dict = {
       'id': self.id,
       'organizer_id': self.organizer_id,
@@ -201,15 +214,60 @@ class Event(db.Model):
       'available_tickets': self.total_tickets - self.tickets_sold,
       'created_at': self.created_at.isoformat() if self.created_at else None,
       'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-      'categories': [category.to_dict() for category in self.categories],
-      'ticket_types': [ticket_type.to_dict() for ticket_type in self.ticket_types]
+      'categories': [category.to_dict() for category in categories],
+      'ticket_types': [ticket_type.to_dict() for ticket_type in ticket_types]
     }
     
     if include_organizer:
-      event_dict['organizer'] = self.organizer.to_dict()
+      event_dict['organizer'] = (organizer or self.organizer).to_dict()
         
     return event_dict
 
+  @staticmethod
+  def to_dict_many(events, include_organizer=False):
+    """Serialize a list of events with one grouped query per relationship instead of one per event"""
+    event_ids = [event.id for event in events]
+    if not event_ids:
+      return []
+
+    categories_by_event = {event_id: [] for event_id in event_ids}
+    category_rows = db.session.query(EventCategory.event_id, Category)\
+      .join(Category, Category.id == EventCategory.category_id)\
+      .filter(EventCategory.event_id.in_(event_ids))\
+      .all()
+    for event_id, category in category_rows:
+      categories_by_event[event_id].append(category)
+
+    ticket_types_by_event = {event_id: [] for event_id in event_ids}
+    ticket_types = TicketType.query\
+      .filter(TicketType.event_id.in_(event_ids))\
+      .order_by(TicketType.created_at)\
+      .all()
+    for ticket_type in ticket_types:
+      ticket_types_by_event[ticket_type.event_id].append(ticket_type)
+
+    organizers = {}
+    if include_organizer:
+      organizer_ids = {event.organizer_id for event in events}
+      # Organizer.to_dict falls back to the user's email/phone, so load users in the same query
+      organizers = {
+        organizer.id: organizer
+        for organizer in Organizer.query
+          .options(db.joinedload(Organizer.user))
+          .filter(Organizer.id.in_(organizer_ids))
+          .all()
+      }
+
+    return [
+      event.to_dict(
+        include_organizer=include_organizer,
+        categories=categories_by_event[event.id],
+        ticket_types=ticket_types_by_event[event.id],
+        organizer=organizers.get(event.organizer_id)
+      )
+      for event in events
+    ]
+
   def create_ticket_type(self, name, price, quantity, **kwargs):
     ticket_type = TicketType(
       event_id=self.id,
@@ -244,6 +302,9 @@ class Category(db.Model):
 
 class EventCategory(db.Model):
   __tablename__ = 'event_categories'
+  __table_args__ = (
+    db.Index('ix_event_categories_category_id', 'category_id'),
+  )
 
   event_id = db.Column(db.String(36), db.ForeignKey('events.id'), primary_key=True)
   category_id = db.Column(db.String(36), db.ForeignKey('categories.id'), primary_key=True)
@@ -251,6 +312,14 @@ class EventCategory(db.Model):
 
 class Ticket(db.Model):
   __tablename__ = 'tickets'
+  __table_args__ = (
+    db.Index('ix_tickets_event_id_purchase_date', 'event_id', 'purchase_date'),
+    db.Index('ix_tickets_purchase_date', 'purchase_date'),
+    db.Index('ix_tickets_attendee_id', 'attendee_id'),
+    db.Index('ix_tickets_satus_purchase_date', 'satus', 'purchase_date'),
+    db.Index('ix_tickets_ticket_type_id', 'ticket_type_id'),
+    db.Index('ix_tickets_checkout_request_id', 'checkout_request_id'),
+  )
 
   id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
   event_id = db.Column(db.String(36), db.ForeignKey('events.id'), nullable=False)
@@ -262,6 +331,9 @@ class Ticket(db.Model):
   qr_code = db.Column(db.String(40), unique=True, default=lambda: str(uuid.uuid4()))
   quantity = db.Column(db.Integer, nullable=True)
   ticket_type_id = db.Column(db.String(36), db.ForeignKey('ticket_types.id'), nullable=True)
+  # M-Pesa checkout the ticket was bought in, shared by the tickets of one purchase.
+  # Its payment row points at the first of them only.
+  checkout_request_id = db.Column(db.String(100), nullable=True)
   
   payments = db.relationship('Payment', back_populates='ticket', cascade="all, delete-orphan")
   def to_dict(self, include_event=False, include_attendee=True, include_payment=True, include_ticket_type=True):
@@ -330,6 +402,11 @@ class EventDiscountCode(db.Model):
 
 class Payment(db.Model):
   __tablename__ = 'payments'
+  __table_args__ = (
+    db.Index('ix_payments_ticket_id_payment_status', 'ticket_id', 'payment_status'),
+    db.Index('ix_payments_payment_status_payment_date', 'payment_status', 'payment_date'),
+    db.Index('ix_payments_payment_date', 'payment_date'),
+  )
 
   id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
   ticket_id = db.Column(db.String(36), db.ForeignKey('tickets.id', ondelete='CASCADE'), nullable=False)
@@ -361,6 +438,9 @@ class Payment(db.Model):
 
 class TicketType(db.Model):
     __tablename__ = 'ticket_types'
+    __table_args__ = (
+        db.Index('ix_ticket_types_event_id_created_at', 'event_id', 'created_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     event_id = db.Column(db.String(36), db.ForeignKey('events.id'), nullable=False)
@@ -405,7 +485,107 @@ class TicketType(db.Model):
         }    
 
     def is_available(self, quantity):
-        return self.quantity - self.tickets_sold >= quantity    
-    
+        return self.quantity - self.tickets_sold >= quantity
+
+class SalesRollup(db.Model):
+  """Completed ticket sales pre-aggregated per ticket type, per hour and per day.
+
+  One row per (period, bucket, event, ticket type), where period is 'hour' or
+  'day' and bucket is the start of the hour or day the tickets were bought.
+  Kept up to date by rollups.record_sales when a payment completes.
+  """
+  __tablename__ = 'sales_rollups'
+  __table_args__ = (
+    db.UniqueConstraint('period', 'bucket', 'event_id', 'ticket_type_id', name='uq_sales_rollups_bucket'),
+    db.Index('ix_sales_rollups_period_bucket', 'period', 'bucket'),
+    db.Index('ix_sales_rollups_organizer_id_period_bucket', 'organizer_id', 'period', 'bucket'),
+    db.Index('ix_sales_rollups_event_id_period_bucket', 'event_id', 'period', 'bucket'),
+  )
+
+  id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+  period = db.Column(db.String(4), nullable=False)
+  bucket = db.Column(db.DateTime, nullable=False)
+  # No foreign keys: sales history outlives deleted events
+  event_id = db.Column(db.String(36), nullable=False)
+  organizer_id = db.Column(db.String(36), nullable=False)
+  ticket_type_id = db.Column(db.String(36), nullable=False, default='')  # '' for tickets without a type
+  revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+  tickets = db.Column(db.Integer, nullable=False, default=0)
+  quantity = db.Column(db.Integer, nullable=False, default=0)
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EmailOutbox(db.Model):
+  """Emails waiting to be sent, one row per (kind, ticket).
+
+  Rows are added in the same transaction as the change that calls for the
+  email (a completed payment for 'ticket' emails) and sent afterwards by
+  cash.email_queue, so a rolled back change never sends one and a crash
+  after the commit never loses one.
+  """
+  __tablename__ = 'email_outbox'
+  __table_args__ = (
+    db.UniqueConstraint('kind', 'ticket_id', name='uq_email_outbox_kind_ticket_id'),
+    db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+  )
+
+  id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+  kind = db.Column(db.String(20), nullable=False, default='ticket')
+  ticket_id = db.Column(db.String(36), db.ForeignKey('tickets.id', ondelete='CASCADE'), nullable=False)
+  status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'sent', 'failed'
+  attempts = db.Column(db.Integer, nullable=False, default=0)
+  next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+  last_error = db.Column(db.Text, nullable=True)
+  created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+  sent_at = db.Column(db.DateTime, nullable=True)
+
+  ticket = db.relationship('Ticket')
+
+
+class EventMailing(db.Model):
+  """A message from an organizer to everyone holding tickets for an event.
+
+  Sent by mailings.mailing_queue from send_at on, in order of user id.
+  last_user_id is the checkpoint: the last recipient handled, so a mailing
+  interrupted by a crash or a deploy resumes after it.
+  """
+  __tablename__ = 'event_mailings'
+  __table_args__ = (
+    db.Index('ix_event_mailings_status_send_at', 'status', 'send_at'),
+    db.Index('ix_event_mailings_event_id', 'event_id'),
+  )
+
+  id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+  event_id = db.Column(db.String(36), db.ForeignKey('events.id', ondelete='CASCADE'), nullable=False)
+  created_by = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+  subject = db.Column(db.String(255), nullable=False)
+  message = db.Column(db.Text, nullable=False)
+  status = db.Column(db.String(20), nullable=False, default='scheduled')  # 'scheduled', 'sending', 'sent', 'cancelled', 'failed'
+  send_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+  last_user_id = db.Column(db.String(36), nullable=True)
+  sent_count = db.Column(db.Integer, nullable=False, default=0)
+  failed_count = db.Column(db.Integer, nullable=False, default=0)
+  retries = db.Column(db.Integer, nullable=False, default=0)
+  last_error = db.Column(db.Text, nullable=True)
+  created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+  started_at = db.Column(db.DateTime, nullable=True)
+  finished_at = db.Column(db.DateTime, nullable=True)
 
+  event = db.relationship('Event')
 
+  def to_dict(self):
+    return {
+      'id': self.id,
+      'event_id': self.event_id,
+      'created_by': self.created_by,
+      'subject': self.subject,
+      'message': self.message,
+      'status': self.status,
+      'send_at': self.send_at.isoformat() if self.send_at else None,
+      'sent_count': self.sent_count,
+      'failed_count': self.failed_count,
+      'last_error': self.last_error,
+      'created_at': self.created_at.isoformat() if self.created_at else None,
+      'started_at': self.started_at.isoformat() if self.started_at else None,
+      'finished_at': self.finished_at.isoformat() if self.finished_at else None
+    }
@@ -0,0 +1,106 @@
+"""
+Shared HTTP client for the M-Pesa gateway.
+
+One pooled keep-alive session per process, explicit (connect, read)
+timeouts, retries with jittered exponential backoff for idempotent calls
+only, and a latency histogram per endpoint.
+"""
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import MPESA_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) seconds
+GATEWAY_TIMEOUT = (5, 30)
+# Upper bounds of the latency buckets, in milliseconds (the last bucket is open)
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.errors = 0
+
+    def observe(self, elapsed_ms, error=False):
+        self.counts[bisect_left(self.buckets, elapsed_ms)] += 1
+        self.total += 1
+        self.sum_ms += elapsed_ms
+        if error:
+            self.errors += 1
+
+    def to_dict(self):
+        labels = [f"<={bound}ms" for bound in self.buckets] + [f">{self.buckets[-1]}ms"]
+        return {
+            'count': self.total,
+            'errors': self.errors,
+            'avg_ms': round(self.sum_ms / self.total, 1) if self.total else None,
+            'buckets': dict(zip(labels, self.counts))
+        }
+
+class GatewayClient:
+    def __init__(self, base_url, pool_size=20, timeout=GATEWAY_TIMEOUT, max_retries=2, backoff=0.5):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        # Retries are handled below so non-idempotent calls are never resent
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._latency = {}
+        self._latency_lock = threading.Lock()
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, idempotent=True, **kwargs)
+
+    def post(self, path, idempotent=False, **kwargs):
+        return self.request('POST', path, idempotent=idempotent, **kwargs)
+
+    def request(self, method, path, idempotent=False, **kwargs):
+        """Send a request to the gateway.
+
+        Idempotent calls are retried on connection errors, timeouts and
+        RETRY_STATUSES. Others are sent exactly once.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        for attempt in range(1, attempts + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._observe(path, start, error=True)
+                if attempt == attempts:
+                    raise
+                logger.warning(f"Gateway {method} {path} failed (attempt {attempt}): {str(e)}")
+            else:
+                self._observe(path, start, error=response.status_code >= 500)
+                if response.status_code not in RETRY_STATUSES or attempt == attempts:
+                    return response
+                logger.warning(f"Gateway {method} {path} returned {response.status_code} (attempt {attempt})")
+            # Full jitter
+            time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    def _observe(self, path, start, error=False):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._latency_lock:
+            self._latency.setdefault(path, LatencyHistogram()).observe(elapsed_ms, error)
+
+    def latency_stats(self):
+        """Per-endpoint latency histograms for this process"""
+        with self._latency_lock:
+            return {path: histogram.to_dict() for path, histogram in self._latency.items()}
+
+mpesa_gateway = GatewayClient(MPESA_BASE_URL)
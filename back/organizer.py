@@ -2,9 +2,10 @@ from flask import request
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from database import db
-from models import User, Role, Organizer
+from models import User, Role, Organizer, Event
 from utils.response import success_response, error_response, paginate_response
 from utils.auth import admin_required
+from redis_client import redis_client
 from werkzeug.utils import secure_filename
 import cloudinary.uploader
 import cloudinary.utils
@@ -18,6 +19,10 @@ MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _organizer_event_ids(organizer_id):
+    # Event details embed the organizer, so these are invalidated along with the listings
+    return [event_id for event_id, in Event.query.with_entities(Event.id).filter_by(organizer_id=organizer_id)]
+
 class OrganizerListResource(Resource):
     """
     Resource for organizer list operations
@@ -157,6 +162,7 @@ class OrganizerResource(Resource):
             
         try:
             db.session.commit()
+            redis_client.invalidate_events_cache(_organizer_event_ids(organizer.id))
             return success_response(
                 data=organizer.to_dict(include_user=True),
                 message="Organizer updated successfully"
@@ -174,6 +180,7 @@ class OrganizerResource(Resource):
                 organizer.company_image = None
                 try:
                     db.session.commit()
+                    redis_client.invalidate_events_cache(_organizer_event_ids(organizer.id))
                 except Exception as e:
                     db.session.rollback()
                     return error_response("Failed to update company image in database", 500)
@@ -227,6 +234,7 @@ class OrganizerResource(Resource):
                 
                 try:
                     db.session.commit()
+                    redis_client.invalidate_events_cache(_organizer_event_ids(organizer.id))
                 except Exception as e:
                     db.session.rollback()
                     return error_response("Failed to save image URL to database", 500)
@@ -272,9 +280,12 @@ class OrganizerResource(Resource):
         if organizer_role and user.has_role('organizer'):
             user.roles.remove(organizer_role)
             
+        event_ids = _organizer_event_ids(organizer.id)
+            
         try:
             db.session.delete(organizer)
             db.session.commit()
+            redis_client.invalidate_events_cache(event_ids)
             return success_response(message="Organizer removed successfully")
         except Exception as e:
             db.session.rollback()
@@ -9,8 +9,15 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 from datetime import datetime, timedelta
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+from app2 import app
+from job_queue import DelayedJobQueue
 
-
+# Pending tickets older than this are abandoned purchases
+PENDING_TICKET_MAX_AGE = timedelta(minutes=10)
+CLEANUP_CHUNK_SIZE = 500
+CLEANUP_INTERVAL = 60  # seconds
+CLEANUP_JOB_ID = 'pending-tickets'
 
 
 class PaymentListResource(Resource):
@@ -25,7 +32,6 @@ class PaymentListResource(Resource):
         
         if not user.has_role('admin'):
             return error_response("Unauthorized", 403)
-        cleanup_pending_tickets_and_payments()
         # Build query
         query = Payment.query
         
@@ -82,52 +88,53 @@ class PaymentListResource(Resource):
             db.session.rollback()
             return error_response(f"Error creating payment: {str(e)}")
 
-def cleanup_pending_tickets_and_payments():
-    
+def cleanup_pending_tickets_and_payments(max_age=PENDING_TICKET_MAX_AGE, chunk_size=CLEANUP_CHUNK_SIZE):
+    """Delete tickets left pending for longer than max_age, with their payments.
+
+    Works through set-based DELETEs of at most chunk_size tickets, committing
+    each chunk, so no transaction holds many row locks. Returns
+    (tickets deleted, payments deleted).
+    """
+    cutoff = datetime.utcnow() - max_age
+    paid_ticket = aliased(Ticket)
+    ticket_count = 0
+    payment_count = 0
+
     try:
-        # Delete payments with null ticket IDs
-        null_ticket_payments = Payment.query.filter(
+        # Payments that lost their ticket
+        payment_count += Payment.query.filter(
             Payment.ticket_id == None
-        ).all()
-        
-        # Track counts for logging
-        null_ticket_payment_count = len(null_ticket_payments)
-        for payment in null_ticket_payments:
-            db.session.delete(payment)
+        ).delete(synchronize_session=False)
+        db.session.commit()
 
-        # Find pending tickets
-        pending_tickets = Ticket.query.filter(
-            Ticket.satus == 'pending'  # Fixed earlier typo
-        ).all()
+        while True:
+            # Served by ix_tickets_satus_purchase_date. A purchase's payment points at
+            # its first ticket only, so the other tickets of a paid checkout are kept too.
+            ticket_ids = [ticket_id for (ticket_id,) in db.session.query(Ticket.id).filter(
+                Ticket.satus == 'pending',
+                Ticket.purchase_date < cutoff,
+                ~Ticket.payments.any(Payment.payment_status == 'Completed'),
+                ~db.session.query(paid_ticket.id).filter(
+                    paid_ticket.checkout_request_id == Ticket.checkout_request_id,
+                    paid_ticket.payments.any(Payment.payment_status == 'Completed')
+                ).exists()
+            ).limit(chunk_size)]
+            if not ticket_ids:
+                break
 
-        ticket_count = len(pending_tickets)
-        payment_count = 0
+            # Payments first, for databases that don't cascade the delete
+            payment_count += Payment.query.filter(
+                Payment.ticket_id.in_(ticket_ids)
+            ).delete(synchronize_session=False)
+            ticket_count += Ticket.query.filter(
+                Ticket.id.in_(ticket_ids)
+            ).delete(synchronize_session=False)
+            db.session.commit()
 
-        # Delete payments associated with pending tickets
-        for ticket in pending_tickets:
-            # Find and delete pending payments for this ticket
-            pending_payments = Payment.query.filter(
-                and_(
-                    Payment.ticket_id == ticket.id,
-                    Payment.payment_status == 'Pending'
-                )
-            ).all()
-            
-            payment_count += len(pending_payments)
-            
-            # Delete associated payments first
-            for payment in pending_payments:
-                db.session.delete(payment)
-            
-            # Then delete the ticket
-            db.session.delete(ticket)
+        logging.info(f"Deleted {ticket_count} tickets pending since before {cutoff} "
+                     f"and {payment_count} associated payments.")
+        return ticket_count, payment_count
 
-        # Commit all changes
-        db.session.commit()
-        
-        logging.info(f"Deleted {null_ticket_payment_count} payments with null ticket IDs, "
-                     f"{ticket_count} pending tickets, and {payment_count} associated pending payments.")
-    
     except IntegrityError as e:
         db.session.rollback()
         logging.error(f"Integrity error during cleanup: {str(e)}")
@@ -138,6 +145,24 @@ def cleanup_pending_tickets_and_payments():
         logging.error(f"Unexpected error during cleanup of pending tickets and payments: {str(e)}")
         raise
 
+def cleanup_job(job_id, attempt):
+    """Run by cleanup_queue every CLEANUP_INTERVAL seconds"""
+    try:
+        with app.app_context():
+            cleanup_pending_tickets_and_payments()
+    except Exception:
+        pass  # Logged by the cleanup, the next run tries again
+    finally:
+        with app.app_context():
+            db.session.remove()
+    return CLEANUP_INTERVAL
+
+cleanup_queue = DelayedJobQueue('cleanup', cleanup_job, workers=1)
+
+def schedule_cleanup():
+    """Queue the periodic cleanup unless it is already queued"""
+    cleanup_queue.schedule(CLEANUP_JOB_ID, 0, replace=False)
+
 class PaymentResource(Resource):
     """
     Resource for individual payment operations
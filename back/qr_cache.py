@@ -0,0 +1,217 @@
+"""
+Content-addressed cache of rendered QR codes.
+
+A QR image only depends on what it encodes and how it is rendered, so the
+image is stored under a hash of both. Entries live in Redis (shared between
+processes, base64 encoded, expiring after QR_CACHE_TTL) and in a per-host
+directory on disk that is trimmed least recently used first once it grows
+past QR_DISK_MAX_BYTES. Either store works without the other.
+
+Keys:
+    qr:<sha256 of payload and settings>   base64 PNG or SVG
+
+Ticket QR codes are rendered in the background when the tickets are created
+(see prerender_ticket_qrs), so the confirmation email, resends and downloads
+read them from the cache instead of rendering in the request thread. Misses
+are rendered on the process pool in qr_render.py. To warm the cache for all
+tickets of an event before a bulk resend:
+
+    flask prerender-ticket-qrs <event_id>
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+
+import click
+from flask.cli import with_appcontext
+
+from config2 import Config2
+from database import db
+from job_queue import DelayedJobQueue
+from models import Ticket
+from qr_render import QR_SETTINGS, qr_renderer
+from redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+QR_CACHE_TTL = 30 * 24 * 3600  # seconds
+QR_DISK_DIR = os.getenv('QR_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fest-qr'))
+QR_DISK_MAX_BYTES = 64 * 1024 * 1024
+PRERENDER_BATCH_SIZE = 100
+
+def ticket_qr_payload(ticket_id):
+    """What a ticket's QR code encodes: its verification URL"""
+    return f"{Config2.BASE_URL}/verify/ticket/{ticket_id}"
+
+def qr_digest(payload, settings=QR_SETTINGS):
+    return hashlib.sha256(json.dumps([payload, settings], sort_keys=True).encode()).hexdigest()
+
+class DiskStore:
+    """Files under a directory, trimmed least recently used first.
+
+    Reads touch the file's mtime, so eviction order is by last use. The
+    total size is counted once per process and then tracked on writes; other
+    processes writing to the same directory are caught up with on the next
+    trim.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.qr")
+
+    def get(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Error reading cached QR {digest}: {str(e)}")
+            return None
+
+    def set(self, digest, data):
+        path = self._path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name so readers never see a partial file
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Error caching QR {digest} on disk: {str(e)}")
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._trim()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.qr'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def _trim(self):
+        # Down to 90% so a full cache isn't rescanned on every write
+        files = sorted(self._files())
+        self._size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+class QRCache:
+    def __init__(self, redis_manager, disk, ttl=QR_CACHE_TTL):
+        self._redis = redis_manager
+        self.disk = disk
+        self.ttl = ttl
+
+    def get(self, digest):
+        """Cached image bytes, or None"""
+        data = self.disk.get(digest)
+        if data is not None:
+            return data
+        client = self._redis.client
+        if client is None:
+            return None
+        try:
+            encoded = client.get(f"qr:{digest}")
+        except Exception as e:
+            logger.error(f"Error reading cached QR {digest}: {str(e)}")
+            return None
+        if not encoded:
+            return None
+        data = base64.b64decode(encoded)
+        self.disk.set(digest, data)
+        return data
+
+    def set(self, digest, data):
+        self.disk.set(digest, data)
+        client = self._redis.client
+        if client is None:
+            return
+        try:
+            client.set(f"qr:{digest}", base64.b64encode(data).decode('ascii'), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Error caching QR {digest}: {str(e)}")
+
+    def get_or_render(self, payload, settings=QR_SETTINGS):
+        """Image of payload's QR code, rendered only on a cache miss"""
+        return self.get_or_render_many([payload], settings)[0]
+
+    def get_or_render_many(self, payloads, settings=QR_SETTINGS):
+        """Images of the payloads' QR codes in order, the misses rendered as one batch"""
+        digests = [qr_digest(payload, settings) for payload in payloads]
+        images = [self.get(digest) for digest in digests]
+        missing = [i for i, image in enumerate(images) if image is None]
+        if missing:
+            rendered = qr_renderer.render_many([payloads[i] for i in missing], settings)
+            for i, image in zip(missing, rendered):
+                self.set(digests[i], image)
+                images[i] = image
+        return images
+
+qr_cache = QRCache(redis_client, DiskStore(QR_DISK_DIR, QR_DISK_MAX_BYTES))
+
+def prerender_job(job_id, attempt):
+    """Run by prerender_queue, renders a batch of tickets' QR codes into the
+    cache. The job id is the comma separated ticket ids."""
+    qr_cache.get_or_render_many([ticket_qr_payload(ticket_id) for ticket_id in job_id.split(',')])
+
+prerender_queue = DelayedJobQueue('qr-prerender', prerender_job, workers=2, max_attempts=3)
+
+def prerender_ticket_qrs(ticket_ids):
+    """Render the tickets' QR codes in the background. Without Redis they are
+    rendered when first needed instead."""
+    ticket_ids = list(ticket_ids)
+    for start in range(0, len(ticket_ids), PRERENDER_BATCH_SIZE):
+        if not prerender_queue.schedule(','.join(ticket_ids[start:start + PRERENDER_BATCH_SIZE]), 0):
+            break
+
+@click.command('prerender-ticket-qrs')
+@click.argument('event_id')
+@with_appcontext
+def prerender_event_qrs(event_id):
+    """Render the QR codes of an event's purchased tickets into the cache"""
+    query = db.session.query(Ticket.id).filter(
+        Ticket.event_id == event_id,
+        Ticket.satus.in_(['purchased', 'used'])
+    ).yield_per(PRERENDER_BATCH_SIZE)
+    batch = []
+    count = 0
+    for (ticket_id,) in query:
+        batch.append(ticket_qr_payload(ticket_id))
+        if len(batch) == PRERENDER_BATCH_SIZE:
+            count += len(qr_cache.get_or_render_many(batch))
+            batch = []
+    if batch:
+        count += len(qr_cache.get_or_render_many(batch))
+    click.echo(f"{count} ticket QR codes cached")
@@ -0,0 +1,157 @@
+"""
+QR code rendering.
+
+Rendering is pure Python and holds the GIL for the whole image, so batches
+go to a process pool (qr_renderer) instead of stalling the threads serving
+requests.
+
+Images are drawn from the module matrix: PNGs as 1-bit palette images (two
+colours, about a tenth of the size of an RGB render), SVGs as a single path.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import qrcode
+from PIL import Image, ImageColor
+
+logger = logging.getLogger(__name__)
+
+ERROR_CORRECTION = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+def qr_settings(error_correction='H', box_size=10, border=4, fill_color='#1a1a1a', back_color='#ffffff', fmt='png'):
+    """Render settings. error_correction is 'L', 'M', 'Q' or 'H'; fmt is 'png' or 'svg'."""
+    if error_correction not in ERROR_CORRECTION:
+        raise ValueError(f"Unknown error correction level: {error_correction}")
+    if fmt not in ('png', 'svg'):
+        raise ValueError(f"Unknown QR format: {fmt}")
+    return {
+        'error_correction': error_correction,
+        'box_size': box_size,
+        'border': border,
+        'fill_color': fill_color,
+        'back_color': back_color,
+        'format': fmt,
+    }
+
+QR_SETTINGS = qr_settings()
+
+def _matrix(payload, settings):
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=ERROR_CORRECTION[settings['error_correction']],
+        border=settings['border'],
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.get_matrix()  # includes the border
+
+def _png(matrix, settings):
+    size = len(matrix)
+    img = Image.new('P', (size, size))
+    img.putpalette(ImageColor.getrgb(settings['back_color']) + ImageColor.getrgb(settings['fill_color']))
+    img.putdata([1 if dark else 0 for row in matrix for dark in row])
+    box_size = settings['box_size']
+    img = img.resize((size * box_size, size * box_size), Image.NEAREST)
+    buffer = BytesIO()
+    img.save(buffer, format="PNG", bits=1, optimize=True)
+    return buffer.getvalue()
+
+def _svg(matrix, settings):
+    # One path of horizontal runs of dark modules, in module units
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+    pixels = size * settings['box_size']
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="{settings["back_color"]}"/>'
+        f'<path fill="{settings["fill_color"]}" d="{"".join(runs)}"/></svg>'
+    ).encode()
+
+def render_qr(payload, settings=QR_SETTINGS):
+    """payload's QR code as PNG or SVG bytes, per settings['format']"""
+    matrix = _matrix(payload, settings)
+    if settings['format'] == 'svg':
+        return _svg(matrix, settings)
+    return _png(matrix, settings)
+
+def _render_chunk(payloads, settings):
+    return [render_qr(payload, settings) for payload in payloads]
+
+def _mp_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+class QRBatchRenderer:
+    """Renders batches of QR codes across cores on a process pool.
+
+    The pool is started on first use (again after a fork). Its workers are
+    fresh interpreters, from a forkserver that has only imported this module
+    (or spawned where there is no forkserver), never forks of the serving
+    process: that runs queue pollers, listeners and connection pools whose
+    held locks and sockets a fork would copy. The workers only need this
+    module, which doesn't import the app. (They also import the main module,
+    as multiprocessing does; app.py starts nothing on import.) Payloads are
+    sent in chunks of chunk_size to keep the pickling overhead down.
+    """
+    def __init__(self, workers=None, chunk_size=16):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                self._pid = os.getpid()
+            return self._executor
+
+    def render_many(self, payloads, settings=QR_SETTINGS):
+        """Render every payload, returns the images in the same order"""
+        payloads = list(payloads)
+        if not payloads:
+            return []
+        chunks = [payloads[i:i + self.chunk_size] for i in range(0, len(payloads), self.chunk_size)]
+        try:
+            pool = self._pool()
+            futures = [pool.submit(_render_chunk, chunk, settings) for chunk in chunks]
+            return [image for future in futures for image in future.result()]
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory); start a new pool next time
+            logger.error(f"QR render pool broke, rendering inline: {str(e)}")
+            with self._lock:
+                self._executor = None
+            return _render_chunk(payloads, settings)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+qr_renderer = QRBatchRenderer()
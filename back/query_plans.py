@@ -0,0 +1,109 @@
+"""
+Sequential scan check for hot queries.
+
+    flask check-query-plans
+
+EXPLAINs every query in hot_queries() and exits non-zero if any plan scans a
+whole table. On Postgres sequential scans are disabled for the check, so a
+Seq Scan in the plan means no index can serve the query at all rather than
+that the table is small. Add new hot-path queries to hot_queries() along
+with the index that serves them.
+"""
+import sys
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from database import db
+from models import EmailOutbox, Event, EventCategory, Payment, Ticket, TicketType
+from rollups import sales_window
+
+# Stand-in for ids and checkout request ids in the explained queries
+SAMPLE_ID = '00000000-0000-0000-0000-000000000000'
+
+def hot_queries():
+    """{name: query} shaped like the queries in events.py, stats.py, rollups.py, tickets.py, cash.py and payments.py"""
+    now = datetime.utcnow()
+    # Spans hourly and daily rows, like a stats time filter
+    sales = sales_window(now - timedelta(days=7))
+    organizer_sales = sales_window(now - timedelta(days=7), organizer_id=SAMPLE_ID)
+    return {
+        'events.upcoming_page': Event.query.filter(Event.start_datetime >= now)
+            .order_by(Event.start_datetime, Event.id).limit(21),
+        'events.past_page': Event.query.filter(Event.start_datetime < now)
+            .order_by(Event.start_datetime.desc(), Event.id.desc()).limit(21),
+        'events.featured': Event.query.filter(Event.featured == True, Event.start_datetime >= now)
+            .order_by(Event.start_datetime),
+        'events.by_organizer': Event.query.filter(Event.organizer_id == SAMPLE_ID),
+        'event_categories.by_category': EventCategory.query.filter(EventCategory.category_id == SAMPLE_ID),
+        'ticket_types.by_events': TicketType.query.filter(TicketType.event_id.in_([SAMPLE_ID]))
+            .order_by(TicketType.created_at),
+        'tickets.by_event': Ticket.query.filter(Ticket.event_id == SAMPLE_ID),
+        'tickets.by_attendee': Ticket.query.filter(Ticket.attendee_id == SAMPLE_ID),
+        'tickets.by_ticket_type': Ticket.query.filter(Ticket.ticket_type_id == SAMPLE_ID),
+        'tickets.by_checkout': Ticket.query.filter(Ticket.checkout_request_id.in_([SAMPLE_ID])),
+        'tickets.stale_pending': Ticket.query.filter(Ticket.satus == 'pending', Ticket.purchase_date < now),
+        'payments.by_checkout': Payment.query.filter(Payment.transaction_id == SAMPLE_ID),
+        'payments.pending_by_checkouts': Payment.query.filter(
+            Payment.transaction_id.in_([SAMPLE_ID]), Payment.payment_status == 'Pending'
+        ),
+        'payments.pending_by_ticket': Payment.query.filter(
+            Payment.ticket_id == SAMPLE_ID, Payment.payment_status == 'Pending'
+        ),
+        'payments.stale_pending': Payment.query.filter(Payment.payment_status == 'Pending', Payment.payment_date < now),
+        'payments.since': Payment.query.filter(Payment.payment_date >= now),
+        # The stats totals, read from hourly and daily rollup rows
+        'sales_rollups.window': db.session.query(func.sum(sales.c.revenue), func.sum(sales.c.tickets)),
+        'sales_rollups.organizer_window': db.session.query(
+            func.sum(organizer_sales.c.revenue), func.sum(organizer_sales.c.tickets)
+        ),
+        'email_outbox.due': EmailOutbox.query.filter(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at).limit(500),
+    }
+
+def _plan_lines(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        rows = connection.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params).fetchall()
+        return [row[0] for row in rows]
+    if connection.dialect.name == 'sqlite':
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).fetchall()
+        return [row[-1] for row in rows]
+    raise RuntimeError(f"Query plan check not supported on {connection.dialect.name}")
+
+def _is_full_scan(line, subqueries=()):
+    # Postgres: "Seq Scan on tickets"; SQLite: "SCAN tickets" (a SCAN ... USING INDEX walks an index,
+    # and SCAN <subquery> reads the rows of a CO-ROUTINE or MATERIALIZE step, not a table)
+    if 'Seq Scan' in line:
+        return True
+    return line.startswith('SCAN ') and 'USING' not in line and line.split()[1] not in subqueries
+
+def find_sequential_scans():
+    """{query name: plan lines} for each hot query whose plan scans a table"""
+    failures = {}
+    with db.engine.connect() as connection:
+        for name, query in hot_queries().items():
+            with connection.begin():
+                lines = _plan_lines(connection, query.statement)
+            lines = [line.strip() for line in lines]
+            subqueries = {line.split()[1] for line in lines if line.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+            if any(_is_full_scan(line, subqueries) for line in lines):
+                failures[name] = lines
+    return failures
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans():
+    """Fail if a hot query does a sequential scan"""
+    failures = find_sequential_scans()
+    for name, lines in failures.items():
+        click.echo(f"Sequential scan in {name}:")
+        for line in lines:
+            click.echo(f"    {line}")
+    if failures:
+        sys.exit(1)
+    click.echo(f"{len(hot_queries())} hot queries use indexes")
@@ -9,11 +9,72 @@ from redis.connection import ConnectionPool
 from redis.retry import Retry
 from redis.backoff import ExponentialBackoff
 import time
+import os
+import threading
+from collections import OrderedDict
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cache tag shared by every event listing key (events:all:*, events:featured:*)
+EVENT_LISTING_TAG = "events"
+
+def stats_cache_tag(organizer_id=None):
+    """Cache tag of the admin stats, or of one organizer's stats"""
+    return f"stats:organizer:{organizer_id}" if organizer_id else "stats:admin"
+
+class LocalCache:
+    """Bounded in-process LRU cache with a per-entry TTL.
+
+    Evicts least recently used entries once the summed size of the stored
+    JSON payloads exceeds max_bytes. Values are shared between callers and
+    must not be mutated.
+    """
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[2]
+
+    def set(self, key, value, size, ttl=None):
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl))
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (expires_at, size, value)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _pop(self, key):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._size -= item[1]
+
 class RedisManager:
     _instance = None
     _client = None
@@ -29,6 +90,13 @@ class RedisManager:
     def __init__(self):
         if not hasattr(self, 'initialized'):
             self.initialized = True
+            self.local_cache = LocalCache(Config.LOCAL_CACHE_MAX_BYTES, Config.LOCAL_CACHE_TTL)
+            self._subscriber = None
+            self._subscriber_pid = None
+            self._subscriber_lock = threading.Lock()
+            self._invalidations = 0
+            self._reconnect_callbacks = []
+            self._was_connected = False
             self.connect()
 
     def connect(self):
@@ -48,6 +116,9 @@ class RedisManager:
             # Test connection
             self._client.ping()
             logger.info("Successfully connected to Redis")
+            if self._was_connected:
+                self._run_reconnect_callbacks()
+            self._was_connected = True
             
         except redis.ConnectionError as e:
             logger.error(f"Failed to connect to Redis: {str(e)}")
@@ -70,6 +141,17 @@ class RedisManager:
         
         logger.error("All Redis reconnection attempts failed")
 
+    def on_reconnect(self, callback):
+        """Call callback() whenever the connection is re-established after being lost"""
+        self._reconnect_callbacks.append(callback)
+
+    def _run_reconnect_callbacks(self):
+        for callback in self._reconnect_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in Redis reconnect callback: {str(e)}")
+
     @property
     def client(self):
         if self._client is None:
@@ -87,18 +169,114 @@ class RedisManager:
             return getattr(self.client, name)
         raise AttributeError("Redis client not initialized")
 
+    def _ensure_subscriber(self):
+        """Start (once per process) the pub/sub listener that keeps the local cache coherent.
+
+        Returns True while the listener is running. Checked against the pid
+        because listener threads don't survive a gunicorn fork.
+        """
+        if self._subscriber_pid == os.getpid() and self._subscriber is not None and self._subscriber.is_alive():
+            return True
+        with self._subscriber_lock:
+            if self._subscriber_pid == os.getpid() and self._subscriber is not None and self._subscriber.is_alive():
+                return True
+            # Anything cached while no listener was running may have missed invalidations
+            self.local_cache.clear()
+            self._subscriber = None
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{Config.CACHE_INVALIDATION_CHANNEL: self._handle_invalidation})
+                self._subscriber = pubsub.run_in_thread(
+                    sleep_time=1,
+                    daemon=True,
+                    exception_handler=self._handle_subscriber_error
+                )
+                self._subscriber_pid = os.getpid()
+                return True
+            except Exception as e:
+                logger.error(f"Could not subscribe to cache invalidations: {str(e)}")
+                return False
+
+    def _handle_invalidation(self, message):
+        try:
+            tags = json.loads(message['data'])
+            self._invalidations += 1
+            self.local_cache.delete(*[f"cache:gen:{tag}" for tag in tags])
+        except Exception as e:
+            logger.error(f"Bad cache invalidation message: {str(e)}")
+
+    def _handle_subscriber_error(self, error, pubsub, thread):
+        # Stop the thread; the next cache read starts a fresh listener and clears the local cache
+        logger.error(f"Cache invalidation listener failed: {str(error)}")
+        thread.stop()
+        try:
+            pubsub.close()
+        except Exception:
+            pass
+
+    def tagged_key(self, key, tags):
+        """Append the current generation of each tag to key.
+
+        Bumping a tag (see bump_cache_tags) changes the key, so every entry
+        built from it misses immediately and the old ones age out via TTL.
+        Returns None when the generations can't be read, so callers skip caching.
+        """
+        if not self.client:
+            return None
+        generation_keys = [f"cache:gen:{tag}" for tag in tags]
+
+        # Generations are only served locally while the invalidation listener is running
+        use_local = self._ensure_subscriber()
+        generations = [self.local_cache.get(generation_key) for generation_key in generation_keys] if use_local else [None]
+        if None in generations:
+            invalidations = self._invalidations
+            try:
+                generations = [generation or '0' for generation in self.client.mget(generation_keys)]
+            except redis.RedisError as e:
+                logger.error(f"Redis error reading cache generations: {str(e)}")
+                return None
+            # Skip storing if an invalidation landed during the read, the values may predate it
+            if use_local and invalidations == self._invalidations:
+                for generation_key, generation in zip(generation_keys, generations):
+                    self.local_cache.set(generation_key, generation, len(generation_key) + len(generation))
+        return f"{key}@{'.'.join(generations)}"
+
+    def bump_cache_tags(self, *tags):
+        """Invalidate every key built from any of the given tags"""
+        if not self.client:
+            return False
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for tag in tags:
+                pipe.incr(f"cache:gen:{tag}")
+            pipe.publish(Config.CACHE_INVALIDATION_CHANNEL, json.dumps(tags))
+            pipe.execute()
+            # Don't wait for our own message to come back through the listener
+            self._invalidations += 1
+            self.local_cache.delete(*[f"cache:gen:{tag}" for tag in tags])
+            return True
+        except Exception as e:
+            logger.error(f"Error bumping cache tags {tags}: {str(e)}")
+            return False
+
     def get_cached_events(self, key):
         """Get cached events with the given key"""
         if not self.client:
             logger.warning("Redis client not initialized, cannot get cached events")
             return None
+        if not key:
+            return None
+        local_data = self.local_cache.get(key)
+        if local_data is not None:
+            return local_data
         try:
-            logger.info(f"Attempting to get cached data for key: {key}")
             cached_data = self.client.get(key)
             if cached_data:
-                logger.info(f"Cache hit for key: {key}")
-                return json.loads(cached_data)
-            logger.info(f"Cache miss for key: {key}")
+                logger.debug(f"Cache hit for key: {key}")
+                data = json.loads(cached_data)
+                self.local_cache.set(key, data, len(cached_data))
+                return data
+            logger.debug(f"Cache miss for key: {key}")
         except redis.RedisError as e:
             logger.error(f"Redis error getting cached events: {str(e)}")
             self._retry_connection()
@@ -111,26 +289,98 @@ class RedisManager:
         if not self.client:
             logger.warning("Redis client not initialized, cannot set cached events")
             return
+        if not key:
+            return
         try:
-            logger.info(f"Attempting to cache data for key: {key}")
-            self.client.setex(key, ttl, json.dumps(data))
-            logger.info(f"Successfully cached data for key: {key}")
+            cached_data = json.dumps(data)
+            self.client.setex(key, ttl, cached_data)
+            self.local_cache.set(key, data, len(cached_data), ttl)
+            logger.debug(f"Cached data for key: {key}")
         except redis.RedisError as e:
             logger.error(f"Redis error caching events: {str(e)}")
             self._retry_connection()
         except Exception as e:
             logger.error(f"Error caching events: {str(e)}")
 
-    def invalidate_event_cache(self, event_id):
-        if not self.is_connected():
-            return False
-        
+    def get_or_compute(self, key, compute, ttl=300, stale_ttl=60, lock_timeout=10, wait_timeout=5, should_cache=None):
+        """Return the cached value for key, recomputing it at most once across workers.
+
+        Entries stay readable for stale_ttl seconds after they go stale. While one
+        worker holds the rebuild lock and runs compute(), the others are served the
+        stale value, or poll for the fresh one if there is none yet (e.g. right
+        after a tag bump). compute() runs uncached if Redis is unavailable, and
+        its result isn't stored when should_cache(result) is false. Values are
+        stored as JSON, so compute() returns a response body, not a
+        (body, status) tuple, which would come back as a list.
+        """
+        if not self.client or not key:
+            return compute()
+
+        entry = self._get_entry(key)
+        if entry and entry['fresh_until'] > time.time():
+            return entry['data']
+
+        lock_name = f"rebuild:{key}"
+        if self.acquire_lock(lock_name, timeout=lock_timeout):
+            try:
+                data = compute()
+                if should_cache is None or should_cache(data):
+                    self._set_entry(key, data, ttl, stale_ttl)
+                return data
+            finally:
+                self.release_lock(lock_name)
+
+        if entry:
+            logger.info(f"Serving stale data for key: {key}")
+            return entry['data']
+
+        deadline = time.time() + wait_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = self._get_entry(key)
+            if entry:
+                return entry['data']
+
+        logger.warning(f"Timed out waiting for rebuild of key: {key}")
+        return compute()
+
+    def _get_entry(self, key):
+        # A fresh local copy saves the round trip; a stale one may already be rebuilt in Redis
+        entry = self.local_cache.get(key)
+        if entry is not None and entry['fresh_until'] > time.time():
+            return entry
         try:
-            key = f"event:{event_id}"
-            return self.client.delete(key) > 0
+            cached_data = self.client.get(key)
+            if not cached_data:
+                return None
+            entry = json.loads(cached_data)
+            self.local_cache.set(key, entry, len(cached_data), entry['fresh_until'] - time.time())
+            return entry
         except Exception as e:
-            logger.error(f"Error invalidating event cache {event_id}: {str(e)}")
-            return False
+            logger.error(f"Error getting cache entry {key}: {str(e)}")
+            return None
+
+    def _set_entry(self, key, data, ttl, stale_ttl):
+        try:
+            entry = {'data': data, 'fresh_until': time.time() + ttl}
+            cached_data = json.dumps(entry)
+            self.client.setex(key, ttl + stale_ttl, cached_data)
+            self.local_cache.set(key, entry, len(cached_data), ttl)
+        except Exception as e:
+            logger.error(f"Error setting cache entry {key}: {str(e)}")
+
+    def invalidate_event_cache(self, event_id):
+        """Invalidate one event's detail key and every event listing"""
+        return self.invalidate_events_cache([event_id])
+
+    def invalidate_events_cache(self, event_ids):
+        """Invalidate the detail keys of several events (e.g. all events of an
+        organizer or category) and every event listing, in one round trip"""
+        return self.bump_cache_tags(EVENT_LISTING_TAG, *[f"event:{event_id}" for event_id in event_ids])
+
+    def invalidate_stats_cache(self, organizer_ids=()):
+        """Invalidate the admin stats and the stats of the given organizers"""
+        return self.bump_cache_tags(stats_cache_tag(), *[stats_cache_tag(organizer_id) for organizer_id in organizer_ids])
 
     def acquire_lock(self, lock_name, timeout=30):
         """Acquire a distributed lock"""
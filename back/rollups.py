@@ -0,0 +1,151 @@
+"""
+Sales rollups for the stats dashboards.
+
+record_sales() adds completed tickets to their hour and day rows in
+sales_rollups, in the same transaction as the payment update. sales_window()
+reads a time window back as hourly rows for the leading partial day and
+daily rows after it, so stats queries read a number of rows bounded by the
+window rather than by the size of the tickets table.
+
+    flask rebuild-stats-rollups
+
+re-derives every row from the tickets of completed payments (run it once
+after the migration that creates the table).
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, text, union_all
+
+from database import db
+from models import Event, Payment, SalesRollup, Ticket
+
+PERIODS = ('hour', 'day')
+UPSERT_CHUNK = 500
+ROLLUP_LOCK_KEY = 7300114  # Postgres advisory lock key
+
+def _lock_rollups(exclusive=False):
+    """Lock the rollups until the end of the transaction. record_sales takes it
+    shared and rebuild_rollups exclusive, so a rebuild never interleaves with
+    a live sale. On SQLite the database write lock, which rebuild_rollups
+    takes by deleting first, does the same."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        function = 'pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'
+        db.session.execute(text(f"SELECT {function}(:key)"), {'key': ROLLUP_LOCK_KEY})
+
+def bucket_start(period, when):
+    if period == 'hour':
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _add_sale(totals, ticket, organizer_id):
+    when = ticket.purchase_date or datetime.utcnow()
+    for period in PERIODS:
+        key = (period, bucket_start(period, when), ticket.event_id, ticket.ticket_type_id or '')
+        row = totals.setdefault(key, {'organizer_id': organizer_id, 'revenue': 0, 'tickets': 0, 'quantity': 0})
+        row['revenue'] += ticket.price or 0
+        row['tickets'] += 1
+        row['quantity'] += ticket.quantity or 0
+
+def _upsert(totals):
+    """Add totals onto their rollup rows, inserting rows that don't exist yet"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Sales rollups not supported on {dialect}")
+
+    table = SalesRollup.__table__
+    now = datetime.utcnow()
+    rows = [{
+        'id': str(uuid.uuid4()),
+        'period': period,
+        'bucket': bucket,
+        'event_id': event_id,
+        'ticket_type_id': ticket_type_id,
+        'updated_at': now,
+        **values
+    } for (period, bucket, event_id, ticket_type_id), values in totals.items()]
+
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = insert(table).values(rows[start:start + UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['period', 'bucket', 'event_id', 'ticket_type_id'],
+            set_={
+                'revenue': table.c.revenue + stmt.excluded.revenue,
+                'tickets': table.c.tickets + stmt.excluded.tickets,
+                'quantity': table.c.quantity + stmt.excluded.quantity,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        db.session.execute(stmt)
+
+def record_sales(tickets):
+    """Add the tickets of completed payments to the rollups. Runs in the caller's
+    transaction. Returns the ids of the organizers whose stats changed."""
+    tickets = [ticket for ticket in tickets if ticket]
+    if not tickets:
+        return set()
+    _lock_rollups()
+    organizer_ids = dict(
+        db.session.query(Event.id, Event.organizer_id)
+        .filter(Event.id.in_({ticket.event_id for ticket in tickets}))
+    )
+    totals = {}
+    for ticket in tickets:
+        _add_sale(totals, ticket, organizer_ids.get(ticket.event_id, ''))
+    _upsert(totals)
+    return set(organizer_ids.values())
+
+def sales_window(since, organizer_id=None):
+    """Subquery of rollup rows for sales since `since`, hourly up to the first
+    midnight after it and daily from there on"""
+    first_day = bucket_start('day', since)
+    if first_day < since:
+        first_day += timedelta(days=1)
+
+    def rows(period, *conditions):
+        query = select(
+            SalesRollup.event_id,
+            SalesRollup.organizer_id,
+            SalesRollup.ticket_type_id,
+            SalesRollup.bucket,
+            SalesRollup.revenue,
+            SalesRollup.tickets,
+            SalesRollup.quantity
+        ).where(SalesRollup.period == period, *conditions)
+        if organizer_id:
+            query = query.where(SalesRollup.organizer_id == organizer_id)
+        return query
+
+    return union_all(
+        rows('hour', SalesRollup.bucket >= bucket_start('hour', since), SalesRollup.bucket < first_day),
+        rows('day', SalesRollup.bucket >= first_day)
+    ).subquery('sales')
+
+def rebuild_rollups(batch_size=1000):
+    """Re-derive all rollup rows from the tickets of completed payments, in one
+    transaction that holds off live sales until it commits"""
+    _lock_rollups(exclusive=True)
+    SalesRollup.query.delete()
+
+    totals = {}
+    query = db.session.query(Ticket, Event.organizer_id)\
+        .join(Event, Ticket.event_id == Event.id)\
+        .filter(Ticket.payments.any(Payment.payment_status == 'Completed'))\
+        .yield_per(batch_size)
+    for ticket, organizer_id in query:
+        _add_sale(totals, ticket, organizer_id)
+    _upsert(totals)
+    db.session.commit()
+    return len(totals)
+
+@click.command('rebuild-stats-rollups')
+@with_appcontext
+def rebuild_stats_rollups():
+    """Recompute the sales rollups from the tickets table"""
+    click.echo(f"Wrote {rebuild_rollups()} rollup rows")
@@ -1,16 +1,68 @@
 from flask_restful import Resource, reqparse
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Event, User, Ticket, Payment, TicketType, Category, Organizer
+from models import Event, User, Ticket, Payment, TicketType, Category, Organizer, SalesRollup
+from rollups import sales_window, bucket_start
 from utils.response import success_response, error_response
 from utils.auth import organizer_required, admin_required
 from datetime import datetime, timedelta
-from sqlalchemy import func, extract, case, and_, or_
-from flask import request
+from sqlalchemy import func, extract, case, and_, or_, text
+from sqlalchemy.orm import selectinload
+from flask import request, current_app
+from concurrent.futures import ThreadPoolExecutor, wait
 import logging
 
 from database import db
+from redis_client import redis_client, EVENT_LISTING_TAG, stats_cache_tag
+from mpesa_gateway import mpesa_gateway
+
+STATS_CACHE_TTL = 60  # seconds
+STATS_EVENTS_CACHE_TTL = 30
+
+def _cached_stats(key, tags, compute, ttl=STATS_CACHE_TTL, should_cache=None):
+    return redis_client.get_or_compute(
+        redis_client.tagged_key(key, tags), compute, ttl=ttl, stale_ttl=ttl // 2, should_cache=should_cache
+    )
+
+def _events_page(events_query, page, per_page):
+    paginated_events = events_query.paginate(page=page, per_page=per_page)
+    return {
+        "events": Event.to_dict_many(paginated_events.items),
+        "pagination": {
+            "page": paginated_events.page,
+            "pages": paginated_events.pages,
+            "per_page": paginated_events.per_page,
+            "total": paginated_events.total
+        }
+    }
+
+def _monthly_revenue(sales):
+    """Revenue per month of the current year, zero-filled, from a sales_window() subquery"""
+    year = datetime.now().year
+    monthly_revenue = dict(db.session.query(
+        extract('month', sales.c.bucket).label('month'),
+        func.sum(sales.c.revenue).label('revenue')
+    ).filter(
+        sales.c.bucket >= datetime(year, 1, 1)
+    ).group_by(
+        extract('month', sales.c.bucket)
+    ).all())
+    return _months(year, {int(month): revenue for month, revenue in monthly_revenue.items()})
+
+def _months(year, revenue_by_month):
+    """Zero-filled monthly revenue list from {month number: revenue}"""
+    return [{
+        'name': datetime(year, month_num, 1).strftime('%B'),
+        'revenue': float(revenue_by_month.get(month_num) or 0)
+    } for month_num in range(1, 13)]
 
 class StatsResource(Resource):
+    """Dashboard statistics. Sales figures (revenue, tickets, ticket types,
+    top events and organizers) are read from the sales rollups, see rollups.py.
+
+    Responses are cached per scope (admin or organizer) in two parts, the
+    aggregates per time_period and the events list per page. Both are
+    invalidated when a payment completes.
+    """
     @jwt_required()
     def get(self):
         try:
@@ -18,6 +70,8 @@ class StatsResource(Resource):
             page = request.args.get('page', 1, type=int)
             per_page = request.args.get('per_page', 10, type=int)
             time_period = request.args.get('time_period', 'all')  # 'week', 'month', 'year', 'all'
+            if time_period not in ('week', 'month', 'year'):
+                time_period = 'all'
             
             current_user_id = get_jwt_identity()
             user = User.query.get(current_user_id)
@@ -42,10 +96,10 @@ class StatsResource(Resource):
             
             if is_admin:
                 # Admin view - all events
-                return self._get_admin_stats(user, page, per_page, time_filter)
+                return self._get_admin_stats(user, page, per_page, time_period, time_filter)
             elif user.has_role('organizer'):
                 # Organizer view - only their events
-                return self._get_organizer_stats(user, page, per_page, time_filter)
+                return self._get_organizer_stats(user, page, per_page, time_period, time_filter)
             else:
                 return error_response("Unauthorized access", 403)
                 
@@ -53,7 +107,7 @@ class StatsResource(Resource):
             logging.error(f"Error in stats endpoint: {str(e)}")
             return error_response(f"Internal server error: {str(e)}", 500)
     
-    def _get_organizer_stats(self, user, page, per_page, time_filter):
+    def _get_organizer_stats(self, user, page, per_page, time_period, time_filter):
         """Generate statistics for organizer users"""
         try:
             # First, get the organizer record for this user
@@ -62,397 +116,434 @@ class StatsResource(Resource):
             if not organizer:
                 return error_response("Organizer profile not found", 404)
                 
-            # Query organizer's events with pagination
-            events_query = Event.query.filter(Event.organizer_id == organizer.id)
-            paginated_events = events_query.paginate(page=page, per_page=per_page)
-            
-            # Basic metrics for organizer
-            total_events = events_query.count()
-            
-            # Get revenue from tickets for organizer's events
-            total_revenue = db.session.query(func.sum(Ticket.price))\
-                .join(Event, Ticket.event_id == Event.id)\
-                .filter(Event.organizer_id == organizer.id)\
-                .filter(Ticket.purchase_date >= time_filter)\
-                .scalar() or 0
-                
-            # Get total tickets sold for organizer's events
-            total_tickets = db.session.query(func.count(Ticket.id))\
-                .join(Event, Ticket.event_id == Event.id)\
-                .filter(Event.organizer_id == organizer.id)\
-                .filter(Ticket.purchase_date >= time_filter)\
-                .scalar() or 0
-                
-            # Count active events for organizer
-            current_time = datetime.now()
-            active_events = events_query.filter(
-                Event.start_datetime <= current_time,
-                or_(Event.end_datetime == None, Event.end_datetime >= current_time)
-            ).count()
-            
-            # Upcoming events
-            upcoming_events = events_query.filter(
-                Event.start_datetime > current_time
-            ).count()
-            
-            # Past events
-            past_events = events_query.filter(
-                Event.end_datetime < current_time
-            ).count()
-            
-            # Calculate monthly revenue for the current year
-            monthly_revenue = db.session.query(
-                extract('month', Ticket.purchase_date).label('month'),
-                func.sum(Ticket.price).label('revenue')
-            ).join(
-                Event, Ticket.event_id == Event.id
-            ).filter(
-                Event.organizer_id == organizer.id,
-                extract('year', Ticket.purchase_date) == datetime.now().year
-            ).group_by(
-                extract('month', Ticket.purchase_date)
-            ).all()
-            
-            # Format monthly revenue
-            formatted_monthly_revenue = []
-            for month_num, revenue in monthly_revenue:
-                month_name = datetime(datetime.now().year, int(month_num), 1).strftime('%B')
-                formatted_monthly_revenue.append({
-                    'name': month_name,
-                    'revenue': float(revenue or 0)
-                })
-            
-            # Fill in missing months with zero values
-            month_dict = {item['name']: item for item in formatted_monthly_revenue}
-            for month_num in range(1, 13):
-                month_name = datetime(datetime.now().year, month_num, 1).strftime('%B')
-                if month_name not in month_dict:
-                    formatted_monthly_revenue.append({'name': month_name, 'revenue': 0.0})
-            
-            # Sort by month number
-            formatted_monthly_revenue.sort(key=lambda x: datetime.strptime(x['name'], '%B').month)
-            
-            # Get ticket types distribution
-            ticket_types = db.session.query(
-                TicketType.name.label('name'),
-                func.sum(Ticket.quantity).label('count')
-            ).join(
-                Ticket, TicketType.id == Ticket.ticket_type_id
-            ).join(
-                Event, TicketType.event_id == Event.id
-            ).filter(
-                Event.organizer_id == organizer.id,
-                Ticket.purchase_date >= time_filter
-            ).group_by(
-                TicketType.name
-            ).all()
-            
-            ticket_type_data = [{'name': name, 'value': int(count) if count else 0} for name, count in ticket_types]
-            
-            # Top performing events by revenue
-            top_events = db.session.query(
-                Event,
-                func.sum(Ticket.price).label('total_revenue'),
-                func.count(Ticket.id).label('ticket_count')
-            ).join(
-                Ticket, Event.id == Ticket.event_id
-            ).filter(
-                Event.organizer_id == organizer.id,
-                Ticket.purchase_date >= time_filter
-            ).group_by(
-                Event.id
-            ).order_by(
-                func.sum(Ticket.price).desc()
-            ).limit(5).all()
-            
-            # Format top events
-            top_events_data = []
-            for event, revenue, ticket_count in top_events:
-                if event.start_datetime <= current_time and (event.end_datetime is None or event.end_datetime >= current_time):
-                    status = 'active'
-                elif event.start_datetime > current_time:
-                    status = 'upcoming'
-                else:
-                    status = 'past'
-                    
-                top_events_data.append({
-                    'id': event.id,
-                    'name': event.title,
-                    'revenue': float(revenue or 0),
-                    'tickets': int(ticket_count or 0),
-                    'status': status,
-                    'start_date': event.start_datetime.strftime('%Y-%m-%d %H:%M') if event.start_datetime else None
-                })
-            
-            # Sales velocity (tickets sold per day) for the past week
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=7)
-            
-            daily_sales = db.session.query(
-                func.date(Ticket.purchase_date).label('date'),
-                func.count(Ticket.id).label('count')
-            ).join(
-                Event, Ticket.event_id == Event.id
-            ).filter(
-                Event.organizer_id == organizer.id,
-                Ticket.purchase_date >= start_date,
-                Ticket.purchase_date <= end_date
-            ).group_by(
-                func.date(Ticket.purchase_date)
-            ).all()
-            
-            # Format daily sales
-            daily_sales_data = []
-            current_date = start_date
-            
-            # Create a dictionary for quick lookup
-            sales_dict = {date_str: count for date_str, count in daily_sales}
-            
-            # Fill in all days, even those with no sales
-            while current_date <= end_date:
-                date_str = current_date.strftime('%Y-%m-%d')
-                daily_sales_data.append({
-                    'date': date_str,
-                    'count': sales_dict.get(date_str, 0)
-                })
-                current_date += timedelta(days=1)
-            
-            return {
-                "totalRevenue": float(total_revenue),
-                "totalTickets": total_tickets,
-                "totalEvents": total_events,
-                "activeEvents": active_events,
-                "upcomingEvents": upcoming_events,
-                "pastEvents": past_events,
-                "events": [event.to_dict() for event in paginated_events.items],
-                "pagination": {
-                    "page": paginated_events.page,
-                    "pages": paginated_events.pages,
-                    "per_page": paginated_events.per_page,
-                    "total": paginated_events.total
-                },
-                "monthlyRevenue": formatted_monthly_revenue,
-                "ticketTypes": ticket_type_data,
-                "topEvents": top_events_data,
-                "dailySales": daily_sales_data,
-                "averageTicketPrice": float(total_revenue) / total_tickets if total_tickets > 0 else 0,
-                "soldOutEvents": events_query.filter(Event.tickets_sold == Event.total_tickets).count(),
-                "conversionRate": {
-                    "message": "Conversion tracking requires integration with analytics",
-                    "value": None
-                }
-            }
+            tags = [stats_cache_tag(organizer.id)]
+            stats = _cached_stats(
+                f"stats:organizer:{organizer.id}:{time_period}",
+                tags,
+                lambda: self._organizer_aggregates(organizer.id, time_filter)
+            )
+            # Cached apart from the totals, so paging doesn't recompute them
+            events_page = _cached_stats(
+                f"stats:organizer:{organizer.id}:events:{page}:{per_page}",
+                tags + [EVENT_LISTING_TAG],
+                lambda: _events_page(Event.query.filter(Event.organizer_id == organizer.id), page, per_page),
+                ttl=STATS_EVENTS_CACHE_TTL
+            )
+            return {**stats, **events_page}
         except Exception as e:
             logging.error(f"Error in organizer stats: {str(e)}")
             return error_response(f"Error generating organizer statistics: {str(e)}", 500)
-    
-    def _get_admin_stats(self, user, page, per_page, time_filter):
-        """Generate statistics for admin users"""
-        try:
-            # Use aggregation queries instead of loading all records
-            total_revenue = db.session.query(func.sum(Ticket.price))\
-                .filter(Ticket.purchase_date >= time_filter)\
-                .scalar() or 0
-                
-            total_tickets = db.session.query(func.count(Ticket.id))\
-                .filter(Ticket.purchase_date >= time_filter)\
-                .scalar() or 0
-                
-            total_users = User.query.count()
-            total_events = Event.query.count()
-            
-            # Count active events using efficient SQL
-            current_time = datetime.now()
-            active_events = Event.query.filter(
-                Event.start_datetime <= current_time,
-                or_(Event.end_datetime == None, Event.end_datetime >= current_time)
-            ).count()
-            
-            # Calculate monthly revenue using SQL aggregation
-            monthly_revenue = db.session.query(
-                extract('month', Ticket.purchase_date).label('month'),
-                func.sum(Ticket.price).label('revenue')
-            ).filter(
-                extract('year', Ticket.purchase_date) == datetime.now().year,
-                Ticket.purchase_date >= time_filter
-            ).group_by(
-                extract('month', Ticket.purchase_date)
-            ).all()
-            
-            formatted_monthly_revenue = []
-            for month_num, revenue in monthly_revenue:
-                month_name = datetime(datetime.now().year, int(month_num), 1).strftime('%B')
-                formatted_monthly_revenue.append({
-                    'name': month_name,
-                    'revenue': float(revenue or 0)
-                })
-            
-            # Fill in missing months with zero values
-            month_dict = {item['name']: item for item in formatted_monthly_revenue}
-            for month_num in range(1, 13):
-                month_name = datetime(datetime.now().year, month_num, 1).strftime('%B')
-                if month_name not in month_dict:
-                    formatted_monthly_revenue.append({'name': month_name, 'revenue': 0.0})
-            
-            # Sort by month number
-            formatted_monthly_revenue.sort(key=lambda x: datetime.strptime(x['name'], '%B').month)
-            
-            # Paginate events for the response
-            paginated_events = Event.query.paginate(page=page, per_page=per_page)
-            
-            # Get event categories with counts
-            try:
-                event_categories = db.session.query(
-                    Category.name.label('category'),
-                    func.count(Event.id).label('count')
-                ).join(
-                    Event.categories
-                ).filter(
-                    Event.created_at >= time_filter
-                ).group_by(
-                    Category.name
-                ).all()
-                
-                category_data = [{'name': cat_name, 'value': count} for cat_name, count in event_categories]
-            except Exception as e:
-                logging.warning(f"Error fetching event categories: {str(e)}")
-                category_data = []  # Return empty list if categories can't be fetched
-            
-            # Get top 5 performing events by revenue
-            top_events_query = db.session.query(
-                Event,
-                func.sum(Ticket.price).label('total_revenue'),
-                func.count(Ticket.id).label('ticket_count')
-            ).join(
-                Ticket, Event.id == Ticket.event_id
-            ).filter(
-                Ticket.purchase_date >= time_filter
-            ).group_by(
-                Event.id
-            ).order_by(
-                func.sum(Ticket.price).desc()
-            ).limit(5)
-            
-            top_events = []
-            for event, revenue, ticket_count in top_events_query:
-                if event.start_datetime <= current_time and (event.end_datetime is None or event.end_datetime >= current_time):
-                    status = 'active'
-                elif event.start_datetime > current_time:
-                    status = 'upcoming'
-                else:
-                    status = 'past'
-                    
-                top_events.append({
-                    'id': event.id,
-                    'name': event.title,
-                    'organizer': event.organizer.company_name,
-                    'revenue': float(revenue or 0),
-                    'tickets': int(ticket_count or 0),
-                    'status': status
-                })
-            
-                # Top organizers by revenue
-            top_organizers = db.session.query(
-                    Organizer.id.label('organizer_id'),
-                    User.id.label('user_id'), 
-                    User.username.label('username'),
-                    Organizer.company_name.label('company_name'),
-                    func.sum(Ticket.price).label('total_revenue'),
-                    func.count(Ticket.id).label('ticket_count'),
-                    func.count(func.distinct(Event.id)).label('event_count')
-                ).select_from(Ticket).join(
-                    Event, Ticket.event_id == Event.id
-                ).join(
-                    Organizer, Event.organizer_id == Organizer.id
-                ).join(
-                    User, Organizer.user_id == User.id
-                ).filter(
-                    Ticket.purchase_date >= time_filter
-                ).group_by(
-                    Organizer.id, User.id, User.username, Organizer.company_name
-                ).order_by(
-                    func.sum(Ticket.price).desc()
-                ).limit(5).all()
 
-            top_organizers_data = [{
-                    'organizer_id': organizer_id,
-                    'user_id': user_id,
-                    'username': username,
-                    'company_name': company_name,
-                    'revenue': float(revenue or 0),
-                    'tickets_sold': int(tickets or 0),
-                    'events': int(events or 0)
-                } for organizer_id, user_id, username, company_name, revenue, tickets, events in top_organizers]
-            
-            # System growth - new users and events per month
-            new_users_monthly = db.session.query(
-                extract('month', User.created_at).label('month'),
-                func.count(User.id).label('count')
-            ).filter(
-                extract('year', User.created_at) == datetime.now().year
-            ).group_by(
-                extract('month', User.created_at)
-            ).all()
-            
-            new_events_monthly = db.session.query(
-                extract('month', Event.created_at).label('month'),
-                func.count(Event.id).label('count')
-            ).filter(
-                extract('year', Event.created_at) == datetime.now().year
-            ).group_by(
-                extract('month', Event.created_at)
-            ).all()
-            
-            
-            growth_data = []
-            for month_num in range(1, 13):
-                month_name = datetime(datetime.now().year, month_num, 1).strftime('%B')
-                user_count = next((count for m, count in new_users_monthly if int(m) == month_num), 0)
-                event_count = next((count for m, count in new_events_monthly if int(m) == month_num), 0)
-                growth_data.append({
-                    'month': month_name,
-                    'new_users': user_count,
-                    'new_events': event_count
-                })
-            
-            
-            payment_methods = db.session.query(
-                Payment.payment_method.label('method'),
-                func.count(Payment.id).label('count')
-            ).filter(
-                Payment.payment_date >= time_filter
-            ).group_by(
-                Payment.payment_method
-            ).all()
-            
-            payment_methods_data = [{
-                'method': method,
-                'count': count
-            } for method, count in payment_methods]
-            
-            return {
-                "totalRevenue": float(total_revenue),
-                "totalTickets": total_tickets,
-                "totalUsers": total_users,
-                "totalEvents": total_events,
-                "activeEvents": active_events,
-                "events": [event.to_dict() for event in paginated_events.items],
-                "pagination": {
-                    "page": paginated_events.page,
-                    "pages": paginated_events.pages,
-                    "per_page": paginated_events.per_page,
-                    "total": paginated_events.total
-                },
-                "monthlyRevenue": formatted_monthly_revenue,
-                "eventCategories": category_data,
-                "topEvents": top_events,
-                "topOrganizers": top_organizers_data,
-                "growthData": growth_data,
-                "paymentMethods": payment_methods_data,
-                "ticketsPerEvent": float(total_tickets) / total_events if total_events > 0 else 0,
-                "revenuePerEvent": float(total_revenue) / total_events if total_events > 0 else 0,
-                "revenuePerUser": float(total_revenue) / total_users if total_users > 0 else 0
+    def _organizer_aggregates(self, organizer_id, time_filter):
+        """Everything on the organizer dashboard except the events page, in three queries"""
+        current_time = datetime.now()
+        
+        # Event counts in one pass
+        is_active = and_(
+            Event.start_datetime <= current_time,
+            or_(Event.end_datetime == None, Event.end_datetime >= current_time)
+        )
+        event_counts = db.session.query(
+            func.count(Event.id),
+            func.sum(case((is_active, 1), else_=0)),
+            func.sum(case((Event.start_datetime > current_time, 1), else_=0)),
+            func.sum(case((Event.end_datetime < current_time, 1), else_=0)),
+            func.sum(case((Event.tickets_sold == Event.total_tickets, 1), else_=0))
+        ).filter(
+            Event.organizer_id == organizer_id
+        ).one()
+        total_events, active_events, upcoming_events, past_events, sold_out_events = (
+            int(count or 0) for count in event_counts
+        )
+        
+        # Sales in the period per event and ticket type, for the totals,
+        # the ticket types distribution and the top events
+        sales = sales_window(time_filter, organizer_id=organizer_id)
+        event_sales = db.session.query(
+            Event.id,
+            Event.title,
+            Event.start_datetime,
+            Event.end_datetime,
+            TicketType.name,
+            func.sum(sales.c.revenue),
+            func.sum(sales.c.tickets),
+            func.sum(sales.c.quantity)
+        ).select_from(sales).join(
+            Event, Event.id == sales.c.event_id
+        ).outerjoin(
+            TicketType, TicketType.id == sales.c.ticket_type_id
+        ).group_by(
+            Event.id, TicketType.name
+        ).all()
+        
+        total_revenue = 0
+        total_tickets = 0
+        ticket_type_counts = {}
+        events_by_id = {}
+        for event_id, title, start_datetime, end_datetime, type_name, revenue, tickets, quantity in event_sales:
+            total_revenue += revenue or 0
+            total_tickets += int(tickets or 0)
+            if type_name is not None:
+                ticket_type_counts[type_name] = ticket_type_counts.get(type_name, 0) + int(quantity or 0)
+            event = events_by_id.setdefault(event_id, {
+                'id': event_id,
+                'name': title,
+                'start_datetime': start_datetime,
+                'end_datetime': end_datetime,
+                'revenue': 0,
+                'tickets': 0
+            })
+            event['revenue'] += revenue or 0
+            event['tickets'] += int(tickets or 0)
+        
+        ticket_type_data = [{'name': name, 'value': count} for name, count in ticket_type_counts.items()]
+        
+        # Top performing events by revenue
+        top_events_data = []
+        for event in sorted(events_by_id.values(), key=lambda e: e['revenue'], reverse=True)[:5]:
+            start_datetime, end_datetime = event['start_datetime'], event['end_datetime']
+            if start_datetime <= current_time and (end_datetime is None or end_datetime >= current_time):
+                status = 'active'
+            elif start_datetime > current_time:
+                status = 'upcoming'
+            else:
+                status = 'past'
+                
+            top_events_data.append({
+                'id': event['id'],
+                'name': event['name'],
+                'revenue': float(event['revenue']),
+                'tickets': event['tickets'],
+                'status': status,
+                'start_date': start_datetime.strftime('%Y-%m-%d %H:%M') if start_datetime else None
+            })
+        
+        # Daily rows for this year and the past week, for the monthly
+        # revenue and the sales velocity (tickets sold per day)
+        end_date = current_time
+        start_date = end_date - timedelta(days=7)
+        year_start = datetime(current_time.year, 1, 1)
+        week_start = bucket_start('day', start_date)
+        
+        daily_sales = db.session.query(
+            SalesRollup.bucket,
+            func.sum(SalesRollup.revenue),
+            func.sum(SalesRollup.tickets)
+        ).filter(
+            SalesRollup.organizer_id == organizer_id,
+            SalesRollup.period == 'day',
+            SalesRollup.bucket >= min(year_start, week_start),
+            SalesRollup.bucket <= end_date
+        ).group_by(
+            SalesRollup.bucket
+        ).all()
+        
+        revenue_by_month = {}
+        sales_dict = {}
+        for day, revenue, tickets in daily_sales:
+            if day >= year_start:
+                revenue_by_month[day.month] = revenue_by_month.get(day.month, 0) + (revenue or 0)
+            if day >= week_start:
+                sales_dict[day.strftime('%Y-%m-%d')] = int(tickets or 0)
+        
+        # Fill in all days, even those with no sales
+        daily_sales_data = []
+        current_date = start_date
+        while current_date <= end_date:
+            date_str = current_date.strftime('%Y-%m-%d')
+            daily_sales_data.append({
+                'date': date_str,
+                'count': sales_dict.get(date_str, 0)
+            })
+            current_date += timedelta(days=1)
+        
+        return {
+            "totalRevenue": float(total_revenue),
+            "totalTickets": total_tickets,
+            "totalEvents": total_events,
+            "activeEvents": active_events,
+            "upcomingEvents": upcoming_events,
+            "pastEvents": past_events,
+            "monthlyRevenue": _months(current_time.year, revenue_by_month),
+            "ticketTypes": ticket_type_data,
+            "topEvents": top_events_data,
+            "dailySales": daily_sales_data,
+            "averageTicketPrice": float(total_revenue) / total_tickets if total_tickets > 0 else 0,
+            "soldOutEvents": sold_out_events,
+            "conversionRate": {
+                "message": "Conversion tracking requires integration with analytics",
+                "value": None
             }
+        }
+
+    def _get_admin_stats(self, user, page, per_page, time_period, time_filter):
+        """Generate statistics for admin users"""
+        try:
+            tags = [stats_cache_tag()]
+            # Partial results aren't cached, the next request tries again
+            stats = _cached_stats(
+                f"stats:admin:{time_period}",
+                tags,
+                lambda: self._admin_aggregates(time_filter),
+                should_cache=lambda stats: not stats["partial"]
+            )
+            # Cached apart from the totals, so paging doesn't recompute them
+            events_page = _cached_stats(
+                f"stats:admin:events:{page}:{per_page}",
+                tags + [EVENT_LISTING_TAG],
+                lambda: _events_page(Event.query, page, per_page),
+                ttl=STATS_EVENTS_CACHE_TTL
+            )
+            # Not cached: the M-Pesa latency histograms of the process serving the request
+            return {**stats, **events_page, "gatewayLatency": mpesa_gateway.latency_stats()}
         except Exception as e:
             logging.error(f"Error in admin stats: {str(e)}")
-            return error_response(f"Error generating admin statistics: {str(e)}", 500)
\ No newline at end of file
+            return error_response(f"Error generating admin statistics: {str(e)}", 500)
+
+    def _admin_aggregates(self, time_filter):
+        """Everything on the admin dashboard except the events page.
+
+        With STATS_CONCURRENT_QUERIES the groups run concurrently, see
+        _run_admin_groups(). Groups that fail or miss the deadline are left at
+        their empty values and named in "partial".
+        """
+        if current_app.config.get('STATS_CONCURRENT_QUERIES'):
+            results, partial = _run_admin_groups(time_filter)
+        else:
+            results = {name: group(time_filter) for name, (group, _) in ADMIN_GROUPS.items()}
+            partial = []
+
+        stats = {}
+        for name, (_, empty) in ADMIN_GROUPS.items():
+            stats.update(results.get(name, empty))
+
+        total_revenue = stats["totalRevenue"]
+        total_tickets = stats["totalTickets"]
+        total_events = stats["totalEvents"]
+        total_users = stats["totalUsers"]
+        return {
+            **stats,
+            "ticketsPerEvent": float(total_tickets) / total_events if total_events > 0 else 0,
+            "revenuePerEvent": float(total_revenue) / total_events if total_events > 0 else 0,
+            "revenuePerUser": float(total_revenue) / total_users if total_users > 0 else 0,
+            "partial": partial
+        }
+
+# Admin dashboard aggregate groups. They don't depend on each other, so each
+# one can run on its own connection.
+
+def _admin_totals(time_filter):
+    # Sales totals from the rollups instead of scanning tickets
+    sales = sales_window(time_filter)
+    total_revenue, total_tickets = db.session.query(
+        func.sum(sales.c.revenue), func.sum(sales.c.tickets)
+    ).one()
+    
+    # Count active events using efficient SQL
+    current_time = datetime.now()
+    active_events = Event.query.filter(
+        Event.start_datetime <= current_time,
+        or_(Event.end_datetime == None, Event.end_datetime >= current_time)
+    ).count()
+    
+    return {
+        "totalRevenue": float(total_revenue or 0),
+        "totalTickets": int(total_tickets or 0),
+        "totalUsers": User.query.count(),
+        "totalEvents": Event.query.count(),
+        "activeEvents": active_events
+    }
+
+def _admin_monthly_revenue(time_filter):
+    # Monthly revenue for the current year within the period
+    return {"monthlyRevenue": _monthly_revenue(
+        sales_window(max(time_filter, datetime(datetime.now().year, 1, 1)))
+    )}
+
+def _admin_categories(time_filter):
+    # Event categories with counts
+    try:
+        event_categories = db.session.query(
+            Category.name.label('category'),
+            func.count(Event.id).label('count')
+        ).join(
+            Event.categories
+        ).filter(
+            Event.created_at >= time_filter
+        ).group_by(
+            Category.name
+        ).all()
+        
+        category_data = [{'name': cat_name, 'value': count} for cat_name, count in event_categories]
+    except Exception as e:
+        logging.warning(f"Error fetching event categories: {str(e)}")
+        category_data = []  # Return empty list if categories can't be fetched
+    return {"eventCategories": category_data}
+
+def _admin_top_events(time_filter):
+    # Top 5 performing events by revenue
+    sales = sales_window(time_filter)
+    current_time = datetime.now()
+    top_events_query = db.session.query(
+        Event,
+        func.sum(sales.c.revenue).label('total_revenue'),
+        func.sum(sales.c.tickets).label('ticket_count')
+    ).options(
+        selectinload(Event.organizer)
+    ).join(
+        sales, Event.id == sales.c.event_id
+    ).group_by(
+        Event.id
+    ).order_by(
+        func.sum(sales.c.revenue).desc()
+    ).limit(5)
+    
+    top_events = []
+    for event, revenue, ticket_count in top_events_query:
+        if event.start_datetime <= current_time and (event.end_datetime is None or event.end_datetime >= current_time):
+            status = 'active'
+        elif event.start_datetime > current_time:
+            status = 'upcoming'
+        else:
+            status = 'past'
+            
+        top_events.append({
+            'id': event.id,
+            'name': event.title,
+            'organizer': event.organizer.company_name,
+            'revenue': float(revenue or 0),
+            'tickets': int(ticket_count or 0),
+            'status': status
+        })
+    return {"topEvents": top_events}
+
+def _admin_top_organizers(time_filter):
+    # Top organizers by revenue
+    sales = sales_window(time_filter)
+    top_organizers = db.session.query(
+        Organizer.id.label('organizer_id'),
+        User.id.label('user_id'), 
+        User.username.label('username'),
+        Organizer.company_name.label('company_name'),
+        func.sum(sales.c.revenue).label('total_revenue'),
+        func.sum(sales.c.tickets).label('ticket_count'),
+        func.count(func.distinct(sales.c.event_id)).label('event_count')
+    ).select_from(sales).join(
+        Organizer, sales.c.organizer_id == Organizer.id
+    ).join(
+        User, Organizer.user_id == User.id
+    ).group_by(
+        Organizer.id, User.id, User.username, Organizer.company_name
+    ).order_by(
+        func.sum(sales.c.revenue).desc()
+    ).limit(5).all()
+
+    return {"topOrganizers": [{
+        'organizer_id': organizer_id,
+        'user_id': user_id,
+        'username': username,
+        'company_name': company_name,
+        'revenue': float(revenue or 0),
+        'tickets_sold': int(tickets or 0),
+        'events': int(events or 0)
+    } for organizer_id, user_id, username, company_name, revenue, tickets, events in top_organizers]}
+
+def _admin_growth(time_filter):
+    # System growth - new users and events per month
+    new_users_monthly = db.session.query(
+        extract('month', User.created_at).label('month'),
+        func.count(User.id).label('count')
+    ).filter(
+        extract('year', User.created_at) == datetime.now().year
+    ).group_by(
+        extract('month', User.created_at)
+    ).all()
+    
+    new_events_monthly = db.session.query(
+        extract('month', Event.created_at).label('month'),
+        func.count(Event.id).label('count')
+    ).filter(
+        extract('year', Event.created_at) == datetime.now().year
+    ).group_by(
+        extract('month', Event.created_at)
+    ).all()
+    
+    growth_data = []
+    for month_num in range(1, 13):
+        month_name = datetime(datetime.now().year, month_num, 1).strftime('%B')
+        user_count = next((count for m, count in new_users_monthly if int(m) == month_num), 0)
+        event_count = next((count for m, count in new_events_monthly if int(m) == month_num), 0)
+        growth_data.append({
+            'month': month_name,
+            'new_users': user_count,
+            'new_events': event_count
+        })
+    return {"growthData": growth_data}
+
+def _admin_payment_methods(time_filter):
+    payment_methods = db.session.query(
+        Payment.payment_method.label('method'),
+        func.count(Payment.id).label('count')
+    ).filter(
+        Payment.payment_date >= time_filter
+    ).group_by(
+        Payment.payment_method
+    ).all()
+    
+    return {"paymentMethods": [{
+        'method': method,
+        'count': count
+    } for method, count in payment_methods]}
+
+# {name: (group, response values when it fails or times out)}
+ADMIN_GROUPS = {
+    'totals': (_admin_totals, {
+        "totalRevenue": 0.0, "totalTickets": 0, "totalUsers": 0, "totalEvents": 0, "activeEvents": 0
+    }),
+    'monthlyRevenue': (_admin_monthly_revenue, {"monthlyRevenue": _months(datetime.now().year, {})}),
+    'eventCategories': (_admin_categories, {"eventCategories": []}),
+    'topEvents': (_admin_top_events, {"topEvents": []}),
+    'topOrganizers': (_admin_top_organizers, {"topOrganizers": []}),
+    'growthData': (_admin_growth, {"growthData": []}),
+    'paymentMethods': (_admin_payment_methods, {"paymentMethods": []}),
+}
+
+def _run_group(app, group, time_filter, timeout):
+    # A new app context gets its own session, and so its own pooled connection
+    with app.app_context():
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # Cancel the query server side once the request has stopped waiting for it
+            db.session.execute(text(f"SET LOCAL statement_timeout = {max(int(timeout * 1000), 1)}"))
+        return group(time_filter)
+
+def _run_admin_groups(time_filter):
+    """Run ADMIN_GROUPS within STATS_QUERY_DEADLINE seconds, on a pool of
+    STATS_QUERY_WORKERS threads of this request's own, so concurrent requests
+    don't queue behind each other. (The stats cache computes each time period
+    once at a time, which bounds how many of these pools run at once.)
+    Returns ({name: values} of the groups that finished, [names of the groups
+    that didn't])"""
+    app = current_app._get_current_object()
+    deadline = app.config.get('STATS_QUERY_DEADLINE', 5)
+    executor = ThreadPoolExecutor(max_workers=app.config.get('STATS_QUERY_WORKERS', 4), thread_name_prefix='stats')
+    futures = {
+        executor.submit(_run_group, app, group, time_filter, deadline): name
+        for name, (group, _) in ADMIN_GROUPS.items()
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    # Groups still running finish on their own, their statement_timeout stops them
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = {}
+    partial = []
+    for future in not_done:
+        future.cancel()
+        logging.warning(f"Admin stats group {futures[future]} missed the {deadline}s deadline")
+        partial.append(futures[future])
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            logging.error(f"Error in admin stats group {futures[future]}: {str(e)}")
+            partial.append(futures[future])
+    return results, sorted(partial)
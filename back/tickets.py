@@ -6,6 +6,7 @@ from celery import current_task as self
 from database import db
 from models import Ticket, Event, User, Attendee, Payment, TicketType
 from utils.response import success_response, error_response
+from qr_cache import qr_cache, qr_digest, ticket_qr_payload
 
 import qrcode
 from sqlalchemy.orm import joinedload
@@ -134,6 +135,41 @@ class TicketVerificationResource(Resource):
             status_code=200
         )
 
+class TicketQRCodeResource(Resource):
+    """
+    Resource for downloading a ticket's QR code
+    """
+    @jwt_required()
+    def get(self, ticket_id):
+        """Get the ticket's QR code as a PNG, from the QR cache"""
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id)
+        
+        ticket = Ticket.query.get(ticket_id)
+        if not ticket:
+            return error_response("Ticket not found", 404)
+        
+        event = Event.query.get(ticket.event_id)
+        is_admin = user.has_role('admin')
+        is_organizer = event and user.has_role('organizer') and user.organizer and user.organizer.id == event.organizer_id
+        is_ticket_owner = user.attendee and user.attendee.id == ticket.attendee_id
+        
+        if not (is_admin or is_organizer or is_ticket_owner):
+            return error_response("Unauthorized", 403)
+        
+        # The digest identifies the image, so a client that has it needs no body
+        payload = ticket_qr_payload(ticket.id)
+        etag = qr_digest(payload)
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = make_response(qr_cache.get_or_render(payload))
+            response.headers['Content-Type'] = 'image/png'
+            response.headers['Content-Disposition'] = f'inline; filename="ticket_{ticket.id}.png"'
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, max-age=86400'
+        return response
+
 class UserTicketsResource(Resource):
     """
     Resource for user's tickets
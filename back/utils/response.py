@@ -1,4 +1,6 @@
 from flask import request, make_response
+import base64
+import json
 import math
 
 # Standardized success and error 
@@ -50,4 +52,29 @@ def paginate_response(query, schema=None, page=1, per_page=10):
                 "has_prev": paginated_query.has_prev
             }
         }
-    }, 200
\ No newline at end of file
+    }, 200
+
+# Opaque keyset cursors: url-safe base64 of a compact JSON payload
+def encode_cursor(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that did not come from encode_cursor
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid cursor")
+    return payload
+
+def cursor_response(items, next_cursor=None, per_page=None, message="Success"):
+    response, status_code = success_response(data=items, message=message)
+    response["pagination"] = {
+        "next_cursor": next_cursor,
+        "per_page": per_page,
+        "has_next": next_cursor is not None
+    }
+    return response, status_code
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
+import { fetchAllEvents } from '@/utils/fetchAllEvents';
 import { 
   Container, 
   Typography, 
@@ -57,10 +58,7 @@ const EventManagement = () => {
   const fetchEvents = async () => {
     try {
       setLoading(true);
-      const response = await axios.get(
-        `${import.meta.env.VITE_API_URL}/api/events`,
-        { withCredentials: true }
-      );
+      const response = await fetchAllEvents({}, { withCredentials: true });
       setEvents(response.data);
       setLoading(false);
     } catch (err) {
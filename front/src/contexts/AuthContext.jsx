@@ -1,6 +1,7 @@
 import { createContext, useContext, useState, useEffect } from "react";
 import axios from "axios";
 import { useNavigate } from "react-router-dom";
+import { fetchAllEvents } from "@/utils/fetchAllEvents";
 
 export const AuthContext = createContext({
   user: null,
@@ -192,17 +193,13 @@ export const AuthProvider = ({ children }) => {
       
       if (isadmin) {
         // admins can see all events
-        const response = await axios.get(
-          `${import.meta.env.VITE_API_URL}/api/events`,
-          { 
-            withCredentials: true,
-            headers: {
-              'Cache-Control': 'no-cache',
-              'Pragma': 'no-cache'
-            }
+        return await fetchAllEvents({}, {
+          withCredentials: true,
+          headers: {
+            'Cache-Control': 'no-cache',
+            'Pragma': 'no-cache'
           }
-        );
-        return response.data;
+        });
       } else {
         // For organizers, show only their events
         const organizer = await fetchOrganizerProfile();
@@ -210,17 +207,13 @@ export const AuthProvider = ({ children }) => {
           throw new Error("User is not an organizer");
         }
 
-        const response = await axios.get(
-          `${import.meta.env.VITE_API_URL}/api/events?organizer_id=${organizer.id}`,
-          { 
-            withCredentials: true,
-            headers: {
-              'Cache-Control': 'no-cache',
-              'Pragma': 'no-cache'
-            }
+        return await fetchAllEvents({ organizer_id: organizer.id }, {
+          withCredentials: true,
+          headers: {
+            'Cache-Control': 'no-cache',
+            'Pragma': 'no-cache'
           }
-        );
-        return response.data;
+        });
       }
     } catch (error) {
       console.error('Error fetching events:', error);
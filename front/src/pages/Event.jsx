@@ -7,6 +7,7 @@ import AnimatedSection from '@/components/AnimatedSection';
 import { Button } from "@/components/ui/button";
 import { Filter, Calendar, MapPin, AlertCircle } from 'lucide-react';
 import axios from 'axios';
+import { fetchAllEvents } from '@/utils/fetchAllEvents';
 import { useTheme } from '@/contexts/ThemeContext';
 import { Input } from "@/components/ui/input";
 import { Select, SelectTrigger, SelectValue, SelectContent, SelectItem } from "@/components/ui/select";
@@ -221,41 +222,39 @@ const Events = () => {
 
       console.log(`Fetching events from: ${import.meta.env.VITE_API_URL}/api/events?${queryParams.toString()}`);
 
-      const response = await axios.get(
-        `${import.meta.env.VITE_API_URL}/api/events?${queryParams.toString()}`,
-        { 
-          withCredentials: true,
-          headers: {
-            // Add Cache-Control header to prevent browser caching for showPastEvents toggle
-            ...(isPastEventsToggle ? { 'Cache-Control': 'no-cache' } : {})
-          }
+      // Every page of the listing, following next_cursor
+      const responseData = await fetchAllEvents(queryParams, {
+        withCredentials: true,
+        headers: {
+          // Add Cache-Control header to prevent browser caching for showPastEvents toggle
+          ...(isPastEventsToggle ? { 'Cache-Control': 'no-cache' } : {})
         }
-      );
+      });
 
       if (!mountedRef.current) return;
 
-      console.log('API Response:', response.data);
+      console.log('API Response:', responseData);
 
       // Handle different potential response structures
       let fetchedEvents = [];
       
-      if (Array.isArray(response.data)) {
-        // If response.data is an array, use it directly
-        fetchedEvents = response.data;
-      } else if (response.data && Array.isArray(response.data.data)) {
-        // If response.data.data is an array
-        fetchedEvents = response.data.data;
-      } else if (response.data && response.data[0] && response.data[0].data) {
+      if (Array.isArray(responseData)) {
+        // If responseData is an array, use it directly
+        fetchedEvents = responseData;
+      } else if (responseData && Array.isArray(responseData.data)) {
+        // If responseData.data is an array
+        fetchedEvents = responseData.data;
+      } else if (responseData && responseData[0] && responseData[0].data) {
         // Original structure expected
-        fetchedEvents = response.data[0].data;
-      } else if (response.data && typeof response.data === 'object') {
+        fetchedEvents = responseData[0].data;
+      } else if (responseData && typeof responseData === 'object') {
         // If data is an object with direct event properties
-        fetchedEvents = [response.data];
+        fetchedEvents = [responseData];
       }
       
       // Ensure fetchedEvents is always an array
       if (!Array.isArray(fetchedEvents)) {
-        console.error('Unexpected API response format:', response.data);
+        console.error('Unexpected API response format:', responseData);
         fetchedEvents = [];
       }
       
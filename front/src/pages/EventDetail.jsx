@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useParams, Link, useNavigate } from 'react-router-dom';
 import { 
   Calendar, 
@@ -47,6 +47,8 @@ const EventDetail = () => {
   const [selectedTickets, setSelectedTickets] = useState({});
   const [copySuccess, setCopySuccess] = useState(false);
   const [isPurchasing, setIsPurchasing] = useState(false);
+  // One key per purchase attempt, so a double submit doesn't start a second payment
+  const purchaseKeyRef = useRef(null);
   const [refreshAttempts, setRefreshAttempts] = useState(0);
   const maxRefreshAttempts = 3; // Maximum number of automatic refresh attempts
   const [isDataReady, setIsDataReady] = useState(false);
@@ -306,6 +308,10 @@ const EventDetail = () => {
         .replace(/^254/, '') // Remove existing 254 if present
         .padStart(9, '0'); // Ensure we have 9 digits after 254
 
+      if (!purchaseKeyRef.current) {
+        purchaseKeyRef.current = crypto.randomUUID();
+      }
+
       // Send purchase request
       const response = await axios.post(
         `${import.meta.env.VITE_API_URL}/api/events/${id}/purchase`,
@@ -317,10 +323,12 @@ const EventDetail = () => {
         {
           withCredentials: true,
           headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Idempotency-Key': purchaseKeyRef.current
           }
         }
       );
+      purchaseKeyRef.current = null;
 
       if (response.data?.message?.includes("Payment initiated successfully")) {
         toast({
@@ -337,6 +345,11 @@ const EventDetail = () => {
         setSelectedTickets(initialSelectedTickets);
       }
     } catch (error) {
+      if (error.response?.status === 409) {
+        // The same purchase is still being processed
+        return;
+      }
+      purchaseKeyRef.current = null;
       console.error("Error purchasing tickets:", error);
       let errorMessage = "Failed to purchase tickets. Please try again.";
       
@@ -0,0 +1,25 @@
+import axios from 'axios';
+
+const EVENTS_PAGE_SIZE = 100;
+
+// GET /api/events returns one page at a time: follow next_cursor to the last
+// page and return the response body with the events of every page in `data`.
+export const fetchAllEvents = async (params = {}, config = {}) => {
+  const query = new URLSearchParams(params);
+  query.set('per_page', EVENTS_PAGE_SIZE);
+  let events = [];
+  let body;
+  do {
+    const response = await axios.get(
+      `${import.meta.env.VITE_API_URL}/api/events?${query.toString()}`,
+      config
+    );
+    body = response.data;
+    events = events.concat(body?.data || []);
+    if (body?.pagination?.next_cursor) {
+      query.set('cursor', body.pagination.next_cursor);
+    }
+  } while (body?.pagination?.next_cursor);
+
+  return { ...body, data: events };
+};